@@ -0,0 +1,206 @@
+# Import AWS classes
+from aws import AWSDefault
+
+# Boto3 imports
+from botocore.exceptions import ClientError
+
+# Waiting subsystem
+from wait import WaitTimeout
+
+# Extra imports
+from datetime import datetime, timedelta, timezone
+import hashlib
+
+# Tag storing the hash of the base image and user data an AMI was baked from
+HASH_TAG = "UserDataHash"
+
+# Tag updated every time a cached AMI is reused (for LRU eviction)
+USED_TAG = "LastUsed"
+
+
+def content_hash(*parts: str):
+    return hashlib.sha256("\0".join(parts).encode()).hexdigest()[:16]
+
+
+def hash_tag(image: str, user_data: str):
+    return {"Key": HASH_TAG, "Value": content_hash(image, user_data)}
+
+
+def tag_value(resource: dict, key: str):
+    for tag in resource.get("Tags", []):
+        if tag["Key"] == key:
+            return tag["Value"]
+    return None
+
+
+class AMICache:
+    def __init__(
+        self,
+        aws: AWSDefault,
+        prefix: str,
+        max_images: int = 3,
+        max_age: timedelta = timedelta(days=30),
+    ):
+        self.aws = aws
+
+        # Cached AMIs are named <prefix>-<hash>
+        self.prefix = prefix
+
+        # Eviction policy
+        self.max_images = max_images
+        self.max_age = max_age
+
+    def key(self, base_image: str, user_data: str):
+        return content_hash(base_image, user_data)
+
+    def name(self, key: str):
+        return f"{self.prefix}-{key}"
+
+    def images(self):
+        # Lists every cached AMI owned by the account
+        return self.aws.client.describe_images(
+            Owners=["self"],
+            Filters=[
+                {"Name": "name", "Values": [f"{self.prefix}-*"]},
+                {"Name": "tag-key", "Values": [HASH_TAG]},
+            ],
+        )["Images"]
+
+    def find(self, images: list, key: str):
+        for image in images:
+            if tag_value(image, HASH_TAG) == key and image["State"] == "available":
+                return image
+        return None
+
+    def lookup(self, base_image: str, user_data: str):
+        image = self.find(self.images(), self.key(base_image, user_data))
+        if image:
+            self.touch(image["ImageId"])
+            return image["ImageId"]
+        return None
+
+    def touch(self, image_id: str):
+        # Marks the AMI as recently used
+        self.aws.client.create_tags(
+            Resources=[image_id],
+            Tags=[{"Key": USED_TAG, "Value": datetime.now(timezone.utc).isoformat()}],
+        )
+
+    def image_state(self, image_id: str):
+        return self.aws.client.describe_images(ImageIds=[image_id])["Images"][0][
+            "State"
+        ]
+
+    def last_used(self, image: dict):
+        used = tag_value(image, USED_TAG) or image["CreationDate"]
+        return datetime.fromisoformat(used.replace("Z", "+00:00"))
+
+    def bake(self, create, delete, base_image: str, user_data: str):
+        key = self.key(base_image, user_data)
+        print(f"\nAMI cache miss for {key}, baking a new image...")
+
+        # Bakes the AMI from a temporary instance, then removes the instance
+        image_id = create.bake_image(
+            img_id=base_image,
+            bake_script=user_data,
+            ami_name=self.name(key),
+            tags=[
+                {"Key": HASH_TAG, "Value": key},
+                {"Key": USED_TAG, "Value": datetime.now(timezone.utc).isoformat()},
+            ],
+        )
+        delete.delete_instances()
+
+        return image_id
+
+    def get_or_bake(self, create, delete, base_image: str, user_data: str):
+        image_id = self.lookup(base_image, user_data)
+        if image_id:
+            print(f"\nAMI cache hit, reusing {image_id}.")
+            create.ami_id = image_id
+        else:
+            image_id = self.bake(create, delete, base_image, user_data)
+
+        self.evict(keep=[image_id])
+        return image_id
+
+    def get_or_copy(self, create, source_region: str, source_image_id: str, key: str):
+        # Other regions reuse the baked AMI by copying it instead of baking again
+        image = self.find(self.images(), key)
+        if image:
+            print(f"\nAMI cache hit in {self.aws.region}, reusing {image['ImageId']}.")
+            self.touch(image["ImageId"])
+            create.ami_id = image["ImageId"]
+        else:
+            create.ami_id = self.copy(source_region, source_image_id, key)
+
+        self.evict(keep=[create.ami_id])
+        return create.ami_id
+
+    def copy(self, source_region: str, source_image_id: str, key: str):
+        print(
+            f"\nCopying AMI {source_image_id} from {source_region} to {self.aws.region}..."
+        )
+        try:
+            image_id = self.aws.client.copy_image(
+                SourceImageId=source_image_id,
+                SourceRegion=source_region,
+                Name=self.name(key),
+            )["ImageId"]
+
+            # Copies don't keep the tags, so the cache tags are added again
+            self.aws.client.create_tags(
+                Resources=[image_id],
+                Tags=[
+                    {"Key": HASH_TAG, "Value": key},
+                    {"Key": USED_TAG, "Value": datetime.now(timezone.utc).isoformat()},
+                ],
+            )
+
+            self.aws.wait_until(
+                lambda: self.image_state(image_id) == "available",
+                name=f"AMI copy {image_id}",
+            )
+            print(f"AMI {image_id} is available in {self.aws.region}.")
+
+            return image_id
+
+        except (ClientError, WaitTimeout) as c_error:
+            print(f"\nERROR: {c_error}")
+
+        return
+
+    def evict(self, keep: list = ()):
+        # Keeps the most recently used images, up to max_images and max_age
+        images = sorted(self.images(), key=self.last_used, reverse=True)
+        now = datetime.now(timezone.utc)
+        kept = 0
+
+        for image in images:
+            # A bake or copy_image may still be writing a pending image
+            if image["State"] != "available":
+                continue
+
+            if image["ImageId"] in keep:
+                kept += 1
+                continue
+
+            if kept < self.max_images and now - self.last_used(image) <= self.max_age:
+                kept += 1
+                continue
+
+            self.deregister(image)
+
+    def deregister(self, image: dict):
+        print(f"\nEvicting cached AMI {image['ImageId']} ({image['Name']})...")
+        try:
+            self.aws.client.deregister_image(ImageId=image["ImageId"])
+
+            # The snapshots behind the AMI keep costing storage until deleted
+            for mapping in image.get("BlockDeviceMappings", []):
+                snapshot_id = mapping.get("Ebs", {}).get("SnapshotId")
+                if snapshot_id:
+                    self.aws.client.delete_snapshot(SnapshotId=snapshot_id)
+
+        except ClientError as c_error:
+            print(f"\nERROR: {c_error}")
@@ -1,35 +1,52 @@
 # Boto3 imports
-import boto3
 from botocore.exceptions import ClientError
 
-# Extra imports
-from time import time
+# Shared boto3 clients
+from clients import ClientRegistry, registry
+
+# Cached network discovery
+from network import NetworkCache, network
+
+# IDs of the resources created, kept between runs
+from state import StateStore, store
+
+# Error classification for retries
+from ratelimit import classify
+
+# Waiting subsystem
+from wait import Waiter
 
 
 class AWSDefault:
     def __init__(
-        self, region: str, key_tags: dict, security_tags: dict, instance_tags: dict
+        self,
+        region: str,
+        key_tags: dict,
+        security_tags: dict,
+        instance_tags: dict,
+        waiter: Waiter = None,
+        clients: ClientRegistry = None,
+        network_cache: NetworkCache = None,
+        state_store: StateStore = None,
     ):
-        # Boto3 methods
-        self.client = boto3.client("ec2", region_name=region)
-        self.resource = boto3.resource("ec2", region_name=region)
-        self.load_balancer = boto3.client("elb", region_name=region)
-        self.autoscaling = boto3.client("autoscaling", region_name=region)
+        self.region = region
+
+        # Boto3 methods are built lazily and shared by every object in the region
+        self.clients = clients or registry
 
         # Tags (for filtering)
         self.key_tags = key_tags
         self.security_tags = security_tags
         self.instance_tags = instance_tags
 
-        # Subnets, VPC and zones
-        self.subnets = [
-            subnet["SubnetId"] for subnet in self.client.describe_subnets()["Subnets"]
-        ]
-        self.vpc_id = self.client.describe_vpcs().get("Vpcs", [{}])[0].get("VpcId", "")
-        self.zones = [
-            zone["ZoneName"]
-            for zone in self.client.describe_availability_zones()["AvailabilityZones"]
-        ]
+        # Waiter used by every polling loop
+        self.waiter = waiter or Waiter()
+
+        # Subnets, VPC and zones are only described when first used
+        self.network = network_cache or network
+
+        # Created resources are recorded so deletes don't have to find them
+        self.store = state_store or store
 
         # Variables used to save values for later
         self.ami_id = None
@@ -37,8 +54,167 @@ class AWSDefault:
         self.key_pair_name = None
         self.sec_group_id = None
 
-    def stopwatch(self, t):
-        t0 = time()
-        t1 = time()
-        while t1 - t0 <= t:
-            t1 = time()
\ No newline at end of file
+    @property
+    def client(self):
+        return self.clients.client("ec2", self.region)
+
+    @property
+    def resource(self):
+        return self.clients.resource("ec2", self.region)
+
+    @property
+    def load_balancer(self):
+        return self.clients.client("elb", self.region)
+
+    @property
+    def autoscaling(self):
+        return self.clients.client("autoscaling", self.region)
+
+    @property
+    def network_key(self):
+        # The topology is cached per account and region, so switching profile
+        # or account doesn't reuse another account's VPC and subnets
+        return f"{self.clients.account(self.region)}:{self.region}"
+
+    @property
+    def subnets(self):
+        return self.network.get(
+            self.network_key,
+            "subnets",
+            lambda: [
+                subnet["SubnetId"]
+                for subnet in self.client.describe_subnets()["Subnets"]
+            ],
+        )
+
+    @property
+    def vpc_id(self):
+        return self.network.get(
+            self.network_key,
+            "vpc_id",
+            lambda: self.client.describe_vpcs().get("Vpcs", [{}])[0].get("VpcId", ""),
+        )
+
+    @property
+    def zones(self):
+        return self.network.get(
+            self.network_key,
+            "zones",
+            lambda: [
+                zone["ZoneName"]
+                for zone in self.client.describe_availability_zones()[
+                    "AvailabilityZones"
+                ]
+            ],
+        )
+
+    def refresh(self):
+        # Forgets the cached subnets, VPC and zones of the region
+        self.network.refresh(self.network_key)
+
+    def tag_filter(self, tags: dict):
+        return {"Name": f"tag:{tags['Key']}", "Values": [tags["Value"]]}
+
+    def known_and_tagged(self, kind: str, key: str, discover):
+        # IDs discovered by tag, plus the ones only the state store knows (e.g.
+        # a resource whose tags weren't written), and whether there are any of
+        # those, since they may no longer exist
+        tagged = discover()
+        known = [
+            known_id
+            for known_id in self.store.ids(self.region, kind, key) or []
+            if known_id not in tagged
+        ]
+        return known + tagged, bool(known)
+
+    def paginate(self, client, operation: str, key: str, **kwargs):
+        # Collects the items of every page returned by a describe call
+        items = []
+        for page in client.get_paginator(operation).paginate(**kwargs):
+            items.extend(page[key])
+        return items
+
+    def find_load_balancer(self, load_name: str):
+        # Describes a single LoadBalancer by name, None if it doesn't exist
+        try:
+            return self.load_balancer.describe_load_balancers(
+                LoadBalancerNames=[load_name]
+            )["LoadBalancerDescriptions"][0]
+
+        except ClientError as c_error:
+            if c_error.response["Error"]["Code"] == "LoadBalancerNotFound":
+                return None
+            raise
+
+    def find_launch_template(self, template_name: str):
+        # Default version of a launch template, None if the template doesn't exist
+        try:
+            return self.client.describe_launch_template_versions(
+                LaunchTemplateName=template_name, Versions=["$Default"]
+            )["LaunchTemplateVersions"][0]
+
+        except ClientError as c_error:
+            if (
+                c_error.response["Error"]["Code"]
+                == "InvalidLaunchTemplateName.NotFoundException"
+            ):
+                return None
+            raise
+
+    def list_load_balancers(self):
+        # Full listing, only needed when the name isn't known
+        return self.paginate(
+            self.load_balancer, "describe_load_balancers", "LoadBalancerDescriptions"
+        )
+
+    def wait_for_lb(self, load_name: str, state: str, timeout: float = None):
+        # Waits until the LoadBalancer "exists" or has been "deleted"
+        if state not in ("exists", "deleted"):
+            raise ValueError(f"Unknown LoadBalancer state {state}")
+
+        exists = state == "exists"
+        return self.wait_until(
+            lambda: (self.find_load_balancer(load_name) is not None) == exists,
+            name=f"LoadBalancer {load_name} ({state})",
+            timeout=timeout,
+        )
+
+    def polling(self, condition):
+        def check():
+            try:
+                return condition()
+
+            except ClientError as c_error:
+                # A throttled poll is just a poll that didn't succeed yet
+                if classify(c_error) in ("throttling", "transient"):
+                    return None
+                raise
+
+        return check
+
+    def wait_until(self, condition, name: str, timeout: float = None, handle=None):
+        return self.waiter.wait_until(
+            self.polling(condition), name=name, timeout=timeout, handle=handle
+        )
+
+    def attempt(self, method, **kwargs):
+        # One try of a call, wrapped in a tuple, None when it can be retried
+        def attempt():
+            try:
+                return (method(**kwargs),)
+
+            except ClientError as c_error:
+                if classify(c_error) == "fatal":
+                    raise
+                print(f"\nRetrying {getattr(method, '__name__', 'call')}: {c_error}")
+                return None
+
+        return attempt
+
+    def call(self, method, **kwargs):
+        # Retries throttling, dependency and transient errors with backoff,
+        # anything else is fatal and raised right away
+        return self.waiter.wait_until(
+            self.attempt(method, **kwargs),
+            name=getattr(method, "__name__", "API call"),
+        )[0]
@@ -0,0 +1,62 @@
+# Import AWS classes
+from aws import AWSDefault
+from aws_create import AWSCreate
+from aws_delete import AWSDelete
+
+# Extra imports
+import asyncio
+
+
+class AsyncAWSDefault:
+    # Coroutine versions of the blocking classes. Every method runs the sync
+    # body in a worker thread, so the two can't diverge: its waits go through
+    # the shared Waiter in that thread and the event loop stays free
+    sync_class = AWSDefault
+
+    def __init__(
+        self,
+        region: str,
+        key_tags: dict,
+        security_tags: dict,
+        instance_tags: dict,
+        **kwargs,
+    ):
+        object.__setattr__(
+            self,
+            "sync",
+            self.sync_class(
+                region=region,
+                key_tags=key_tags,
+                security_tags=security_tags,
+                instance_tags=instance_tags,
+                **kwargs,
+            ),
+        )
+
+    def __getattr__(self, name: str):
+        if name == "sync":
+            raise AttributeError(name)
+
+        # Attributes (region, client, ami_id...) are read from the blocking object
+        attr = getattr(self.sync, name)
+        if not callable(getattr(type(self.sync), name, None)):
+            return attr
+
+        # Methods run in a worker thread as coroutines
+        async def call(*args, **kwargs):
+            return await asyncio.to_thread(attr, *args, **kwargs)
+
+        return call
+
+    def __setattr__(self, name: str, value):
+        # Attributes set by callers (key_pair_name, sec_group_id...) are used
+        # by the sync bodies
+        setattr(self.sync, name, value)
+
+
+class AsyncAWSCreate(AsyncAWSDefault):
+    sync_class = AWSCreate
+
+
+class AsyncAWSDelete(AsyncAWSDefault):
+    sync_class = AWSDelete
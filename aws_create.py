@@ -5,9 +5,38 @@ from aws import AWSDefault
 import boto3
 from botocore.exceptions import ClientError
 
+# Waiting subsystem
+from wait import WaitTimeout
+
+# Scaling policy names
+from scaling import policy_targets
+
+# Endpoint cache read by client.py
+from network import endpoint_key
+
+# Postgres and PgBouncer configuration
+from database import options, postgres_port, replica_script
+
 # OS import for managing key pair files
 import os
 
+# Extra imports
+from base64 import b64encode
+
+
+def resolve_groups(permissions: list, group_id: str):
+    # Replaces the "self" group in ingress permissions with the actual group ID
+    resolved = []
+    for permission in permissions:
+        pairs = [
+            {**pair, "GroupId": group_id} if pair["GroupId"] == "self" else pair
+            for pair in permission.get("UserIdGroupPairs", [])
+        ]
+        resolved.append(
+            {**permission, "UserIdGroupPairs": pairs} if pairs else permission
+        )
+    return resolved
+
 
 class AWSCreate(AWSDefault):
     def generate_key_pair(self, keyname: str, filename: str):
@@ -17,13 +46,16 @@ class AWSCreate(AWSDefault):
             self.key_pair_name = keyname
 
             # Creates key pair via EC2 client
-            keypair = self.client.create_key_pair(
+            keypair = self.call(
+                self.client.create_key_pair,
                 KeyName=keyname,
                 TagSpecifications=[
                     {"ResourceType": "key-pair", "Tags": [self.key_tags]}
                 ],
             )
 
+            self.store.add(self.region, "key_pairs", self.key_tags["Value"], keyname)
+
             print("\nKey pair was generated successfully.")
             print(f"Name: {keyname}")
             print(f"ID: {keypair['KeyPairId']}")
@@ -57,7 +89,8 @@ class AWSCreate(AWSDefault):
         print(f"\nCreating new security group named {sec_group_name}...")
         try:
             # Creates security group via EC2 client
-            security_group = self.client.create_security_group(
+            security_group = self.call(
+                self.client.create_security_group,
                 Description="Security group created by Bruno",
                 GroupName=sec_group_name,
                 TagSpecifications=[
@@ -68,13 +101,21 @@ class AWSCreate(AWSDefault):
 
             # Stores security group id
             self.sec_group_id = security_group["GroupId"]
+            self.store.add(
+                self.region,
+                "security_groups",
+                self.security_tags["Value"],
+                self.sec_group_id,
+            )
             print(
                 f"Security group with ID {self.sec_group_id} using Vpc {self.vpc_id} created successfully."
             )
 
             # Configures security group ingress access
-            ingress = self.client.authorize_security_group_ingress(
-                GroupId=self.sec_group_id, IpPermissions=permissions
+            ingress = self.call(
+                self.client.authorize_security_group_ingress,
+                GroupId=self.sec_group_id,
+                IpPermissions=resolve_groups(permissions, self.sec_group_id),
             )
 
             print("Security group authorizations configured successfully.")
@@ -86,25 +127,31 @@ class AWSCreate(AWSDefault):
 
         return
 
-    def create_instance(self, img_id: str, user_data: str):
+    def create_instance(
+        self,
+        img_id: str,
+        user_data: str,
+        tags: list = None,
+        instance_type: str = "t2.micro",
+    ):
         print(
             f"\nCreating a new instance with image_id {img_id} using keypair {self.key_pair_name}..."
         )
 
         try:
-            # Creates a new waiter
-            instance_waiter = self.client.get_waiter("instance_status_ok")
-
             # Creates the instance via EC2 resource
             instance = self.resource.create_instances(
                 ImageId=img_id,
-                InstanceType="t2.micro",
+                InstanceType=instance_type,
                 KeyName=self.key_pair_name,
                 MaxCount=1,
                 MinCount=1,
                 SecurityGroupIds=[self.sec_group_id],
                 TagSpecifications=[
-                    {"ResourceType": "instance", "Tags": [self.instance_tags]}
+                    {
+                        "ResourceType": "instance",
+                        "Tags": [self.instance_tags] + (tags or []),
+                    }
                 ],
                 UserData=user_data,
             )
@@ -112,14 +159,22 @@ class AWSCreate(AWSDefault):
             # Saves the ID returned as a variable for easier referencing
             instance_id = instance[0].id
 
-            # Checks if instance was created and is running
-            instance_waiter.wait(InstanceIds=[instance_id])
+            # Recorded right away, so a failed wait can still be cleaned up
+            self.store.add(
+                self.region, "instances", self.instance_tags["Value"], instance_id
+            )
+
+            # Checks if instance was created and its status checks are ok
+            self.wait_until(
+                lambda: self.status_ok(instance_id),
+                name=f"instance {instance_id} status checks",
+            )
 
-            # Getting the instance's public IP address
+            # Getting the instance's public IP address (None without one)
             describe = self.client.describe_instances(InstanceIds=[instance_id])
-            instances = describe["Reservations"][0]["Instances"][0]
-            private_ip = instances["NetworkInterfaces"][0]["PrivateIpAddresses"][0]
-            public_ip = private_ip["Association"]["PublicIp"]
+            public_ip = describe["Reservations"][0]["Instances"][0].get(
+                "PublicIpAddress"
+            )
 
             print("Instance created successfully.")
             print(f"ID: {instance_id}")
@@ -130,43 +185,170 @@ class AWSCreate(AWSDefault):
 
             return public_ip
 
-        except ClientError as c_error:
+        except (ClientError, WaitTimeout) as c_error:
             print(f"\nERROR: {c_error}")
 
         return
 
-    def create_ami_image(self, ami_name: str):
+    def status_ok(self, instance_id: str):
+        # True once the instance and system status checks both passed
+        return any(
+            status["InstanceStatus"]["Status"] == "ok"
+            and status["SystemStatus"]["Status"] == "ok"
+            for status in self.client.describe_instance_status(
+                InstanceIds=[instance_id]
+            )["InstanceStatuses"]
+        )
+
+    def private_ip(self, instance_id: str):
+        describe = self.client.describe_instances(InstanceIds=[instance_id])
+        return describe["Reservations"][0]["Instances"][0]["PrivateIpAddress"]
+
+    def create_database(
+        self, img_id: str, database: dict, user_data: str, tags: list = None
+    ):
+        # Postgres primary (user_data comes from database.primary_script) and,
+        # optionally, a streaming read replica of it
+        database = options(database)
+        public_ip = self.create_instance(
+            img_id=img_id,
+            user_data=user_data,
+            tags=tags,
+            instance_type=database["instance_type"],
+        )
+
+        if not public_ip or not database["replica"]:
+            return public_ip
+
+        primary_id = self.instance_id
+        try:
+            # The replica copies the primary over the private network, the
+            # security group lets its own members reach the Postgres port
+            primary_ip = self.private_ip(primary_id)
+            print(
+                f"\nCreating read replica of {primary_id} ({primary_ip}:{postgres_port(database)})..."
+            )
+            replica_ip = self.create_instance(
+                img_id=img_id,
+                user_data=replica_script(database, primary_ip),
+                tags=[{"Key": "Role", "Value": "replica"}],
+                instance_type=database["instance_type"],
+            )
+            print(f"Read replica available at {replica_ip}.")
+
+        except ClientError as c_error:
+            print(f"\nERROR: {c_error}")
+
+        # The primary stays the instance the rest of the setup refers to
+        self.instance_id = primary_id
+
+        return public_ip
+
+    def create_ami_image(
+        self, ami_name: str, tags: list = None, no_reboot: bool = True
+    ):
         print(
             f"\nCreating an AMI with name {ami_name} from instance with ID {self.instance_id}"
         )
         try:
-            # Creates a new waiter
-            ami_waiter = self.client.get_waiter("image_available")
-
             # Creates the AMI image using EC2 client
-            ami_image = self.client.create_image(
-                InstanceId=self.instance_id, NoReboot=True, Name=ami_name
+            ami_image = self.call(
+                self.client.create_image,
+                InstanceId=self.instance_id,
+                NoReboot=no_reboot,
+                Name=ami_name,
+                TagSpecifications=(
+                    [{"ResourceType": "image", "Tags": tags}] if tags else []
+                ),
             )
 
+            self.store.add(self.region, "images", ami_name, ami_image["ImageId"])
+
             # Checks if AMI has been created
-            ami_waiter.wait(ImageIds=[ami_image["ImageId"]])
+            state = self.wait_until(
+                lambda: self.image_state(ami_image["ImageId"]),
+                name=f"AMI {ami_name}",
+            )
+            if state != "available":
+                print(f"\nERROR: AMI {ami_name} is {state}")
+                return
+
             print(f"AMI {ami_name} has been created successfully.")
 
             # Stores the ID as class variable
             self.ami_id = ami_image["ImageId"]
 
-        except ClientError as c_error:
+        except (ClientError, WaitTimeout) as c_error:
             print(f"\nERROR: {c_error}")
 
         return
 
+    def image_state(self, image_id: str):
+        # None while the AMI is pending, its state once it's available or failed
+        images = self.client.describe_images(ImageIds=[image_id])["Images"]
+        if images and images[0]["State"] in ("available", "failed"):
+            return images[0]["State"]
+        return None
+
+    def instance_state(self, instance_id: str):
+        describe = self.client.describe_instances(InstanceIds=[instance_id])
+        return describe["Reservations"][0]["Instances"][0]["State"]["Name"]
+
+    def bake_image(
+        self,
+        img_id: str,
+        bake_script: str,
+        ami_name: str,
+        tags: list = None,
+        instance_type: str = "t2.micro",
+        timeout: float = 1800,
+    ):
+        # Bake stage: installs everything on a temporary instance, which shuts
+        # itself down once the script succeeded, and images it stopped. The
+        # state works on every instance type, unlike the latest console output
+        # (Nitro only), and a stopped instance gives a consistent snapshot
+        print(f"\nBaking AMI {ami_name}...")
+        if not self.create_instance(
+            img_id=img_id, user_data=bake_script, instance_type=instance_type
+        ):
+            return
+
+        def finished():
+            # Stopped once the script succeeded, terminated if something removed it
+            state = self.instance_state(self.instance_id)
+            return state if state in ("stopped", "terminated") else None
+
+        try:
+            state = self.wait_until(
+                finished,
+                name=f"bake script on {self.instance_id} (instance stopped)",
+                timeout=timeout,
+            )
+
+        except WaitTimeout as c_error:
+            # A failed script leaves the instance running, see default.txt on it
+            print(f"\nERROR: {c_error}, the bake script failed or is still running")
+            return
+
+        except ClientError as c_error:
+            print(f"\nERROR: {c_error}")
+            return
+
+        if state != "stopped":
+            print(f"\nERROR: Bake instance {self.instance_id} is {state}")
+            return
+
+        self.create_ami_image(ami_name=ami_name, tags=tags)
+        return self.ami_id
+
     def create_load_balancer(
         self, load_name: str, security_group: dict, load_tags: dict
     ):
         print(f"\nCreating ElasticLoadBalancer with name {load_name}")
         try:
             # Creates the LoadBalancer via ELB client
-            load_balancer = self.load_balancer.create_load_balancer(
+            load_balancer = self.call(
+                self.load_balancer.create_load_balancer,
                 LoadBalancerName=load_name,
                 Listeners=[
                     {
@@ -180,71 +362,446 @@ class AWSCreate(AWSDefault):
                 Tags=[load_tags],
             )
 
-            # Checks if LoadBalancer has been created every 10s
-            created = False
-            while not created:
-                loadbalancers = self.load_balancer.describe_load_balancers()[
-                    "LoadBalancerDescriptions"
-                ]
-                for loadbalancer in loadbalancers:
-                    if loadbalancer["LoadBalancerName"] == load_name:
-                        created = True
+            # Polls until the LoadBalancer can be described by name
+            self.wait_for_lb(load_name, "exists")
 
-                self.stopwatch(10)
+            # Saves the new DNS name for client.py, replacing the old one
+            self.network.put(
+                self.region, endpoint_key(load_name), load_balancer["DNSName"]
+            )
+
+            # Shorter health check, so new instances are marked InService sooner
+            self.call(
+                self.load_balancer.configure_health_check,
+                LoadBalancerName=load_name,
+                HealthCheck={
+                    "Target": "TCP:8080",
+                    "Interval": 10,
+                    "Timeout": 5,
+                    "UnhealthyThreshold": 2,
+                    "HealthyThreshold": 2,
+                },
+            )
 
             print(f"ElasticLoadBalancer {load_name} created successfully")
 
-        except ClientError as c_error:
+            return load_name
+
+        except (ClientError, WaitTimeout) as c_error:
             print(f"\nERROR: {c_error}")
 
-    def create_launch_configuration(self, launch_name: str):
+    def create_launch_configuration(
+        self, launch_name: str, instance_type: str = "t2.micro", user_data: str = None
+    ):
         print(f"\nCreating launch configuration with name {launch_name}...")
         print(
             f"Configuration is using key pair {self.key_pair_name}, security group with ID {self.sec_group_id} and AMI with ID {self.ami_id}."
         )
         try:
             # Creates launch configuration using autoscaling client
-            launch_config = self.autoscaling.create_launch_configuration(
+            launch_config = self.call(
+                self.autoscaling.create_launch_configuration,
                 LaunchConfigurationName=launch_name,
                 ImageId=self.ami_id,
                 InstanceMonitoring={"Enabled": True},
-                InstanceType="t2.micro",
+                InstanceType=instance_type,
                 KeyName=self.key_pair_name,
                 SecurityGroups=[self.sec_group_id],
+                **({"UserData": user_data} if user_data else {}),
             )
 
             print(f"Launch configuration {launch_name} created successfully.")
 
+            return launch_name
+
         except ClientError as c_error:
             print(f"\nERROR: {c_error}")
 
-    def create_autoscaling(self, auto_name: str, launch_name: str, load_name: str):
+    def launch_template_data(
+        self, instance_type: str = "t2.micro", user_data: str = None
+    ):
+        data = {
+            "ImageId": self.ami_id,
+            "InstanceType": instance_type,
+            "KeyName": self.key_pair_name,
+            "SecurityGroupIds": [self.sec_group_id],
+            "Monitoring": {"Enabled": True},
+        }
+
+        # Launch templates take the user data already base64 encoded
+        if user_data:
+            data["UserData"] = b64encode(user_data.encode()).decode()
+        return data
+
+    def create_launch_template(
+        self, template_name: str, instance_type: str = "t2.micro", user_data: str = None
+    ):
+        print(f"\nCreating launch template with name {template_name}...")
+        print(
+            f"Template is using key pair {self.key_pair_name}, security group with ID {self.sec_group_id} and AMI with ID {self.ami_id}."
+        )
+        try:
+            data = self.launch_template_data(instance_type, user_data)
+
+            if self.find_launch_template(template_name) is None:
+                # Creates the launch template via EC2 client
+                launch_template = self.call(
+                    self.client.create_launch_template,
+                    LaunchTemplateName=template_name,
+                    LaunchTemplateData=data,
+                )
+
+                print(f"Launch template {template_name} created successfully.")
+
+            else:
+                # Existing templates get a new default version instead of being
+                # recreated, the autoscaling picks it up with an instance refresh
+                version = self.call(
+                    self.client.create_launch_template_version,
+                    LaunchTemplateName=template_name,
+                    LaunchTemplateData=data,
+                )["LaunchTemplateVersion"]["VersionNumber"]
+
+                self.call(
+                    self.client.modify_launch_template,
+                    LaunchTemplateName=template_name,
+                    DefaultVersion=str(version),
+                )
+
+                print(f"Launch template {template_name} is now at version {version}.")
+
+            return template_name
+
+        except ClientError as c_error:
+            print(f"\nERROR: {c_error}")
+
+    def launch_source(self, launch_name: str, launch_template: bool = False):
+        # Autoscaling arguments for a launch template or a legacy launch configuration
+        if launch_template:
+            return {
+                "LaunchTemplate": {
+                    "LaunchTemplateName": launch_name,
+                    "Version": "$Default",
+                }
+            }
+        return {"LaunchConfigurationName": launch_name}
+
+    def create_autoscaling(
+        self,
+        auto_name: str,
+        launch_name: str,
+        load_name: str,
+        min_size: int = 2,
+        max_size: int = 3,
+        desired: int = 2,
+        timeout: float = 900,
+        launch_template: bool = False,
+        warm_pool: dict = None,
+        scaling: dict = None,
+    ):
         print(f"\nCreating autoscaling with name {auto_name}")
         print(
-            f"Autoscaling is using launch configuration {launch_name} and LoadBalancer {load_name}."
+            f"Autoscaling is using launch {'template' if launch_template else 'configuration'} {launch_name} and LoadBalancer {load_name}."
         )
         try:
             # Creates autoscaling using autoscaling client
-            autoscaling = self.autoscaling.create_auto_scaling_group(
+            autoscaling = self.call(
+                self.autoscaling.create_auto_scaling_group,
                 AutoScalingGroupName=auto_name,
-                LaunchConfigurationName=launch_name,
-                MinSize=2,
-                MaxSize=3,
+                MinSize=min_size,
+                MaxSize=max_size,
                 LoadBalancerNames=[load_name],
-                DesiredCapacity=2,
+                DesiredCapacity=desired,
                 AvailabilityZones=self.zones,
+                # Instances only count as healthy once the LoadBalancer says so,
+                # which is what keeps rolling instance refreshes safe
+                HealthCheckType="ELB",
+                HealthCheckGracePeriod=120,
+                **self.launch_source(launch_name, launch_template),
             )
 
-            # Describes the autoscaling created
-            describe = self.autoscaling.describe_auto_scaling_groups(
-                AutoScalingGroupNames=[auto_name]
+            # The warm pool fills up while the first instances are starting
+            if warm_pool:
+                self.create_warm_pool(auto_name, **warm_pool)
+
+            if scaling:
+                self.create_scaling_policies(auto_name, load_name, **scaling)
+
+            print(
+                f"Autoscaling {auto_name} created, waiting for {desired} instances..."
             )
 
-            # Checks if describe has values, if not, autoscaling hasn't been created yet
-            while len(describe["AutoScalingGroups"]) == 0:
-                self.stopwatch(10)
+            # Only returns once the LoadBalancer is actually serving the instances
+            self.wait_for_capacity(auto_name, load_name, timeout)
 
             print(f"Autoscaling {auto_name} created successfully.")
 
+            return auto_name
+
+        except (ClientError, WaitTimeout) as c_error:
+            print(f"\nERROR: {c_error}")
+
+    def create_warm_pool(
+        self, auto_name: str, min_size: int = 1, pool_state: str = "Stopped"
+    ):
+        print(
+            f"\nAdding a warm pool of {min_size} {pool_state.lower()} instances to {auto_name}..."
+        )
+        try:
+            # Pre-initialized instances, so scaling out doesn't boot a cold AMI
+            warm_pool = self.call(
+                self.autoscaling.put_warm_pool,
+                AutoScalingGroupName=auto_name,
+                MinSize=min_size,
+                PoolState=pool_state,
+                InstanceReusePolicy={"ReuseOnScaleIn": True},
+            )
+
+            print(f"Warm pool of {auto_name} configured successfully.")
+
+            return auto_name
+
+        except ClientError as c_error:
+            print(f"\nERROR: {c_error}")
+
+    def create_scaling_policies(
+        self,
+        auto_name: str,
+        load_name: str,
+        cpu_target: float = None,
+        requests_per_instance: float = None,
+        warmup: int = 120,
+        scheduled: list = (),
+    ):
+        print(f"\nAttaching scaling policies to {auto_name}...")
+        targets = policy_targets(
+            auto_name,
+            {"cpu_target": cpu_target, "requests_per_instance": requests_per_instance},
+        )
+        try:
+            if cpu_target is not None:
+                # Keeps the average CPU of the group around the target
+                self.call(
+                    self.autoscaling.put_scaling_policy,
+                    AutoScalingGroupName=auto_name,
+                    PolicyName=f"{auto_name}-cpu",
+                    PolicyType="TargetTrackingScaling",
+                    EstimatedInstanceWarmup=warmup,
+                    TargetTrackingConfiguration={
+                        "PredefinedMetricSpecification": {
+                            "PredefinedMetricType": "ASGAverageCPUUtilization"
+                        },
+                        "TargetValue": targets[f"{auto_name}-cpu"],
+                    },
+                )
+
+            if requests_per_instance is not None:
+                # Classic LoadBalancers have no per-target request metric, so it's
+                # computed from the request count and the InService instances
+                self.call(
+                    self.autoscaling.enable_metrics_collection,
+                    AutoScalingGroupName=auto_name,
+                    Granularity="1Minute",
+                    Metrics=["GroupInServiceInstances"],
+                )
+                self.call(
+                    self.autoscaling.put_scaling_policy,
+                    AutoScalingGroupName=auto_name,
+                    PolicyName=f"{auto_name}-requests",
+                    PolicyType="TargetTrackingScaling",
+                    EstimatedInstanceWarmup=warmup,
+                    TargetTrackingConfiguration={
+                        "CustomizedMetricSpecification": {
+                            "Metrics": [
+                                {
+                                    "Id": "requests",
+                                    "MetricStat": {
+                                        "Metric": {
+                                            "Namespace": "AWS/ELB",
+                                            "MetricName": "RequestCount",
+                                            "Dimensions": [
+                                                {
+                                                    "Name": "LoadBalancerName",
+                                                    "Value": load_name,
+                                                }
+                                            ],
+                                        },
+                                        "Stat": "Sum",
+                                    },
+                                    "ReturnData": False,
+                                },
+                                {
+                                    "Id": "instances",
+                                    "MetricStat": {
+                                        "Metric": {
+                                            "Namespace": "AWS/AutoScaling",
+                                            "MetricName": "GroupInServiceInstances",
+                                            "Dimensions": [
+                                                {
+                                                    "Name": "AutoScalingGroupName",
+                                                    "Value": auto_name,
+                                                }
+                                            ],
+                                        },
+                                        "Stat": "Average",
+                                    },
+                                    "ReturnData": False,
+                                },
+                                {
+                                    "Id": "per_instance",
+                                    "Expression": "requests / instances",
+                                    "Label": "Requests per instance per minute",
+                                    "ReturnData": True,
+                                },
+                            ]
+                        },
+                        "TargetValue": targets[f"{auto_name}-requests"],
+                    },
+                )
+
+            # Capacity changes known in advance (daily peaks...)
+            for action in scheduled:
+                sizes = {
+                    key: action[name]
+                    for key, name in (
+                        ("MinSize", "min_size"),
+                        ("MaxSize", "max_size"),
+                        ("DesiredCapacity", "desired"),
+                    )
+                    if name in action
+                }
+                self.call(
+                    self.autoscaling.put_scheduled_update_group_action,
+                    AutoScalingGroupName=auto_name,
+                    ScheduledActionName=action["name"],
+                    Recurrence=action["recurrence"],
+                    TimeZone=action.get("time_zone", "UTC"),
+                    **sizes,
+                )
+
+            print(
+                f"{len(targets)} scaling policies and {len(scheduled)} scheduled actions attached to {auto_name}."
+            )
+
+            return list(targets)
+
         except ClientError as c_error:
             print(f"\nERROR: {c_error}")
+
+    def start_instance_refresh(
+        self,
+        auto_name: str,
+        load_name: str,
+        min_healthy: int = 50,
+        warmup: int = 120,
+        timeout: float = 1800,
+    ):
+        print(f"\nStarting a rolling instance refresh of {auto_name}...")
+        try:
+            # Replaces instances a few at a time, the rest keep serving traffic
+            refresh_id = self.call(
+                self.autoscaling.start_instance_refresh,
+                AutoScalingGroupName=auto_name,
+                Strategy="Rolling",
+                Preferences={
+                    "MinHealthyPercentage": min_healthy,
+                    "InstanceWarmup": warmup,
+                    "SkipMatching": True,
+                },
+            )["InstanceRefreshId"]
+
+            t0 = self.waiter.now()
+            refresh = self.wait_until(
+                lambda: self.instance_refresh_status(auto_name, refresh_id),
+                name=f"instance refresh {refresh_id}",
+                timeout=timeout,
+            )
+
+            if refresh["Status"] != "Successful":
+                print(
+                    f"\nERROR: Instance refresh {refresh_id} ended as {refresh['Status']}: {refresh.get('StatusReason', '')}"
+                )
+                return
+
+            print(
+                f"Instance refresh {refresh_id} finished after {self.waiter.now() - t0:.1f}s."
+            )
+
+            self.wait_for_capacity(auto_name, load_name, timeout)
+
+            return refresh_id
+
+        except (ClientError, WaitTimeout) as c_error:
+            print(f"\nERROR: {c_error}")
+
+    def instance_refresh_status(self, auto_name: str, refresh_id: str):
+        # None while the refresh is running, the refresh once it has ended
+        refresh = self.autoscaling.describe_instance_refreshes(
+            AutoScalingGroupName=auto_name, InstanceRefreshIds=[refresh_id]
+        )["InstanceRefreshes"][0]
+
+        if refresh["Status"] in (
+            "Pending",
+            "InProgress",
+            "Cancelling",
+            "Baking",
+            "RollbackInProgress",
+        ):
+            print(
+                f"Instance refresh {refresh_id}: {refresh.get('PercentageComplete', 0)}% complete"
+            )
+            return None
+
+        return refresh
+
+    def capacity_ready(self, auto_name: str, load_name: str):
+        # Autoscaling side: instances launched and healthy
+        groups = self.autoscaling.describe_auto_scaling_groups(
+            AutoScalingGroupNames=[auto_name]
+        )["AutoScalingGroups"]
+        if not groups:
+            return None
+
+        desired = groups[0]["DesiredCapacity"]
+        instance_ids = [
+            instance["InstanceId"]
+            for instance in groups[0]["Instances"]
+            if instance["LifecycleState"] == "InService"
+            and instance["HealthStatus"] == "Healthy"
+        ]
+        if len(instance_ids) < desired:
+            print(f"{len(instance_ids)}/{desired} instances InService in {auto_name}")
+            return None
+
+        # Nothing to check behind the LoadBalancer (an empty list of instances
+        # would describe every instance registered with it)
+        if not instance_ids:
+            return ([],)
+
+        # LoadBalancer side: instances passing the health check
+        states = self.load_balancer.describe_instance_health(
+            LoadBalancerName=load_name,
+            Instances=[{"InstanceId": instance_id} for instance_id in instance_ids],
+        )["InstanceStates"]
+        in_service = [
+            state["InstanceId"] for state in states if state["State"] == "InService"
+        ]
+        if len(in_service) < desired:
+            print(f"{len(in_service)}/{desired} instances InService in {load_name}")
+            return None
+
+        # Wrapped in a tuple, no instances at all (desired 0) would otherwise
+        # keep it waiting
+        return (in_service,)
+
+    def wait_for_capacity(self, auto_name: str, load_name: str, timeout: float = 900):
+        t0 = self.waiter.now()
+        (in_service,) = self.wait_until(
+            lambda: self.capacity_ready(auto_name, load_name),
+            name=f"autoscaling {auto_name} capacity",
+            timeout=timeout,
+        )
+        print(
+            f"{len(in_service)} instances InService behind {load_name} after {self.waiter.now() - t0:.1f}s."
+        )
+        return in_service
@@ -5,6 +5,22 @@ from aws import AWSDefault
 import boto3
 from botocore.exceptions import ClientError
 
+# Waiting subsystem
+from wait import WaitTimeout
+
+# Error classification for retries
+from ratelimit import classify
+
+# Extra imports
+from functools import partial
+from time import monotonic
+
+# Dependency graph used for concurrent teardown
+from scheduler import Scheduler
+
+# Endpoint cache read by client.py
+from network import endpoint_key
+
 
 class AWSDelete(AWSDefault):
     def delete_autoscaling(self, auto_name: str):
@@ -18,23 +34,48 @@ class AWSDelete(AWSDefault):
             # Checks if describe has values
             if len(describe_auto["AutoScalingGroups"]) != 0:
                 # Deletes values
-                delete_auto = self.autoscaling.delete_auto_scaling_group(
-                    AutoScalingGroupName=auto_name, ForceDelete=True
+                delete_auto = self.call(
+                    self.autoscaling.delete_auto_scaling_group,
+                    AutoScalingGroupName=auto_name,
+                    ForceDelete=True,
                 )
 
                 # Checks if there are new values, if there are, wait
-                while (
-                    len(
-                        self.autoscaling.describe_auto_scaling_groups(
-                            AutoScalingGroupNames=[auto_name]
-                        )["AutoScalingGroups"]
-                    )
-                    != 0
-                ):
-                    self.stopwatch(10)
+                self.wait_until(
+                    lambda: not self.autoscaling.describe_auto_scaling_groups(
+                        AutoScalingGroupNames=[auto_name]
+                    )["AutoScalingGroups"],
+                    name=f"autoscaling {auto_name} deletion",
+                )
 
                 print(f"Autoscaling {auto_name} has been deleted successfully.")
 
+        except (ClientError, WaitTimeout) as c_error:
+            print(f"\nERROR: {c_error}")
+
+    def delete_scaling_policies(
+        self, auto_name: str, policy_names: list, action_names: list
+    ):
+        print(f"\nDeleting scaling policies of {auto_name}...")
+        try:
+            for policy_name in policy_names:
+                self.call(
+                    self.autoscaling.delete_policy,
+                    AutoScalingGroupName=auto_name,
+                    PolicyName=policy_name,
+                )
+
+            for action_name in action_names:
+                self.call(
+                    self.autoscaling.delete_scheduled_action,
+                    AutoScalingGroupName=auto_name,
+                    ScheduledActionName=action_name,
+                )
+
+            print(
+                f"{len(policy_names)} scaling policies and {len(action_names)} scheduled actions deleted from {auto_name}."
+            )
+
         except ClientError as c_error:
             print(f"\nERROR: {c_error}")
 
@@ -49,8 +90,9 @@ class AWSDelete(AWSDefault):
             # Checks if describe has values
             if len(describe_launch["LaunchConfigurations"]) != 0:
                 # Deletes values
-                delete_launch = self.autoscaling.delete_launch_configuration(
-                    LaunchConfigurationName=launch_name
+                delete_launch = self.call(
+                    self.autoscaling.delete_launch_configuration,
+                    LaunchConfigurationName=launch_name,
                 )
 
                 print(
@@ -60,164 +102,347 @@ class AWSDelete(AWSDefault):
         except ClientError as c_error:
             print(f"\nERROR: {c_error}")
 
-    def delete_load_balancers(self, load_name: str):
-        print(f"\nDeleting LoadBalancer {load_name}...")
+    def delete_launch_template(self, template_name: str):
+        print(f"\nDeleting launch template {template_name}...")
         try:
-            # Gets list of all LoadBalancers
-            load_balancers = self.load_balancer.describe_load_balancers()[
-                "LoadBalancerDescriptions"
-            ]
+            # Deletes the template with all of its versions, if it exists
+            if self.find_launch_template(template_name):
+                delete_template = self.call(
+                    self.client.delete_launch_template,
+                    LaunchTemplateName=template_name,
+                )
 
-            # Checks if there is a LoadBalancer with the name specified
-            load_exists = False
-            for lb in load_balancers:
-                if lb["LoadBalancerName"] == load_name:
-                    load_exists = True
+                print(f"Launch template {template_name} has been deleted successfully.")
 
+        except ClientError as c_error:
+            print(f"\nERROR: {c_error}")
+
+    def delete_load_balancers(self, load_name: str):
+        print(f"\nDeleting LoadBalancer {load_name}...")
+        try:
             # If the LoadBalancer exists, it needs to be deleted
-            if load_exists:
-                delete_load = self.load_balancer.delete_load_balancer(
-                    LoadBalancerName=load_name
+            if self.find_load_balancer(load_name):
+                delete_load = self.call(
+                    self.load_balancer.delete_load_balancer, LoadBalancerName=load_name
                 )
 
-                # Sets that there are more values to check
-                has_values = True
-                while has_values:
-                    # Gets a new describe
-                    loadbalancers = self.load_balancer.describe_load_balancers()[
-                        "LoadBalancerDescriptions"
-                    ]
+                # Polls until the LoadBalancer is no longer found
+                self.wait_for_lb(load_name, "deleted")
 
-                    # If there are no new values, we have deleted the LoadBalancers
-                    if len(loadbalancers) == 0:
-                        has_values = False
+                # Its DNS name is gone, client.py looks up the new one
+                self.network.forget(self.region, endpoint_key(load_name))
 
-                    # If there are LoadBalancers, check if it is the same one.
-                    # If it is, it may be a delay, so we can say that the LoadBalancer has been deleted.
-                    for loadbalancer in loadbalancers:
-                        if loadbalancer["LoadBalancerName"] == load_name:
-                            has_values = False
+                print(f"LoadBalancer {load_name} has been deleted successfully.")
 
-                    # Waits 10s
-                    self.stopwatch(10)
+        except (ClientError, WaitTimeout) as c_error:
+            print(f"\nERROR: {c_error}")
 
-                print(f"LoadBalancer {load_name} has been deleted successfully.")
+    def named_images(self, ami_name: str):
+        # Searches for AMIs with the name specified
+        images = self.client.describe_images(
+            Filters=[{"Name": "name", "Values": [ami_name]}]
+        )
+        return [image["ImageId"] for image in images["Images"]]
+
+    def deregister_image(self, image_id: str):
+        # False when the image doesn't exist (anymore)
+        try:
+            delete_image = self.call(self.client.deregister_image, ImageId=image_id)
+            print(
+                f"Image {delete_image['ResponseMetadata']['RequestId']} has been deleted successfully."
+            )
+            return True
 
         except ClientError as c_error:
-            print(f"\nERROR: {c_error}")
+            if "InvalidAMIID" not in c_error.response["Error"]["Code"]:
+                raise
+            return False
 
     def delete_ami_image(self, ami_name: str):
         print(f"\nDeleting AMI image {ami_name}...")
         try:
-            # Searches for an AMI with the name specified
-            image_id = self.client.describe_images(
-                Filters=[{"Name": "name", "Values": [ami_name]}]
+            # Images in the state file that were already deregistered (e.g.
+            # evicted from the AMI cache) are skipped
+            image_ids, _ = self.known_and_tagged(
+                "images", ami_name, lambda: self.named_images(ami_name)
             )
+            for image_id in image_ids:
+                self.deregister_image(image_id)
 
-            # Checks if any AMI has been found
-            if len(image_id["Images"]) != 0:
-                # Gets the AMI ID
-                image_id = image_id["Images"][0]["ImageId"]
-
-                # Deregisters the image
-                delete_image = self.client.deregister_image(ImageId=image_id)
-                print(
-                    f"Image {delete_image['ResponseMetadata']['RequestId']} has been deleted successfully."
-                )
+            self.store.forget(self.region, "images", ami_name)
 
         except ClientError as c_error:
             print(f"\nERROR: {c_error}")
 
+    def tagged_instances(self):
+        # Lists every instance with the class tags that hasn't been terminated yet
+        reservations = self.paginate(
+            self.client,
+            "describe_instances",
+            "Reservations",
+            Filters=[
+                self.tag_filter(self.instance_tags),
+                {
+                    "Name": "instance-state-name",
+                    "Values": ["pending", "running", "stopping", "stopped"],
+                },
+            ],
+        )
+        return [
+            instance["InstanceId"]
+            for reservation in reservations
+            for instance in reservation["Instances"]
+        ]
+
+    def terminate_instances(self, instance_ids: list):
+        # Checks if there are any instances
+        if len(instance_ids) != 0:
+            # Terminates every instance in a single call
+            delete_instance = self.call(
+                self.client.terminate_instances, InstanceIds=instance_ids
+            )
+
+            # Checks if all instances have been terminated
+            self.wait_until(
+                lambda: self.terminated(instance_ids),
+                name=f"instances {instance_ids} termination",
+            )
+            print(f"Instances {instance_ids} have been deleted successfully.")
+
+    def terminated(self, instance_ids: list):
+        return all(
+            instance["State"]["Name"] == "terminated"
+            for reservation in self.client.describe_instances(InstanceIds=instance_ids)[
+                "Reservations"
+            ]
+            for instance in reservation["Instances"]
+        )
+
     def delete_instances(self):
         print("\nDeleting all instances...")
+        t0 = monotonic()
+        deleted = []
+        key = self.instance_tags["Value"]
         try:
-            # Lists all instances with the class tags that are currently running
-            instances = self.client.describe_instances(
-                Filters=[
-                    {
-                        "Name": f"tag:{self.instance_tags['Key']}",
-                        "Values": [self.instance_tags["Value"]],
-                    },
-                    {"Name": "instance-state-name", "Values": ["running"]},
-                ]
-            )
-
-            # Checks if there are any instances
-            if len(instances["Reservations"]) != 0:
-                # Saves the instance ID
-                instance = instances["Reservations"][0]["Instances"][0]
-                instance_id = instance["InstanceId"]
-
-                # Creates a new waiter
-                instance_waiter = self.client.get_waiter("instance_terminated")
-
-                # Terminates instance
-                delete_instance = self.client.terminate_instances(
-                    InstanceIds=[instance_id]
-                )
+            # Instances found by tag or recorded when they were created
+            instance_ids, known = self.known_and_tagged(
+                "instances", key, self.tagged_instances
+            )
 
-                # Checks if instance hass been terminated
-                instance_waiter.wait(InstanceIds=[instance_id])
-                print(f"Instance {instance_id} has been deleted successfully.")
+            try:
+                self.terminate_instances(instance_ids)
 
-        except ClientError as c_error:
+            except ClientError as c_error:
+                # An instance only in the state file is long gone, so only the
+                # ones found by tag are terminated
+                if (
+                    not known
+                    or "InvalidInstanceID" not in c_error.response["Error"]["Code"]
+                ):
+                    raise
+                instance_ids = self.tagged_instances()
+                self.terminate_instances(instance_ids)
+
+            # Only reported once every instance is terminated
+            deleted = instance_ids
+            self.store.forget(self.region, "instances", key)
+
+        except (ClientError, WaitTimeout) as c_error:
             print(f"\nERROR: {c_error}")
 
-    def delete_security_group(self):
+        return self.summary(deleted, t0)
+
+    def tagged_security_groups(self):
+        # Lists all security groups using tags as filters
+        return [
+            sec_group["GroupId"]
+            for sec_group in self.paginate(
+                self.client,
+                "describe_security_groups",
+                "SecurityGroups",
+                Filters=[self.tag_filter(self.security_tags)],
+            )
+        ]
+
+    def delete_security_group(self, timeout: float = 600):
         print("\nDeleting all security groups in region...")
+        t0 = monotonic()
+        deleted = []
+        key = self.security_tags["Value"]
         try:
-            # Lists all security groups using tags as filters
-            sec_group_id = self.client.describe_security_groups(
-                Filters=[
-                    {
-                        "Name": f"tag:{self.security_tags['Key']}",
-                        "Values": [self.security_tags["Value"]],
-                    }
-                ]
-            )
-
-            # If there are security groups, they need to be deleted
-            if len(sec_group_id["SecurityGroups"]) != 0:
-                # Saves the ID for the security group (only one exists)
-                sec_group_id = sec_group_id["SecurityGroups"][0]["GroupId"]
-
-                # Tries to delete the security group
-                while True:
-                    try:
-                        delete_security = self.client.delete_security_group(
-                            GroupId=sec_group_id
-                        )
-                        break
-
-                    except ClientError as c_error:
-                        self.stopwatch(10)
+            # Groups only in the state file that no longer exist come back
+            # as missing
+            sec_group_ids, _ = self.known_and_tagged(
+                "security_groups", key, self.tagged_security_groups
+            )
+            results = self.delete_security_groups(sec_group_ids, timeout)
 
-                print(f"Security group {sec_group_id} has been deleted successfully.")
+            # A group that was already gone wasn't deleted by this run
+            deleted = [
+                sec_group_id
+                for sec_group_id, result in results.items()
+                if result == "deleted"
+            ]
+
+            # Groups that couldn't be deleted are still there for the next run
+            self.store.set(
+                self.region,
+                "security_groups",
+                key,
+                [
+                    sec_group_id
+                    for sec_group_id in sec_group_ids
+                    if not results.get(sec_group_id)
+                ],
+            )
 
         except ClientError as c_error:
             print(f"\nERROR: {c_error}")
 
+        return self.summary(deleted, t0)
+
+    def delete_security_groups(self, sec_group_ids: list, timeout: float):
+        # Every group waits for its own network interfaces, up to as many at
+        # the same time as the scheduler runs tasks
+        scheduler = Scheduler()
+        for sec_group_id in dict.fromkeys(sec_group_ids):
+            scheduler.add(
+                sec_group_id,
+                partial(self.delete_one_security_group, sec_group_id, timeout),
+            )
+        return scheduler.run()
+
+    def security_group_interfaces(self, sec_group_id: str):
+        # Network interfaces (instances, LoadBalancers...) still using the group
+        return self.paginate(
+            self.client,
+            "describe_network_interfaces",
+            "NetworkInterfaces",
+            Filters=[{"Name": "group-id", "Values": [sec_group_id]}],
+        )
+
+    def delete_one_security_group(self, sec_group_id: str, timeout: float):
+        deadline = self.waiter.now() + timeout
+        try:
+            # Waits specifically for the interfaces using the group to be detached
+            self.wait_until(
+                lambda: not self.security_group_interfaces(sec_group_id),
+                name=f"network interfaces of security group {sec_group_id}",
+                timeout=timeout,
+            )
+
+            # Rules in other groups can still reference it, so deleting is retried
+            result = self.wait_until(
+                lambda: self.try_delete_security_group(sec_group_id),
+                name=f"security group {sec_group_id} deletion",
+                timeout=max(deadline - self.waiter.now(), 0),
+            )
+
+            if result != "missing":
+                print(f"Security group {sec_group_id} has been deleted successfully.")
+            return result
+
+        except (ClientError, WaitTimeout) as c_error:
+            print(f"\nERROR: {c_error}")
+
+        return False
+
+    def try_delete_security_group(self, sec_group_id: str):
+        try:
+            self.client.delete_security_group(GroupId=sec_group_id)
+            return "deleted"
+
+        except ClientError as c_error:
+            # Already deleted, e.g. a group from an out of date state file
+            if c_error.response["Error"]["Code"] == "InvalidGroup.NotFound":
+                return "missing"
+
+            # Resources still attached to the group, try again later
+            if classify(c_error) in ("dependency", "throttling", "transient"):
+                return False
+            raise
+
+    def tagged_key_pairs(self):
+        # Gets all key pairs with the class tags (DescribeKeyPairs isn't paginated)
+        keys = self.client.describe_key_pairs(Filters=[self.tag_filter(self.key_tags)])
+        return [key["KeyName"] for key in keys["KeyPairs"]]
+
     def delete_key_pairs(self):
         print("\nDeleting all key pairs...")
+        t0 = monotonic()
+        deleted = []
+        key = self.key_tags["Value"]
         try:
-            # Gets all key pairs with the class tags
-            keys = self.client.describe_key_pairs(
-                Filters=[
-                    {
-                        "Name": f"tag:{self.key_tags['Key']}",
-                        "Values": [self.key_tags["Value"]],
-                    }
-                ]
+            key_names, _ = self.known_and_tagged(
+                "key_pairs", key, self.tagged_key_pairs
             )
 
-            # Checks if there are any keys
-            if len(keys["KeyPairs"]) != 0:
-                # Saves the key pair ID
-                key_id = keys["KeyPairs"][0]["KeyPairId"]
+            # Deleted by name, which also covers a key recreated since it was
+            # recorded (deleting a missing key pair isn't an error)
+            for key_name in key_names:
+                delete_key = self.call(self.client.delete_key_pair, KeyName=key_name)
+                deleted.append(key_name)
+                print(f"Key pair {key_name} has been deleted successfully.")
 
-                # Deletes the key pair
-                delete_key = self.client.delete_key_pair(KeyPairId=key_id)
-                print(f"Key pair {key_id} has been deleted successfully.")
+            self.store.forget(self.region, "key_pairs", key)
 
         except ClientError as c_error:
             print(f"\nERROR: {c_error}")
+
+        return self.summary(deleted, t0)
+
+    def summary(self, ids: list, t0: float):
+        # Structured result of a bulk deletion
+        return {"count": len(ids), "ids": ids, "elapsed": monotonic() - t0}
+
+    def teardown_region(
+        self,
+        auto_name: str = None,
+        load_name: str = None,
+        launch_name: str = None,
+        ami_name: str = None,
+        template_name: str = None,
+    ):
+        print(f"\nTearing down region {self.region}...")
+
+        # Only real dependencies are serialized, everything else runs at once
+        scheduler = Scheduler()
+        sec_group_deps = ["instances"]
+
+        if auto_name:
+            scheduler.add("autoscaling", lambda: self.delete_autoscaling(auto_name))
+            sec_group_deps.append("autoscaling")
+
+        if load_name:
+            scheduler.add(
+                "load_balancer", lambda: self.delete_load_balancers(load_name)
+            )
+            sec_group_deps.append("load_balancer")
+
+        if launch_name:
+            # The launch config can't be deleted while the autoscaling uses it
+            scheduler.add(
+                "launch_configuration",
+                lambda: self.delete_launch_configuration(launch_name),
+                deps=["autoscaling"] if auto_name else [],
+            )
+
+        if template_name:
+            # Same for the launch template
+            scheduler.add(
+                "launch_template",
+                lambda: self.delete_launch_template(template_name),
+                deps=["autoscaling"] if auto_name else [],
+            )
+
+        if ami_name:
+            scheduler.add("ami_image", lambda: self.delete_ami_image(ami_name))
+
+        scheduler.add("instances", self.delete_instances)
+        scheduler.add("key_pairs", self.delete_key_pairs)
+        scheduler.add("security_group", self.delete_security_group, deps=sec_group_deps)
+
+        scheduler.run()
+        scheduler.report(f"Teardown report ({self.region})")
+
+        return scheduler
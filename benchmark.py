@@ -0,0 +1,381 @@
+# Task manager client
+from client import TaskClient, new_task
+
+# HTTP imports
+import requests
+
+# Extra imports
+from argparse import ArgumentParser
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from json import dump, dumps, load, loads
+import math
+import random
+import threading
+from time import perf_counter, sleep
+
+# Endpoints of the task manager, relative to /tasks
+OPERATIONS = {
+    "create_task": ("POST", "/create_task"),
+    "get_tasks": ("GET", "/get_tasks"),
+    "delete_tasks": ("DELETE", "/delete_tasks"),
+}
+
+
+def percentile(values: list, p: float):
+    # Nearest rank percentile of a sorted list, the smallest value with at
+    # least p% of the values at or below it
+    if not values:
+        return None
+    rank = max(math.ceil(p / 100 * len(values)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def parse_mix(mix: str):
+    # "create_task=8,get_tasks=2" -> {"create_task": 8.0, "get_tasks": 2.0}
+    weights = {}
+    for part in mix.split(","):
+        operation, _, weight = part.partition("=")
+        if operation not in OPERATIONS:
+            raise ValueError(f"Unknown operation {operation}")
+        weights[operation] = float(weight or 1)
+    return weights
+
+
+######################## STUB SERVER ########################
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # Keeps connections alive like the real server behind the LoadBalancer
+    protocol_version = "HTTP/1.1"
+
+    # Headers and body are separate writes, with Nagle's algorithm the body
+    # waits for the client's delayed ACK on every kept-alive request
+    disable_nagle_algorithm = True
+
+    def reply(self, status: int, body):
+        payload = dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def route(self, method: str):
+        server = self.server
+        if server.delay:
+            sleep(server.delay)
+
+        if (method, self.path) == ("POST", "/tasks/create_task"):
+            length = int(self.headers.get("Content-Length", 0))
+            task = self.rfile.read(length)
+            with server.lock:
+                server.tasks.append(loads(task))
+            return self.reply(200, {"created": 1})
+        if (method, self.path) == ("GET", "/tasks/get_tasks"):
+            with server.lock:
+                return self.reply(200, list(server.tasks))
+        if (method, self.path) == ("DELETE", "/tasks/delete_tasks"):
+            with server.lock:
+                deleted = len(server.tasks)
+                server.tasks.clear()
+            return self.reply(200, {"deleted": deleted})
+        if (method, self.path.rstrip("/")) == ("GET", "/tasks"):
+            return self.reply(200, "Test index")
+
+        self.reply(404, {"error": f"{method} {self.path} not found"})
+
+    def do_GET(self):
+        self.route("GET")
+
+    def do_POST(self):
+        self.route("POST")
+
+    def do_DELETE(self):
+        self.route("DELETE")
+
+    def log_message(self, *args):
+        # Keeps the benchmark output readable
+        pass
+
+
+class StubHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    # Room for every connection the load generator opens at once
+    request_queue_size = 256
+
+
+class StubServer:
+    # In-memory stand-in for the task manager, for running the benchmark locally
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, delay: float = 0):
+        self.server = StubHTTPServer((host, port), StubHandler)
+        self.server.tasks = []
+        self.server.lock = threading.Lock()
+        self.server.delay = delay
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/tasks"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+######################## LOAD GENERATOR ########################
+
+
+class LoadGenerator:
+    def __init__(
+        self,
+        url: str = None,
+        mix: dict = None,
+        concurrency: int = 16,
+        rate: float = None,
+        timeout: float = 10,
+        label: str = None,
+    ):
+        # Name of the run in comparisons, e.g. the deployment topology
+        self.label = label
+
+        self.mix = mix or {"create_task": 1, "get_tasks": 1}
+        self.concurrency = concurrency
+        self.timeout = timeout
+
+        # Requests per second (open loop), None sends as fast as concurrency allows
+        self.rate = rate
+
+        # One keep-alive connection per concurrent request, no retries so that
+        # every failure shows up in the error rate
+        self.client = TaskClient(url, timeout=timeout, retries=0, pool_size=concurrency)
+
+        # (operation, latency in seconds, error or None) of every request
+        self.samples = []
+        self.elapsed = 0
+
+    def pick(self):
+        # Weighted random operation from the mix
+        operations, weights = zip(*self.mix.items())
+        return random.choices(operations, weights=weights)[0]
+
+    def request(self, operation: str, scheduled: float):
+        method, path = OPERATIONS[operation]
+        data = None
+        if operation == "create_task":
+            data = dumps(new_task("benchmark", "Task created by the load generator"))
+
+        error = None
+        try:
+            response = self.client.request(method, path, data=data)
+            if response.status_code >= 400:
+                error = f"HTTP {response.status_code}"
+        except requests.RequestException as r_error:
+            error = type(r_error).__name__
+
+        # With a fixed rate, latency counts from when the request should have
+        # been sent, so a slow server can't hide the requests it delayed
+        return operation, perf_counter() - scheduled, error
+
+    async def run(self, duration: float = 10, total: int = None):
+        loop = asyncio.get_running_loop()
+        pool = ThreadPoolExecutor(max_workers=self.concurrency)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        pending = set()
+        self.samples = []
+        sent = 0
+
+        async def send(operation: str, scheduled: float):
+            async with semaphore:
+                self.samples.append(
+                    await loop.run_in_executor(pool, self.request, operation, scheduled)
+                )
+
+        # Resolves the LoadBalancer (cache or API) before the clock starts
+        await asyncio.to_thread(lambda: self.client.url)
+
+        t0 = perf_counter()
+        while perf_counter() - t0 < duration and (total is None or sent < total):
+            if self.rate:
+                # Open loop, requests go out on schedule whatever the latency
+                scheduled = t0 + sent / self.rate
+                await asyncio.sleep(max(scheduled - perf_counter(), 0))
+            else:
+                # Closed loop, a new request as soon as one finishes
+                if len(pending) >= self.concurrency:
+                    await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                scheduled = perf_counter()
+
+            task = asyncio.ensure_future(send(self.pick(), scheduled))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+            sent += 1
+
+        await asyncio.gather(*pending)
+        self.elapsed = perf_counter() - t0
+        pool.shutdown()
+        self.client.close()
+
+        return self.results()
+
+    def stats(self, samples: list):
+        latencies = sorted(latency for _, latency, _ in samples)
+        errors = [error for _, _, error in samples if error]
+        return {
+            "requests": len(samples),
+            "errors": len(errors),
+            "error_rate": len(errors) / len(samples) if samples else 0,
+            "throughput": len(samples) / self.elapsed if self.elapsed else 0,
+            "mean": sum(latencies) / len(latencies) if latencies else None,
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": latencies[-1] if latencies else None,
+            "error_types": {error: errors.count(error) for error in set(errors)},
+        }
+
+    def results(self):
+        return {
+            "config": {
+                "label": self.label,
+                "url": self.client.url,
+                "mix": self.mix,
+                "concurrency": self.concurrency,
+                "rate": self.rate,
+                "timeout": self.timeout,
+            },
+            "elapsed": self.elapsed,
+            "overall": self.stats(self.samples),
+            "operations": {
+                operation: self.stats(
+                    [sample for sample in self.samples if sample[0] == operation]
+                )
+                for operation in self.mix
+            },
+        }
+
+
+def print_results(results: dict):
+    print(f"\nBenchmark of {results['config']['url']} ({results['elapsed']:.1f}s)")
+    print(
+        f"{'Operation':<15}{'Requests':>10}{'Req/s':>9}{'Errors':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+    )
+
+    rows = list(results["operations"].items()) + [("total", results["overall"])]
+    for operation, stats in rows:
+
+        def ms(value):
+            return f"{value * 1000:>9.1f}" if value is not None else f"{'-':>9}"
+
+        print(
+            f"{operation:<15}{stats['requests']:>10}{stats['throughput']:>9.1f}{stats['error_rate']:>7.1%}{ms(stats['p50'])}{ms(stats['p95'])}{ms(stats['p99'])}"
+        )
+
+
+def print_comparison(runs: list):
+    # Side by side latency of saved runs (e.g. one per topology), the first is
+    # the baseline the others are compared to
+    baseline = runs[0]["overall"]
+    print(
+        f"\n{'Run':<20}{'Req/s':>9}{'Errors':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'p50 vs first':>14}"
+    )
+
+    for run in runs:
+        stats = run["overall"]
+        label = run["config"].get("label") or run["config"]["url"]
+
+        def ms(value):
+            return f"{value * 1000:>9.1f}" if value is not None else f"{'-':>9}"
+
+        change = (
+            f"{stats['p50'] / baseline['p50'] - 1:>+14.1%}"
+            if stats["p50"] and baseline["p50"]
+            else f"{'-':>14}"
+        )
+        print(
+            f"{label[:19]:<20}{stats['throughput']:>9.1f}{stats['error_rate']:>7.1%}{ms(stats['p50'])}{ms(stats['p95'])}{ms(stats['p99'])}{change}"
+        )
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Load test for the task manager endpoints.")
+    parser.add_argument("--url", help="tasks endpoint, defaults to the LoadBalancer")
+    parser.add_argument(
+        "--stub",
+        action="store_true",
+        help="runs against a local in-memory stub server instead of AWS",
+    )
+    parser.add_argument(
+        "--stub-delay",
+        type=float,
+        default=0,
+        help="seconds the stub server waits before answering",
+    )
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument(
+        "--rate", type=float, help="requests per second, default is closed loop"
+    )
+    parser.add_argument("--duration", type=float, default=10, help="seconds")
+    parser.add_argument("--requests", type=int, help="stops after this many requests")
+    parser.add_argument(
+        "--mix",
+        default="create_task=1,get_tasks=1",
+        help="operation weights, e.g. create_task=8,get_tasks=2,delete_tasks=0",
+    )
+    parser.add_argument("--timeout", type=float, default=10)
+    parser.add_argument("--json", metavar="PATH", help="writes the results as JSON")
+    parser.add_argument(
+        "--label", help="name of the run, e.g. the topology (cross-region, colocated)"
+    )
+    parser.add_argument(
+        "--compare",
+        nargs="+",
+        metavar="PATH",
+        help="compares results saved with --json instead of running",
+    )
+    args = parser.parse_args()
+
+    if args.compare:
+        runs = []
+        for path in args.compare:
+            with open(path, "r") as f:
+                runs.append(load(f))
+        print_comparison(runs)
+        raise SystemExit(0)
+
+    stub = StubServer(delay=args.stub_delay).start() if args.stub else None
+    url = stub.url if stub else args.url
+
+    generator = LoadGenerator(
+        url,
+        mix=parse_mix(args.mix),
+        concurrency=args.concurrency,
+        rate=args.rate,
+        timeout=args.timeout,
+        label=args.label,
+    )
+    results = asyncio.run(generator.run(duration=args.duration, total=args.requests))
+
+    if stub:
+        stub.stop()
+
+    print_results(results)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            dump(results, f, indent=2)
+        print(f"\nResults written to {args.json}.")
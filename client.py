@@ -1,52 +1,232 @@
 import boto3
 from botocore.exceptions import ClientError
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from json import dumps
+from json import JSONDecoder, dumps
+from network import CACHE_PATH, ENDPOINT_TTL, NetworkCache, endpoint_key
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-load_balancer_client = boto3.client("elb", region_name="us-east-1")
-loadbalancer = load_balancer_client.describe_load_balancers(
-    LoadBalancerNames=["lb-bruno-nv"]
-)
-ip_address = loadbalancer["LoadBalancerDescriptions"][0]["DNSName"]
-url = f"http://{ip_address}:8080/tasks"
-
-while True:
-    try:
-        print("\nDatabase access\n")
-
-        print("0: Test index")
-        print("1: Create task")
-        print("2: Get all tasks")
-        print("3: Delete all tasks")
-
-        print("Type the number corresponding to the action you want.")
-        action = int(input("Action: "))
-
-        if action == 0:
-            print(f"\nResponse: {requests.get(url).text}")
-
-        if action == 1:
-            task = {
-                "title": str(input("Task title: ")),
-                "pub_date": datetime.now().isoformat(),
-                "description": str(input("Task description: ")),
-            }
-
-            print(
-                f"\nResponse: {requests.post(url + '/create_task', data=dumps(task)).text}"
+
+def load_balancer_dns(load_name: str = "lb-bruno-nv", region: str = "us-east-1"):
+    load_balancer_client = boto3.client("elb", region_name=region)
+    loadbalancer = load_balancer_client.describe_load_balancers(
+        LoadBalancerNames=[load_name]
+    )
+    return loadbalancer["LoadBalancerDescriptions"][0]["DNSName"]
+
+
+def new_task(title: str, description: str, pub_date: str = None):
+    return {
+        "title": title,
+        "pub_date": pub_date or datetime.now().isoformat(),
+        "description": description,
+    }
+
+
+class TaskClient:
+    def __init__(
+        self,
+        url: str = None,
+        timeout: tuple = (3.05, 10),
+        retries: int = 3,
+        backoff: float = 0.2,
+        pool_size: int = 16,
+        load_name: str = "lb-bruno-nv",
+        region: str = "us-east-1",
+        cache: NetworkCache = None,
+    ):
+        # The LoadBalancer is only looked up on the first request, in the
+        # endpoint cache written by main.py and then with the API
+        self._url = url
+        self.discovered = url is None
+        self.load_name = load_name
+        self.region = region
+        self.cache = cache or NetworkCache(ttl=ENDPOINT_TTL, path=CACHE_PATH)
+
+        # (connect, read) timeouts in seconds
+        self.timeout = timeout
+        self.pool_size = pool_size
+
+        # Keep-alive connections reused by every request, failed connections and
+        # 502/503/504 are retried with backoff (POST isn't, it isn't idempotent)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            max_retries=Retry(
+                total=retries,
+                backoff_factor=backoff,
+                status_forcelist=(502, 503, 504),
+                raise_on_status=False,
+            ),
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    @property
+    def url(self):
+        if self._url is None:
+            ip_address = self.cache.get(
+                self.region,
+                endpoint_key(self.load_name),
+                lambda: load_balancer_dns(self.load_name, self.region),
             )
+            self._url = f"http://{ip_address}:8080/tasks"
+        return self._url
+
+    def invalidate(self):
+        # Forgets the cached endpoint, the next request looks it up again
+        self.cache.forget(self.region, endpoint_key(self.load_name))
+        self._url = None
+
+    def request(self, method: str, path: str = "", **kwargs):
+        # Raw response, for callers that handle status codes themselves
+        kwargs.setdefault("timeout", self.timeout)
+        try:
+            return self.session.request(method, self.url + path, **kwargs)
+
+        except requests.ConnectionError:
+            # A cached endpoint may belong to a LoadBalancer that was recreated
+            # since, so it's looked up again once before giving up
+            if not self.discovered:
+                raise
+            stale = self._url
+            self.invalidate()
+            if self.url == stale:
+                raise
+            return self.session.request(method, self.url + path, **kwargs)
+
+    def send(self, method: str, path: str = "", **kwargs):
+        response = self.request(method, path, **kwargs)
+        response.raise_for_status()
+        return response
+
+    def index(self):
+        return self.send("GET").text
+
+    def create_task(self, title: str, description: str, pub_date: str = None):
+        task = new_task(title, description, pub_date)
+        return self.send("POST", "/create_task", data=dumps(task)).text
+
+    def create_tasks(self, tasks, concurrency: int = None):
+        # Sends tasks (dicts with title, description and optionally pub_date)
+        # concurrently over the pool, at most `concurrency` in flight at a time
+        concurrency = concurrency or self.pool_size
+        results = []
+        in_flight = deque()
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for task in tasks:
+                if len(in_flight) >= concurrency:
+                    results.append(in_flight.popleft().result())
+                in_flight.append(
+                    pool.submit(lambda task=task: self.create_task(**task))
+                )
+
+            while in_flight:
+                results.append(in_flight.popleft().result())
+
+        return results
+
+    def get_tasks(self):
+        return self.send("GET", "/get_tasks").json()
+
+    def iter_tasks(self, chunk_size: int = 65536):
+        # Yields the tasks of a JSON list as they arrive, without loading the
+        # whole response in memory
+        decoder = JSONDecoder()
+        buffer = ""
+        in_list = None
+
+        with self.send("GET", "/get_tasks", stream=True) as response:
+            response.encoding = response.encoding or "utf-8"
+            for chunk in response.iter_content(chunk_size, decode_unicode=True):
+                buffer += chunk
+                if in_list is None:
+                    buffer = buffer.lstrip()
+                    if not buffer:
+                        continue
+                    in_list = buffer[0] == "["
+                    buffer = buffer[1:] if in_list else buffer
+
+                # Anything other than a list is parsed once it's complete
+                if not in_list:
+                    continue
+
+                while True:
+                    buffer = buffer.lstrip(" \t\r\n,")
+                    if not buffer or buffer[0] == "]":
+                        break
+                    try:
+                        task, end = decoder.raw_decode(buffer)
+                    except ValueError:
+                        break
+
+                    # The task may continue in the next chunk
+                    if end == len(buffer):
+                        break
+                    buffer = buffer[end:]
+                    yield task
+
+        if not in_list and buffer.strip():
+            document = decoder.decode(buffer)
+            yield from (document.values() if isinstance(document, dict) else [document])
+
+    def delete_tasks(self):
+        return self.send("DELETE", "/delete_tasks").text
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def menu(client: TaskClient):
+    while True:
+        try:
+            print("\nDatabase access\n")
+
+            print("0: Test index")
+            print("1: Create task")
+            print("2: Get all tasks")
+            print("3: Delete all tasks")
+
+            print("Type the number corresponding to the action you want.")
+            action = int(input("Action: "))
+
+            if action == 0:
+                print(f"\nResponse: {client.index()}")
+
+            if action == 1:
+                title = str(input("Task title: "))
+                description = str(input("Task description: "))
+                print(f"\nResponse: {client.create_task(title, description)}")
+
+            if action == 2:
+                print(f"\nResponse: {client.send('GET', '/get_tasks').text}")
+
+            if action == 3:
+                print(f"\nResponse: {client.delete_tasks()}")
+
+        except ValueError:
+            print("INVALID ACTION")
+            continue
 
-        if action == 2:
-            print(f"\nResponse: {requests.get(url + '/get_tasks').text}")
+        except (requests.RequestException, ClientError) as error:
+            print(f"\nERROR: {error}")
+            continue
 
-        if action == 3:
-            print(f"\nResponse: {requests.delete(url + '/delete_tasks').text}")
+        except (EOFError, KeyboardInterrupt):
+            break
 
-    except ValueError:
-        print("INVALID ACTION")
-        continue
 
-    except:
-        print("UNKNOWN ERROR")
-        break
+if __name__ == "__main__":
+    with TaskClient() as client:
+        menu(client)
@@ -0,0 +1,94 @@
+# Boto3 imports
+import boto3
+from botocore.config import Config
+
+# Shared API rate limiting
+from ratelimit import RateLimiter
+
+# Extra imports
+from threading import Lock
+from time import monotonic
+
+# Shared connection settings for every client built by the registry
+DEFAULT_CONFIG = Config(
+    max_pool_connections=32,
+    retries={"max_attempts": 8, "mode": "standard"},
+    connect_timeout=5,
+    read_timeout=30,
+)
+
+
+class ClientRegistry:
+    def __init__(self, config: Config = None, rate_limiter: RateLimiter = None):
+        self.config = config or DEFAULT_CONFIG
+
+        # Sessions aren't thread safe, so building clients goes through a lock
+        self.session = boto3.session.Session()
+        self.lock = Lock()
+
+        # Clients and resources keyed by (service, region)
+        self.clients = {}
+        self.resources = {}
+
+        # Startup cost of the clients built so far
+        self.built = 0
+        self.build_time = 0.0
+
+        # Functions called with every botocore client (to register event handlers)
+        self.hooks = []
+
+        # Account of the credentials, only looked up when first needed
+        self.account_id = None
+
+        # Every client in a region shares the same per service token bucket
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.hooks.append(self.rate_limiter.attach)
+
+    def build(self, cache: dict, factory, service: str, region: str):
+        key = (service, region)
+        with self.lock:
+            if key not in cache:
+                t0 = monotonic()
+                cache[key] = factory(service, region_name=region, config=self.config)
+                self.built += 1
+                self.build_time += monotonic() - t0
+
+                for hook in self.hooks:
+                    hook(self.botocore_client(cache[key]))
+            return cache[key]
+
+    def botocore_client(self, built):
+        # Resources wrap a botocore client, which is where the events live
+        return built.meta.client if hasattr(built.meta, "client") else built
+
+    def add_hook(self, hook):
+        # Applies to clients already built and to every client built later
+        with self.lock:
+            self.hooks.append(hook)
+            for built in list(self.clients.values()) + list(self.resources.values()):
+                hook(self.botocore_client(built))
+
+    def client(self, service: str, region: str):
+        return self.build(self.clients, self.session.client, service, region)
+
+    def resource(self, service: str, region: str):
+        return self.build(self.resources, self.session.resource, service, region)
+
+    def account(self, region: str):
+        # Two threads may both look it up the first time, which is harmless
+        if self.account_id is None:
+            identity = self.client("sts", region).get_caller_identity()
+            self.account_id = identity["Account"]
+        return self.account_id
+
+    def stats(self):
+        return {
+            "built": self.built,
+            "build_time": self.build_time,
+            "clients": sorted(self.clients),
+            "resources": sorted(self.resources),
+        }
+
+
+# Process-wide registry shared by every AWSDefault object
+registry = ClientRegistry()
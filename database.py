@@ -0,0 +1,273 @@
+# Extra imports
+from configparser import ConfigParser
+import hashlib
+import os
+
+# Memory (MB) of the instance types the database can run on
+INSTANCE_MEMORY = {
+    "t2.nano": 512,
+    "t2.micro": 1024,
+    "t2.small": 2048,
+    "t2.medium": 4096,
+    "t2.large": 8192,
+    "t3.micro": 1024,
+    "t3.small": 2048,
+    "t3.medium": 4096,
+    "t3.large": 8192,
+    "m5.large": 8192,
+    "m5.xlarge": 16384,
+    "r5.large": 16384,
+}
+
+# Ubuntu 18.04 (the base image) ships PostgreSQL 10
+PG_VERSION = "10"
+PG_DIR = f"/etc/postgresql/{PG_VERSION}/main"
+PG_DATA = f"/var/lib/postgresql/{PG_VERSION}/main"
+
+# Connections Postgres keeps for superusers and replication
+RESERVED_CONNECTIONS = 3
+
+# Credentials used by the task manager (same as scripts/postgres.sh)
+DB_NAME = "tasks"
+DB_USER = "cloud"
+DB_PASSWORD = "cloud"
+REPLICATION_USER = "replicator"
+
+# Defaults of the "database" block of a spec
+DEFAULTS = {
+    "instance_type": "t2.micro",
+    "pgbouncer": True,
+    "pool_mode": "session",
+    "pool_size": 20,
+    "max_client_conn": 500,
+    "replica": False,
+}
+
+
+def options(database: dict):
+    return {**DEFAULTS, **database}
+
+
+def postgres_port(database: dict):
+    # With PgBouncer, it takes 5432 (what Django connects to) and Postgres moves
+    return 5433 if options(database)["pgbouncer"] else 5432
+
+
+def postgres_settings(database: dict):
+    # postgresql.conf values sized to the memory of the instance type
+    database = options(database)
+    memory = INSTANCE_MEMORY[database["instance_type"]]
+
+    if database["pgbouncer"]:
+        # Only PgBouncer's server connections reach Postgres
+        max_connections = database["pool_size"] * 2 + 10
+    else:
+        max_connections = 100
+
+    shared_buffers = memory // 4
+    work_mem = max((memory - shared_buffers) // (max_connections * 4), 1)
+
+    return {
+        "listen_addresses": "'*'",
+        "port": postgres_port(database),
+        "max_connections": max_connections,
+        "superuser_reserved_connections": RESERVED_CONNECTIONS,
+        "shared_buffers": f"{shared_buffers}MB",
+        "effective_cache_size": f"{memory * 3 // 4}MB",
+        "work_mem": f"{work_mem}MB",
+        "maintenance_work_mem": f"{min(memory // 16, 1024)}MB",
+        "wal_level": "replica",
+        "max_wal_senders": 5 if database["replica"] else 0,
+        "wal_keep_segments": 64 if database["replica"] else 0,
+        "hot_standby": "on",
+    }
+
+
+def megabytes(value: str):
+    return int(str(value).rstrip("MB"))
+
+
+def postgresql_conf(database: dict):
+    lines = ["# Generated by database.py, included from postgresql.conf via conf.d"]
+    lines += [f"{key} = {value}" for key, value in postgres_settings(database).items()]
+    return "\n".join(lines) + "\n"
+
+
+def pgbouncer_ini(database: dict):
+    database = options(database)
+    return (
+        "[databases]\n"
+        f"{DB_NAME} = host=127.0.0.1 port={postgres_port(database)} dbname={DB_NAME}\n"
+        "\n"
+        "[pgbouncer]\n"
+        "listen_addr = *\n"
+        "listen_port = 5432\n"
+        "auth_type = md5\n"
+        "auth_file = /etc/pgbouncer/userlist.txt\n"
+        f"pool_mode = {database['pool_mode']}\n"
+        f"default_pool_size = {database['pool_size']}\n"
+        f"max_client_conn = {database['max_client_conn']}\n"
+        "server_reset_query = DISCARD ALL\n"
+    )
+
+
+def userlist(user: str = DB_USER, password: str = DB_PASSWORD):
+    # PgBouncer md5 format: "md5" + md5(password + user)
+    digest = hashlib.md5(f"{password}{user}".encode()).hexdigest()
+    return f'"{user}" "md5{digest}"\n'
+
+
+def primary_script(database: dict):
+    database = options(database)
+    lines = [
+        "#!/bin/bash",
+        "sudo apt update && sudo apt install postgresql postgresql-contrib -y",
+        f'sudo -u postgres sh -c "psql -c \\"CREATE USER {DB_USER} WITH PASSWORD \'{DB_PASSWORD}\';\\" && createdb -O {DB_USER} {DB_NAME}"',
+        "",
+        "# Tuned settings, conf.d is included by the default postgresql.conf",
+        f"sudo tee {PG_DIR}/conf.d/tuning.conf > /dev/null << 'EOF'",
+        postgresql_conf(database).rstrip("\n"),
+        "EOF",
+        f'sudo sed -i "$ a\\host all all 0.0.0.0/0 md5" {PG_DIR}/pg_hba.conf',
+    ]
+
+    if database["replica"]:
+        lines += [
+            "",
+            "# Streaming replication from the replica (same security group)",
+            f'sudo -u postgres sh -c "psql -c \\"CREATE USER {REPLICATION_USER} WITH REPLICATION PASSWORD \'{DB_PASSWORD}\';\\""',
+            f'sudo sed -i "$ a\\host replication {REPLICATION_USER} 0.0.0.0/0 md5" {PG_DIR}/pg_hba.conf',
+        ]
+
+    lines += ["", "sudo systemctl restart postgresql"]
+
+    if database["pgbouncer"]:
+        lines += [
+            "",
+            "# PgBouncer takes port 5432, so Django connects through the pool",
+            "sudo apt install pgbouncer -y",
+            "sudo sed -i 's/START=0/START=1/' /etc/default/pgbouncer",
+            "sudo tee /etc/pgbouncer/pgbouncer.ini > /dev/null << 'EOF'",
+            pgbouncer_ini(database).rstrip("\n"),
+            "EOF",
+            "sudo tee /etc/pgbouncer/userlist.txt > /dev/null << 'EOF'",
+            userlist().rstrip("\n"),
+            "EOF",
+            "sudo systemctl enable pgbouncer",
+            "sudo systemctl restart pgbouncer",
+        ]
+
+    return "\n".join(lines) + "\n"
+
+
+def replica_script(database: dict, primary_ip: str):
+    database = options(database)
+    port = postgres_port(database)
+    return (
+        "\n".join(
+            [
+                "#!/bin/bash",
+                "sudo apt update && sudo apt install postgresql postgresql-contrib -y",
+                "sudo systemctl stop postgresql",
+                "",
+                "# Same tuning as the primary, then a copy of its data kept in sync",
+                f"sudo tee {PG_DIR}/conf.d/tuning.conf > /dev/null << 'EOF'",
+                postgresql_conf(database).rstrip("\n"),
+                "EOF",
+                f"sudo rm -rf {PG_DATA}",
+                f'until sudo -u postgres sh -c "PGPASSWORD={DB_PASSWORD} pg_basebackup -h {primary_ip} -p {port} -U {REPLICATION_USER} -D {PG_DATA} -X stream -R"; do sleep 10; done',
+                f'sudo sed -i "$ a\\host all all 0.0.0.0/0 md5" {PG_DIR}/pg_hba.conf',
+                "sudo systemctl start postgresql",
+            ]
+        )
+        + "\n"
+    )
+
+
+def validate_database(database: dict):
+    # Offline checks of the generated configuration, returns a list of problems
+    database = options(database)
+    problems = []
+
+    if database["instance_type"] not in INSTANCE_MEMORY:
+        return [f"unknown instance type {database['instance_type']}"]
+    if database["pool_mode"] not in ("session", "transaction", "statement"):
+        problems.append(f"unknown pool_mode {database['pool_mode']}")
+
+    settings = postgres_settings(database)
+    memory = INSTANCE_MEMORY[database["instance_type"]]
+    shared_buffers = megabytes(settings["shared_buffers"])
+    work_mem = megabytes(settings["work_mem"])
+
+    if shared_buffers > memory * 0.4:
+        problems.append(
+            f"shared_buffers {shared_buffers}MB is over 40% of {memory}MB of memory"
+        )
+    if shared_buffers + work_mem * settings["max_connections"] > memory * 0.9:
+        problems.append(
+            f"shared_buffers plus work_mem for every connection is over 90% of {memory}MB"
+        )
+
+    if database["pgbouncer"]:
+        available = (
+            settings["max_connections"]
+            - settings["superuser_reserved_connections"]
+            - settings["max_wal_senders"]
+        )
+        if database["pool_size"] > available:
+            problems.append(
+                f"pool_size {database['pool_size']} is over the {available} connections Postgres accepts"
+            )
+        if database["max_client_conn"] < database["pool_size"]:
+            problems.append("max_client_conn is below pool_size")
+
+        # The rendered file has to parse as an ini file
+        parser = ConfigParser()
+        parser.read_string(pgbouncer_ini(database))
+        if parser["pgbouncer"].getint("listen_port") == settings["port"]:
+            problems.append("PgBouncer and Postgres listen on the same port")
+
+    if database["replica"] and (
+        settings["wal_level"] != "replica" or settings["max_wal_senders"] < 1
+    ):
+        problems.append("the replica needs wal_level replica and max_wal_senders")
+
+    return problems
+
+
+def dry_run(database: dict, render: str = None):
+    database = options(database)
+    print(f"\nValidating database on {database['instance_type']} (no AWS calls)...")
+    settings = postgres_settings(database)
+    for key in ("max_connections", "shared_buffers", "work_mem", "port"):
+        print(f"  {key:<22}{settings[key]}")
+    print(
+        f"  {'pgbouncer':<22}{'pool of ' + str(database['pool_size']) if database['pgbouncer'] else 'off'}"
+    )
+    print(f"  {'replica':<22}{'on' if database['replica'] else 'off'}")
+
+    # Writes the generated files, to inspect them or run them through other tools
+    if render:
+        os.makedirs(render, exist_ok=True)
+        files = {
+            "postgresql.conf": postgresql_conf(database),
+            "primary.sh": primary_script(database),
+        }
+        if database["pgbouncer"]:
+            files["pgbouncer.ini"] = pgbouncer_ini(database)
+        if database["replica"]:
+            files["replica.sh"] = replica_script(database, "PRIMARY_IP")
+        for name, content in files.items():
+            with open(os.path.join(render, name), "w") as f:
+                f.write(content)
+        print(f"Generated files written to {render}.")
+
+    problems = validate_database(database)
+    if problems:
+        print(f"Database configuration is invalid ({len(problems)} found):")
+    else:
+        print("Database configuration is valid.")
+    for problem in problems:
+        print(f"  - {problem}")
+
+    return problems
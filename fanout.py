@@ -0,0 +1,249 @@
+# Import AWS classes
+from aws_create import AWSCreate
+from aws_delete import AWSDelete
+
+# AMI cache
+from ami_cache import AMICache
+
+# Dependency graph shared with the rest of the deploy
+from scheduler import Scheduler
+
+
+def require(value, what: str):
+    # The AWS methods print their errors and return None, this turns that into a failure
+    if value is None:
+        raise RuntimeError(f"{what} failed")
+    return value
+
+
+class RegionDeployment:
+    def __init__(self, spec: dict):
+        self.spec = spec
+        self.region = spec["region"]
+
+        tags = spec["tags"]
+        self.create = AWSCreate(
+            region=self.region,
+            key_tags=tags["key"],
+            security_tags=tags["security"],
+            instance_tags=tags["instance"],
+        )
+        self.delete = AWSDelete(
+            region=self.region,
+            key_tags=tags["key"],
+            security_tags=tags["security"],
+            instance_tags=tags["instance"],
+        )
+        self.ami_cache = AMICache(self.create, prefix=spec["ami"]["name"])
+
+    @property
+    def launch_step(self):
+        # Launch templates replace the legacy launch configurations when in the spec
+        if "launch_template" in self.spec:
+            return "launch_template"
+        return "launch_configuration"
+
+    def clear(self):
+        # Cached AMIs (named <ami name>-<hash>) are left for the next deploy,
+        # AMICache.evict is what removes them
+        self.delete.teardown_region(
+            auto_name=self.spec["autoscaling"]["name"],
+            load_name=self.spec["load_balancer"]["name"],
+            launch_name=self.spec.get("launch_configuration", {}).get("name"),
+            template_name=self.spec.get("launch_template", {}).get("name"),
+        )
+
+    def key_pair(self):
+        self.create.generate_key_pair(
+            keyname=self.spec["key_pair"]["name"],
+            filename=self.spec["key_pair"]["filename"],
+        )
+
+    def security_group(self):
+        return require(
+            self.create.create_security_group(
+                sec_group_name=self.spec["security_group"]["name"],
+                permissions=self.spec["security_group"]["permissions"],
+            ),
+            f"Security group in {self.region}",
+        )
+
+    def load_balancer(self):
+        return require(
+            self.create.create_load_balancer(
+                load_name=self.spec["load_balancer"]["name"],
+                security_group=self.spec["security_group"]["name"],
+                load_tags=self.spec["tags"]["load_balancer"],
+            ),
+            f"LoadBalancer in {self.region}",
+        )
+
+    def bake(self):
+        # The bake script doesn't depend on the Postgres IP, so it starts right away
+        with open(self.spec["instance"]["user_data"], "r") as b:
+            bake_script = b.read()
+
+        image = self.spec["instance"]["image"]
+        ami_id = self.ami_cache.get_or_bake(
+            self.create, self.delete, image, bake_script
+        )
+        require(ami_id, f"AMI bake in {self.region}")
+        return ami_id, self.ami_cache.key(image, bake_script)
+
+    def copy(self, source_region: str, source: tuple):
+        source_image_id, key = source
+        return require(
+            self.ami_cache.get_or_copy(
+                self.create, source_region, source_image_id, key
+            ),
+            f"AMI copy to {self.region}",
+        )
+
+    def launch_configuration(self, user_data: str):
+        return require(
+            self.create.create_launch_configuration(
+                launch_name=self.spec["launch_configuration"]["name"],
+                instance_type=self.spec.get("instance_type", "t2.micro"),
+                user_data=user_data,
+            ),
+            f"Launch configuration in {self.region}",
+        )
+
+    def launch_template(self, user_data: str):
+        return require(
+            self.create.create_launch_template(
+                template_name=self.spec["launch_template"]["name"],
+                instance_type=self.spec.get("instance_type", "t2.micro"),
+                user_data=user_data,
+            ),
+            f"Launch template in {self.region}",
+        )
+
+    def autoscaling(self):
+        sizes = self.spec["autoscaling"]
+        return require(
+            self.create.create_autoscaling(
+                auto_name=sizes["name"],
+                launch_name=self.spec[self.launch_step]["name"],
+                load_name=self.spec["load_balancer"]["name"],
+                min_size=sizes["min_size"],
+                max_size=sizes["max_size"],
+                desired=sizes["desired"],
+                launch_template=self.launch_step == "launch_template",
+                warm_pool=sizes.get("warm_pool"),
+                scaling=sizes.get("scaling"),
+            ),
+            f"Autoscaling in {self.region}",
+        )
+
+
+class MultiRegionDeploy:
+    def __init__(self, specs: list, scheduler: Scheduler):
+        self.scheduler = scheduler
+        self.deployments = [RegionDeployment(spec) for spec in specs]
+
+        # The first region bakes the AMI, every other region copies it
+        self.home = self.deployments[0]
+
+    def task(self, deployment: RegionDeployment, step: str):
+        return f"{deployment.region}:{step}"
+
+    def add_tasks(self, user_data_task: str, clear_deps: list = ()):
+        # user_data_task returns the launch user data (with the Postgres IP)
+        self.add_region_tasks(clear_deps)
+        self.add_launch_tasks(user_data_task)
+
+    def add_region_tasks(self, clear_deps: list = ()):
+        # Everything that doesn't need the launch user data, so tasks that
+        # depend on a region's resources (e.g. its security group) can be added
+        # before the launch tasks
+        scheduler = self.scheduler
+        bake = self.task(self.home, "ami")
+
+        for deployment in self.deployments:
+
+            def name(step: str, deployment=deployment):
+                return self.task(deployment, step)
+
+            scheduler.add(name("clear"), deployment.clear, deps=list(clear_deps))
+            scheduler.add(name("key_pair"), deployment.key_pair, deps=[name("clear")])
+            scheduler.add(
+                name("security_group"),
+                deployment.security_group,
+                deps=[name("clear")],
+            )
+            scheduler.add(
+                name("load_balancer"),
+                deployment.load_balancer,
+                deps=[name("security_group")],
+            )
+
+            if deployment is self.home:
+                scheduler.add(
+                    bake,
+                    self.home.bake,
+                    deps=[name("key_pair"), name("security_group")],
+                )
+            else:
+                scheduler.add(
+                    name("ami"),
+                    lambda deployment=deployment: deployment.copy(
+                        self.home.region, scheduler.result(bake)
+                    ),
+                    deps=[bake],
+                )
+
+    def add_launch_tasks(self, user_data_task: str):
+        scheduler = self.scheduler
+
+        for deployment in self.deployments:
+
+            def name(step: str, deployment=deployment):
+                return self.task(deployment, step)
+
+            launch_step = deployment.launch_step
+            scheduler.add(
+                name(launch_step),
+                lambda launch=getattr(deployment, launch_step): launch(
+                    scheduler.result(user_data_task)
+                ),
+                deps=[
+                    name("ami"),
+                    name("key_pair"),
+                    name("security_group"),
+                    user_data_task,
+                ],
+            )
+            scheduler.add(
+                name("autoscaling"),
+                deployment.autoscaling,
+                deps=[name(launch_step), name("load_balancer")],
+            )
+
+    def report(self):
+        print("\nRegion report")
+        print(f"{'Region':<20}{'Duration':>10}  Status")
+
+        for deployment in self.deployments:
+            tasks = [
+                task
+                for name, task in self.scheduler.tasks.items()
+                if name.startswith(f"{deployment.region}:")
+            ]
+            started = [task for task in tasks if task.start is not None]
+            duration = (
+                max(task.end for task in started) - min(task.start for task in started)
+                if started
+                else 0
+            )
+
+            failed = [task.name for task in tasks if task.error is not None]
+            skipped = [task for task in tasks if task.skipped]
+            if failed:
+                status = f"failed ({', '.join(failed)})"
+            elif skipped:
+                status = "incomplete (a dependency failed)"
+            else:
+                status = "ok"
+
+            print(f"{deployment.region:<20}{duration:>9.1f}s  {status}")
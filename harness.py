@@ -0,0 +1,414 @@
+# Deploy flow and AWS classes
+import aws
+import aws_delete
+from aws_create import AWSCreate
+from aws_delete import AWSDelete
+from clients import ClientRegistry
+from fanout import RegionDeployment
+import main
+from ratelimit import DEFAULT_RATES, RateLimiter
+from scheduler import Scheduler
+from tracing import Tracer
+from wait import Waiter
+
+# Boto3 imports
+import boto3
+
+# Extra imports
+from argparse import ArgumentParser
+from contextlib import contextmanager, ExitStack, redirect_stdout
+from functools import partial
+import json
+import os
+import shutil
+import tempfile
+import threading
+from time import perf_counter
+from unittest.mock import patch
+
+# Local AWS stand-in, optional like everything the deploy itself doesn't need
+try:
+    from moto import mock_aws
+except ImportError:
+    mock_aws = None
+
+# Phases run in order on the same (mocked) account
+PHASES = ["rebuild", "rebuild_again", "plan", "teardown"]
+
+
+class VirtualClock:
+    # Per-thread virtual time: sleeping only advances the calling thread, so
+    # waits in concurrent tasks overlap like they do for real
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.slept = 0.0
+
+    def time(self):
+        return getattr(self.local, "now", 0.0)
+
+    def set(self, t: float):
+        self.local.now = t
+
+    def sleep(self, t: float):
+        self.local.now = self.time() + t
+        with self.lock:
+            self.slept += t
+
+
+class VirtualScheduler(Scheduler):
+    # Tasks start in virtual time when their last dependency ended (the worker
+    # limit isn't simulated), and every task is a span of the tracer
+    def __init__(self, max_workers: int = 8, clock: VirtualClock = None, tracer=None):
+        super().__init__(max_workers, clock=clock.time)
+        self.virtual = clock
+        self.tracer = tracer
+
+    def run(self):
+        results = super().run()
+
+        # The caller resumes once the last task has ended
+        ends = [task.end for task in self.tasks.values() if task.end is not None]
+        self.virtual.set(max([self.t0] + ends))
+        return results
+
+    def execute(self, task):
+        deps = [self.tasks[dep].end for dep in task.deps]
+        self.virtual.set(max([self.t0] + deps))
+
+        # Steps of a nested scheduler (a region's teardown) are named after
+        # the task that runs it, e.g. ohio_clear/instances. Calls made by the
+        # task also count towards the caller's spans, opened in its context
+        parents = [
+            span["name"] for span in self.tracer.stack() if span["cat"] == "task"
+        ]
+        with self.tracer.span("/".join(parents[-1:] + [task.name]), cat="task"):
+            return super().execute(task)
+
+
+def simulate_bake(clock: VirtualClock, bake_time: float):
+    # Nothing runs the bake script in moto, so the instance is stopped (like
+    # the script's shutdown does) bake_time virtual seconds after it is first
+    # polled, with a client of its own so the call isn't counted. Returns the
+    # replacement for AWSCreate.instance_state
+    polled = {}
+    instance_state = AWSCreate.instance_state
+
+    def simulated(self, instance_id: str):
+        started = polled.setdefault(instance_id, clock.time())
+        if clock.time() - started >= bake_time:
+            boto3.client("ec2", region_name=self.region).stop_instances(
+                InstanceIds=[instance_id]
+            )
+        return instance_state(self, instance_id)
+
+    return simulated
+
+
+def moto_gaps(client):
+    # AWS behaviours moto doesn't have, filled in with a client of its own so
+    # the extra calls aren't counted
+    if client.meta.service_model.service_name != "ec2":
+        return
+    ec2 = boto3.client("ec2", region_name=client.meta.region_name)
+
+    def prune_interfaces(**kwargs):
+        # AWS deletes the network interfaces of terminated instances, moto
+        # keeps them and security group deletions wait on them forever
+        terminated = ec2.describe_instances(
+            Filters=[{"Name": "instance-state-name", "Values": ["terminated"]}]
+        )["Reservations"]
+        instance_ids = [
+            instance["InstanceId"]
+            for reservation in terminated
+            for instance in reservation["Instances"]
+        ]
+        if not instance_ids:
+            return
+        for interface in ec2.describe_network_interfaces(
+            Filters=[{"Name": "attachment.instance-id", "Values": instance_ids}]
+        )["NetworkInterfaces"]:
+            ec2.delete_network_interface(
+                NetworkInterfaceId=interface["NetworkInterfaceId"]
+            )
+
+    client.meta.events.register(
+        "before-call.ec2.DescribeNetworkInterfaces", prune_interfaces
+    )
+
+
+def api_latency(clock: VirtualClock, latency: float):
+    # Every API call takes `latency` virtual seconds in the calling thread
+    def hook(client):
+        client.meta.events.register(
+            "before-call.*.*", lambda **kwargs: clock.sleep(latency)
+        )
+
+    return hook
+
+
+@contextmanager
+def virtualize(clock: VirtualClock, tracer: Tracer, latency: float, bake_time: float):
+    # Fresh clients (created inside the mock) without real rate limiting
+    registry = ClientRegistry(
+        rate_limiter=RateLimiter({service: (1e6, 1e6) for service in DEFAULT_RATES})
+    )
+    registry.add_hook(tracer.attach)
+    registry.add_hook(api_latency(clock, latency))
+    registry.add_hook(moto_gaps)
+
+    # Regions of every AWS object, to compare with building clients per object
+    objects = []
+    init = aws.AWSDefault.__init__
+
+    def counted(self, region: str, *args, **kwargs):
+        objects.append(region)
+        init(self, region, *args, **kwargs)
+
+    # Polling loops and timing reports use the virtual clock, without jitter
+    # so runs can be compared. Everything is put back once the run is over
+    scheduler = partial(VirtualScheduler, clock=clock, tracer=tracer)
+    with ExitStack() as patches:
+        for target, attribute, value in [
+            (aws, "registry", registry),
+            (aws, "Waiter", partial(Waiter, clock=clock, jitter=0)),
+            (main, "Scheduler", scheduler),
+            (aws_delete, "Scheduler", scheduler),
+            (AWSCreate, "instance_state", simulate_bake(clock, bake_time)),
+            (aws.AWSDefault, "__init__", counted),
+        ]:
+            patches.enter_context(patch.object(target, attribute, value))
+        yield registry, objects
+
+
+def direct_build_time(regions: list):
+    # Time the same objects took to start when each one built its own EC2
+    # client and resource, ELB and autoscaling clients (before the registry)
+    session = boto3.session.Session()
+    t0 = perf_counter()
+    for region in regions:
+        session.client("ec2", region_name=region)
+        session.resource("ec2", region_name=region)
+        session.client("elb", region_name=region)
+        session.client("autoscaling", region_name=region)
+    return perf_counter() - t0
+
+
+def teardown():
+    # Deletes both database locations and every web region
+    scheduler = main.Scheduler()
+    scheduler.add(
+        "ohio_clear",
+        AWSDelete(
+            region=main.oh_region,
+            key_tags=main.oh_key_tag,
+            security_tags=main.sec_group_tag,
+            instance_tags=main.oh_instance_tag,
+        ).teardown_region,
+    )
+    scheduler.add(
+        "colocated_clear",
+        lambda: main.clear_colocated(
+            AWSDelete(
+                region=main.web_regions[0]["region"],
+                key_tags=main.nv_key_tag,
+                security_tags=main.colocated_sec_group_tag,
+                instance_tags=main.colocated_instance_tag,
+            )
+        ),
+    )
+    for spec in main.web_regions:
+        scheduler.add(
+            f"{spec['region']}:clear",
+            RegionDeployment(spec).clear,
+            deps=["colocated_clear"],
+        )
+    scheduler.run()
+
+
+def run_phase(name: str, tracer: Tracer, clock: VirtualClock, topology: str):
+    t0 = clock.time()
+    real = perf_counter()
+    spans = len(tracer.spans)
+
+    with tracer.span(name) as phase:
+        if name in ("rebuild", "rebuild_again"):
+            main.rebuild(topology)
+        elif name == "plan":
+            main.reconcile(apply=False)
+        else:
+            teardown()
+
+    # Every API call of the phase by operation
+    operations = {}
+    calls = [span for span in tracer.spans[spans:] if span["cat"] == "api"]
+    for span in calls:
+        operations[span["name"]] = operations.get(span["name"], 0) + 1
+
+    return {
+        "virtual": clock.time() - t0,
+        "real": perf_counter() - real,
+        "api_calls": len(calls),
+        "errors": len([span for span in calls if span["args"].get("error")]),
+        "operations": dict(sorted(operations.items(), key=lambda item: -item[1])),
+        "tasks": [
+            {
+                "name": span["name"],
+                "start": span["start"] - t0,
+                "duration": span["end"] - span["start"],
+                "api_calls": span["api_calls"],
+            }
+            for span in sorted(tracer.spans[spans:], key=lambda span: span["start"])
+            if span["cat"] == "task"
+        ],
+    }
+
+
+def run(topology: str, latency: float, bake_time: float, log: str):
+    # Runs every phase against moto, in a scratch folder for the key files
+    clock = VirtualClock()
+    tracer = Tracer(clock=clock.time)
+    cwd = os.getcwd()
+    results = {
+        "config": {
+            "topology": topology,
+            "api_latency": latency,
+            "bake_time": bake_time,
+        },
+        "phases": {},
+    }
+
+    with tempfile.TemporaryDirectory() as scratch, open(log, "w") as output:
+        shutil.copytree(os.path.join(cwd, "scripts"), os.path.join(scratch, "scripts"))
+        os.chdir(scratch)
+        try:
+            with mock_aws(), redirect_stdout(output), virtualize(
+                clock, tracer, latency, bake_time
+            ) as (registry, objects):
+                for name in PHASES:
+                    # plan only knows the cross-region topology, like main.py
+                    if name == "plan" and topology != "cross-region":
+                        continue
+                    results["phases"][name] = run_phase(name, tracer, clock, topology)
+        finally:
+            os.chdir(cwd)
+
+    stats = registry.stats()
+    results["clients_built"] = stats["built"]
+    results["client_build_time"] = stats["build_time"]
+    results["objects"] = len(objects)
+    results["direct_build_time"] = direct_build_time(objects)
+    results["slept"] = clock.slept
+    return results
+
+
+def print_results(results: dict, top: int = 5):
+    config = results["config"]
+    print(
+        f"\nOffline run ({config['topology']}, {config['api_latency'] * 1000:g}ms per API call, {config['bake_time']:g}s bake)"
+    )
+    print(
+        f"{'Phase':<16}{'Simulated':>11}{'Real':>9}{'API calls':>11}{'API errors':>12}"
+    )
+    for name, phase in results["phases"].items():
+        print(
+            f"{name:<16}{phase['virtual']:>10.1f}s{phase['real']:>8.1f}s{phase['api_calls']:>11}{phase['errors']:>12}"
+        )
+
+    print(
+        f"Built {results['clients_built']} boto3 clients for {results['objects']} AWS objects in {results['client_build_time']:.2f}s, building 4 per object ({4 * results['objects']}) takes {results['direct_build_time']:.2f}s (real time)."
+    )
+
+    for name, phase in results["phases"].items():
+        # Wide enough for nested steps, e.g. ohio_clear/security_group/sg-...
+        width = max([36] + [len(task["name"]) + 2 for task in phase["tasks"]])
+        print(f"\n{name}")
+        print(f"  {'Task':<{width}}{'Start':>9}{'Duration':>10}{'API calls':>11}")
+        for task in phase["tasks"]:
+            print(
+                f"  {task['name']:<{width}}{task['start']:>8.1f}s{task['duration']:>9.1f}s{task['api_calls']:>11}"
+            )
+        busiest = list(phase["operations"].items())[:top]
+        print(
+            "  Most called: "
+            + ", ".join(f"{operation} x{count}" for operation, count in busiest)
+        )
+
+
+def regressions(results: dict, baseline: dict, tolerance: float):
+    # Phases that got slower or make more API calls than the baseline
+    problems = []
+    for name, phase in results["phases"].items():
+        before = baseline["phases"].get(name)
+        if not before:
+            continue
+        for metric in ("virtual", "api_calls"):
+            if phase[metric] > before[metric] * (1 + tolerance) + 1e-9:
+                problems.append(
+                    f"{name}: {metric} went from {before[metric]:g} to {phase[metric]:g}"
+                )
+    return problems
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        description="Runs the deploy flow against moto with virtual time and reports API calls per phase."
+    )
+    parser.add_argument(
+        "--topology", default="cross-region", choices=["cross-region", "colocated"]
+    )
+    parser.add_argument(
+        "--api-latency",
+        type=float,
+        default=0.1,
+        help="virtual seconds every API call takes",
+    )
+    parser.add_argument(
+        "--bake-time",
+        type=float,
+        default=300,
+        help="virtual seconds the bake script takes",
+    )
+    parser.add_argument(
+        "--log", default=os.devnull, help="file receiving the deploy's own output"
+    )
+    parser.add_argument("--json", metavar="PATH", help="writes the results as JSON")
+    parser.add_argument(
+        "--baseline",
+        metavar="PATH",
+        help="results of an earlier run (--json), exits with 1 if a phase regressed",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.05,
+        help="allowed growth against the baseline, 0.05 is 5%%",
+    )
+    args = parser.parse_args()
+
+    if mock_aws is None:
+        raise SystemExit(
+            "The offline harness needs moto: pip install 'moto[ec2,elb,autoscaling]'"
+        )
+
+    # moto only needs credentials to exist
+    for variable in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"):
+        os.environ[variable] = "testing"
+
+    results = run(args.topology, args.api_latency, args.bake_time, args.log)
+    print_results(results)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.json}.")
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            problems = regressions(results, json.load(f), args.tolerance)
+        if problems:
+            print(f"\nRegressions against {args.baseline}:")
+            for problem in problems:
+                print(f"  - {problem}")
+            raise SystemExit(1)
+        print(f"\nNo regressions against {args.baseline}.")
@@ -1,5 +1,19 @@
+from ami_cache import AMICache, hash_tag
+from aws import AWSDefault
 from aws_create import AWSCreate
 from aws_delete import AWSDelete
+from clients import registry
+from database import dry_run as database_dry_run, options, postgres_port, primary_script
+from fanout import MultiRegionDeploy, RegionDeployment, require
+from network import CACHE_PATH, network
+from reconcile import Reconciler
+from scaling import dry_run
+from scheduler import Scheduler
+from state import STATE_PATH, store
+from tracing import Tracer
+
+# Extra imports
+from argparse import ArgumentParser
 
 ################### PARAMETERS ###################
 
@@ -11,7 +25,33 @@ oh_img_id = "ami-0dd9f0e7df0f0a138"
 nv_region = "us-east-1"
 oh_region = "us-east-2"
 
+# Postgres on Ohio, behind PgBouncer (port 5432, where Django connects) and
+# with tuned settings sized to the instance type, checked with "validate"
+ohio_database = {
+    "instance_type": "t2.micro",
+    "pgbouncer": True,
+    "pool_mode": "session",
+    "pool_size": 20,
+    "max_client_conn": 500,
+    # Streaming read replica of the primary
+    "replica": False,
+}
+
 # Security Groups
+# The replica reaches Postgres directly (not through PgBouncer) from the same group
+replica_permissions = (
+    [
+        {
+            "FromPort": postgres_port(ohio_database),
+            "IpProtocol": "tcp",
+            "UserIdGroupPairs": [{"GroupId": "self"}],
+            "ToPort": postgres_port(ohio_database),
+        }
+    ]
+    if options(ohio_database)["replica"]
+    else []
+)
+
 ohio_permissions = [
     {
         "FromPort": 22,
@@ -25,7 +65,26 @@ ohio_permissions = [
         "IpRanges": [{"CidrIp": "0.0.0.0/0"}],
         "ToPort": 5432,
     },
-]
+] + replica_permissions
+
+
+def colocated_permissions(web_group_id: str):
+    # Postgres next to the web tier is only reachable from the web security group
+    return [
+        {
+            "FromPort": 22,
+            "IpProtocol": "tcp",
+            "IpRanges": [{"CidrIp": "0.0.0.0/0"}],
+            "ToPort": 22,
+        },
+        {
+            "FromPort": 5432,
+            "IpProtocol": "tcp",
+            "UserIdGroupPairs": [{"GroupId": web_group_id}],
+            "ToPort": 5432,
+        },
+    ] + replica_permissions
+
 
 north_virginia_permissions = [
     {
@@ -50,27 +109,124 @@ oh_key_tag = {"Key": "Name", "Value": "key_tag_bruno_ohio"}
 
 # Security Group
 sec_group_tag = {"Key": "Name", "Value": "security_tags_bruno"}
+colocated_sec_group_tag = {"Key": "Name", "Value": "database_security_tags_bruno"}
 
 # Instances
 nv_instance_tag = {"Key": "Name", "Value": "instance_tag_bruno_nv"}
 oh_instance_tag = {"Key": "Name", "Value": "instance_tag_bruno_ohio"}
+colocated_instance_tag = {"Key": "Name", "Value": "database_tag_bruno_nv"}
 
 # Load Balancer
 nv_load_tag = {"Key": "Name", "Value": "load_balancer_tag_bruno_nv"}
 
 
-if __name__ == "__main__":
+####################### DESIRED STATE #######################
 
-    ######################## RUNNING OHIO INSTANCE ########################
+# Used by the plan/apply reconciler
+ohio_spec = {
+    "key_pair": {"name": "brunosd1_ohio", "filename": "ohio_instance"},
+    "security_group": {"name": "postgres", "permissions": ohio_permissions},
+    "instance": {"image": oh_img_id, "user_data": "scripts/postgres.sh"},
+    # Generates the user data instead of scripts/postgres.sh, remove to use it
+    "database": ohio_database,
+}
+
+nv_spec = {
+    "region": nv_region,
+    "instance_type": "t2.micro",
+    "tags": {
+        "key": nv_key_tag,
+        "security": sec_group_tag,
+        "instance": nv_instance_tag,
+        "load_balancer": nv_load_tag,
+    },
+    "key_pair": {"name": "brunosd1_nv", "filename": "nv_instance"},
+    "security_group": {"name": "orm-bruno", "permissions": north_virginia_permissions},
+    # Bake stage (baked into the AMI) and launch stage (run by every instance)
+    "instance": {"image": nv_img_id, "user_data": "scripts/django_bake.sh"},
+    "ami": {"name": "django_ami_bruno"},
+    "load_balancer": {"name": "lb-bruno-nv", "tags": nv_load_tag},
+    "launch_template": {
+        "name": "launch_template_bruno_nv",
+        "user_data": "scripts/django_launch.sh",
+    },
+    "autoscaling": {
+        "name": "autoscaling_bruno_nv",
+        "min_size": 2,
+        "max_size": 3,
+        "desired": 2,
+        # Stopped instances kept ready for scale-outs
+        "warm_pool": {"min_size": 1, "pool_state": "Stopped"},
+        # Target tracking (CPU % and requests per instance per minute) and
+        # scheduled capacity for the weekday peak, checked with "validate"
+        "scaling": {
+            "cpu_target": 50,
+            "requests_per_instance": 600,
+            "warmup": 120,
+            "scheduled": [
+                {
+                    "name": "weekday_peak",
+                    "recurrence": "0 12 * * MON-FRI",
+                    "min_size": 3,
+                    "max_size": 5,
+                },
+                {
+                    "name": "weekday_off_peak",
+                    "recurrence": "0 22 * * MON-FRI",
+                    "min_size": 2,
+                    "max_size": 3,
+                },
+            ],
+        },
+    },
+}
+
+# Regions running the web tier, all pointing at the Ohio database.
+# The first one bakes the Django AMI and the others copy it.
+web_regions = [nv_spec]
+
+
+def postgres_user_data():
+    if "database" in ohio_spec:
+        return primary_script(ohio_spec["database"])
+
+    with open(ohio_spec["instance"]["user_data"], "r") as p:
+        return p.read()
 
-    # Reads postgres script
-    with open("scripts/postgres.sh", "r") as p:
-        postgres_script = p.read()
 
-    # Sets postgres IP address
-    postgres_ip = 0
+def clear_colocated(delete: AWSDelete):
+    # Its security group references the web one, so it goes before the web region
+    delete.delete_instances()
+    delete.delete_security_group()
 
-    # Deletes everything before creation
+
+def create_colocated(create: AWSCreate, postgres_script: str):
+    # Shares the web region's key pair and is reached through its private IP
+    spec = web_regions[0]
+    create.key_pair_name = spec["key_pair"]["name"]
+    require(
+        create.create_database(
+            img_id=spec["instance"]["image"],
+            database=ohio_spec.get("database", {}),
+            user_data=postgres_script,
+            tags=[hash_tag(spec["instance"]["image"], postgres_script)],
+        ),
+        "Colocated database",
+    )
+    return create.private_ip(create.instance_id)
+
+
+def rebuild(topology: str = "cross-region"):
+    # Runs independent steps of every region concurrently on a bounded pool
+    scheduler = Scheduler(max_workers=8)
+
+    # Generates (or reads) the postgres script
+    postgres_script = postgres_user_data()
+
+    ######################## RUNNING OHIO INSTANCE ########################
+
+    # Deletes everything before creation (with either topology, so switching
+    # doesn't leave the other database running)
     print("\nClearing Ohio region...")
     ohio_delete = AWSDelete(
         region=oh_region,
@@ -79,76 +235,275 @@ if __name__ == "__main__":
         instance_tags=oh_instance_tag,
     )
 
-    ohio_delete.delete_instances()
-    ohio_delete.delete_security_group()
-    ohio_delete.delete_key_pairs()
+    scheduler.add("ohio_clear", ohio_delete.teardown_region)
 
-    # Creates and starts the instance
-    print("\nCreating Ohio instance...")
-    ohio_create = AWSCreate(
-        region=oh_region,
-        key_tags=oh_key_tag,
-        security_tags=sec_group_tag,
-        instance_tags=oh_instance_tag,
-    )
+    if topology == "cross-region":
+        # Creates and starts the instance
+        print("\nCreating Ohio instance...")
+        ohio_create = AWSCreate(
+            region=oh_region,
+            key_tags=oh_key_tag,
+            security_tags=sec_group_tag,
+            instance_tags=oh_instance_tag,
+        )
 
-    ohio_create.generate_key_pair(keyname="brunosd1_ohio", filename="ohio_instance")
-    ohio_create.create_security_group(
-        sec_group_name="postgres", permissions=ohio_permissions
-    )
-    postgres_ip = ohio_create.create_instance(
-        img_id=oh_img_id, user_data=postgres_script
+        scheduler.add(
+            "ohio_key_pair",
+            lambda: ohio_create.generate_key_pair(
+                keyname="brunosd1_ohio", filename="ohio_instance"
+            ),
+            deps=["ohio_clear"],
+        )
+        scheduler.add(
+            "ohio_security_group",
+            lambda: ohio_create.create_security_group(
+                sec_group_name="postgres", permissions=ohio_permissions
+            ),
+            deps=["ohio_clear"],
+        )
+        scheduler.add(
+            "ohio_instance",
+            lambda: ohio_create.create_database(
+                img_id=oh_img_id,
+                database=ohio_spec.get("database", {}),
+                user_data=postgres_script,
+                tags=[hash_tag(oh_img_id, postgres_script)],
+            ),
+            deps=["ohio_key_pair", "ohio_security_group"],
+        )
+        database_task = "ohio_instance"
+
+    ######################## RUNNING WEB TIER REGIONS ########################
+
+    # The database colocated with the first web region is cleared first
+    home_region = web_regions[0]["region"]
+    colocated_delete = AWSDelete(
+        region=home_region,
+        key_tags=nv_key_tag,
+        security_tags=colocated_sec_group_tag,
+        instance_tags=colocated_instance_tag,
     )
+    scheduler.add("colocated_clear", lambda: clear_colocated(colocated_delete))
 
-    ######################## RUNNING N. VIRGINIA INSTANCE ########################
+    # Clears and provisions every web region concurrently
+    print("\nProvisioning web tier regions...")
+    web_tier = MultiRegionDeploy(web_regions, scheduler)
+    web_tier.add_region_tasks(clear_deps=["colocated_clear"])
 
-    # Reads django script
-    with open("scripts/django.sh", "r") as d:
-        django_script = d.read().replace("ADD_IP_HERE", postgres_ip)
+    if topology == "colocated":
+        # Postgres in the web region's VPC, only open to its security group
+        print(f"\nCreating database in {home_region}, next to the web tier...")
+        colocated_create = AWSCreate(
+            region=home_region,
+            key_tags=nv_key_tag,
+            security_tags=colocated_sec_group_tag,
+            instance_tags=colocated_instance_tag,
+        )
+        web_group = web_tier.task(web_tier.home, "security_group")
 
-    # Deletes everything before creation
-    print("\nClearing North Virginia region...")
-    nv_delete = AWSDelete(
-        region=nv_region,
-        key_tags=nv_key_tag,
-        security_tags=sec_group_tag,
-        instance_tags=nv_instance_tag,
+        scheduler.add(
+            "colocated_security_group",
+            lambda: require(
+                colocated_create.create_security_group(
+                    sec_group_name="postgres-colocated",
+                    permissions=colocated_permissions(scheduler.result(web_group)),
+                ),
+                "Colocated database security group",
+            ),
+            deps=[web_group],
+        )
+        scheduler.add(
+            "colocated_instance",
+            lambda: create_colocated(colocated_create, postgres_script),
+            deps=[
+                "colocated_security_group",
+                web_tier.task(web_tier.home, "key_pair"),
+            ],
+        )
+        database_task = "colocated_instance"
+
+    # Reads the django launch script, the IP is only added once the database
+    # is up, while the AMI is baked at the same time
+    with open(nv_spec["launch_template"]["user_data"], "r") as d:
+        django_template = d.read()
+
+    scheduler.add(
+        "django_user_data",
+        lambda: django_template.replace(
+            "ADD_IP_HERE", require(scheduler.result(database_task), "Database")
+        ),
+        deps=[database_task],
     )
+    web_tier.add_launch_tasks(user_data_task="django_user_data")
 
-    nv_delete.delete_autoscaling("autoscaling_bruno_nv")
-    nv_delete.delete_load_balancers("lb-bruno-nv")
-    nv_delete.delete_launch_configuration(launch_name="launch_configs_bruno_nv")
-    nv_delete.delete_ami_image(ami_name="django_ami_bruno")
-    nv_delete.delete_instances()
-    nv_delete.delete_security_group()
-    nv_delete.delete_key_pairs()
-
-    # Runs the instance
-    print("\nCreating North Virginia instance...")
-    nv_create = AWSCreate(
-        region=nv_region,
-        key_tags=nv_key_tag,
-        security_tags=sec_group_tag,
-        instance_tags=nv_instance_tag,
+    scheduler.run()
+    scheduler.report()
+    web_tier.report()
+
+
+def reconcile(apply: bool):
+    # Only creates, updates or deletes what differs from the desired state
+    ohio = Reconciler(
+        ohio_spec,
+        AWSCreate(
+            region=oh_region,
+            key_tags=oh_key_tag,
+            security_tags=sec_group_tag,
+            instance_tags=oh_instance_tag,
+        ),
+        AWSDelete(
+            region=oh_region,
+            key_tags=oh_key_tag,
+            security_tags=sec_group_tag,
+            instance_tags=oh_instance_tag,
+        ),
     )
 
-    # Starts instance, loadbalancer and autoscaling
-    nv_create.generate_key_pair(keyname="brunosd1_nv", filename="nv_instance")
-    nv_create.create_security_group(
-        sec_group_name="orm-bruno",
-        permissions=north_virginia_permissions,
+    # Every web region, the first one bakes the AMI and the others copy it
+    web = []
+    for spec in web_regions:
+        deployment = RegionDeployment(spec)
+        web.append(
+            Reconciler(
+                spec,
+                deployment.create,
+                deployment.delete,
+                home=web[0] if web else None,
+            )
+        )
+
+    # Reads the scripts
+    postgres_script = postgres_user_data()
+
+    with open(web_regions[0]["instance"]["user_data"], "r") as b:
+        django_bake = b.read()
+
+    with open(web_regions[0]["launch_template"]["user_data"], "r") as d:
+        django_template = d.read()
+
+    # Every region can be described at the same time
+    scheduler = Scheduler()
+    for reconciler in [ohio] + web:
+        scheduler.add(f"{reconciler.create.region}_describe", reconciler.describe)
+    scheduler.run()
+
+    ohio.plan(user_data=postgres_script)
+    ohio.print_plan()
+
+    # The django launch user data is only known if the Postgres instance is kept
+    postgres_ip = None
+    if ohio.actions["instance"][0] == "keep":
+        postgres_ip = ohio.state["instance"][0].get("PublicIpAddress")
+
+    if not apply:
+        for reconciler in web:
+            reconciler.plan(
+                user_data=django_bake,
+                launch_user_data=(
+                    django_template.replace("ADD_IP_HERE", postgres_ip)
+                    if postgres_ip
+                    else None
+                ),
+            )
+            reconciler.print_plan()
+        return
+
+    postgres_ip = ohio.apply()
+    if not postgres_ip:
+        print("\nERROR: The Postgres instance has no IP, stopping the apply")
+        return
+
+    for reconciler in web:
+        reconciler.plan(
+            user_data=django_bake,
+            launch_user_data=django_template.replace("ADD_IP_HERE", postgres_ip),
+        )
+        reconciler.print_plan()
+
+    # The home region first (it bakes the AMI), then the others at once
+    scheduler = Scheduler()
+    home = f"{web[0].create.region}_apply"
+    scheduler.add(home, web[0].apply)
+    for reconciler in web[1:]:
+        scheduler.add(
+            f"{reconciler.create.region}_apply", reconciler.apply, deps=[home]
+        )
+    scheduler.run()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Sets up the task manager environment.")
+    parser.add_argument(
+        "mode",
+        nargs="?",
+        default="rebuild",
+        choices=["rebuild", "plan", "apply", "validate"],
+        help="rebuild clears and recreates everything, plan shows what apply would change, validate checks the scaling and database settings offline",
+    )
+    parser.add_argument(
+        "--topology",
+        default="cross-region",
+        choices=["cross-region", "colocated"],
+        help="with rebuild, runs Postgres in Ohio (cross-region) or in the VPC of the first web region, reached through private IPs (colocated)",
+    )
+    parser.add_argument(
+        "--peak-rpm",
+        type=float,
+        help="with validate, checks the autoscaling can serve this many requests per minute",
     )
-    django_ip = nv_create.create_instance(img_id=nv_img_id, user_data=django_script)
-    nv_create.create_ami_image(ami_name="django_ami_bruno")
-    nv_delete.delete_instances()
-    nv_create.create_load_balancer(
-        load_name="lb-bruno-nv",
-        security_group="orm-bruno",
-        load_tags=nv_load_tag,
+    parser.add_argument(
+        "--render",
+        metavar="DIR",
+        help="with validate, writes the generated database configs and scripts",
     )
-    nv_create.create_launch_configuration(launch_name="launch_configs_bruno_nv")
-    nv_create.create_autoscaling(
-        auto_name="autoscaling_bruno_nv",
-        launch_name="launch_configs_bruno_nv",
-        load_name="lb-bruno-nv",
+    parser.add_argument(
+        "--trace",
+        metavar="PATH",
+        help="writes a Chrome trace (chrome://tracing) of every method and API call",
     )
+    args = parser.parse_args()
+
+    # Keeps subnets, VPC and zones between runs
+    network.use_file(CACHE_PATH)
+
+    # IDs of what was created, so deletes don't have to search for it
+    store.use_file(STATE_PATH)
+
+    # Times every AWS method and boto3 call without touching the call sites
+    tracer = None
+    if args.trace:
+        tracer = Tracer()
+        tracer.instrument(AWSDefault, methods=["wait_until", "find_load_balancer"])
+        tracer.instrument(AWSCreate)
+        tracer.instrument(AWSDelete)
+        tracer.instrument(AMICache)
+        registry.add_hook(tracer.attach)
+
+    if args.mode == "validate":
+        problems = [
+            problem
+            for spec in web_regions
+            for problem in dry_run(spec["autoscaling"], args.peak_rpm)
+        ]
+        if "database" in ohio_spec:
+            problems += database_dry_run(ohio_spec["database"], args.render)
+        raise SystemExit(1 if problems else 0)
+
+    if args.topology == "colocated" and (
+        args.mode in ("plan", "apply") or len(web_regions) > 1
+    ):
+        # Private IPs don't cross regions, and the reconciler only knows Ohio
+        parser.error("--topology colocated needs rebuild and a single web region")
+
+    if args.mode == "rebuild":
+        rebuild(args.topology)
+    else:
+        reconcile(apply=args.mode == "apply")
+
+    # Startup cost of the shared clients (4 per region instead of 4 per object)
+    stats = registry.stats()
+    print(f"\nBuilt {stats['built']} boto3 clients in {stats['build_time']:.2f}s.")
+
+    if tracer:
+        tracer.summary()
+        tracer.write(args.trace)
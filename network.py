@@ -0,0 +1,94 @@
+# Extra imports
+import json
+import os
+from threading import Lock
+from time import time
+
+# File shared by main.py (which writes it) and client.py (which reads endpoints)
+CACHE_PATH = ".cache/network.json"
+
+# LoadBalancer DNS names don't change until it's recreated, which invalidates them
+ENDPOINT_TTL = 7 * 86400
+
+
+def endpoint_key(load_name: str):
+    return f"endpoint:{load_name}"
+
+
+class NetworkCache:
+    def __init__(self, ttl: float = 86400, path: str = None, clock=time):
+        # Entries older than the TTL are fetched again
+        self.ttl = ttl
+        self.clock = clock
+
+        # Optional JSON file used to keep the topology between runs
+        self.path = path
+        self.lock = Lock()
+
+        # Values keyed by region and then by name, with the time they were fetched
+        self.entries = self.load()
+
+    def use_file(self, path: str):
+        # Starts persisting to the file, reusing whatever it already holds
+        with self.lock:
+            self.path = path
+            self.entries = self.load()
+
+    def load(self):
+        if self.path and os.path.exists(self.path):
+            try:
+                with open(self.path, "r") as f:
+                    return json.load(f)
+            except (OSError, ValueError):
+                # A corrupt cache is simply rebuilt
+                return {}
+        return {}
+
+    def save(self):
+        if not self.path:
+            return
+
+        folder = os.path.dirname(self.path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+
+        with open(self.path, "w") as f:
+            json.dump(self.entries, f, indent=2)
+
+    def get(self, region: str, name: str, fetch):
+        with self.lock:
+            entry = self.entries.get(region, {}).get(name)
+            if entry and self.clock() - entry["fetched"] <= self.ttl:
+                return entry["value"]
+
+        # Fetches outside the lock so regions don't wait on each other
+        return self.put(region, name, fetch())
+
+    def put(self, region: str, name: str, value):
+        with self.lock:
+            self.entries.setdefault(region, {})[name] = {
+                "value": value,
+                "fetched": self.clock(),
+            }
+            self.save()
+
+        return value
+
+    def forget(self, region: str, name: str):
+        # Drops a single value, e.g. the endpoint of a deleted LoadBalancer
+        with self.lock:
+            if self.entries.get(region, {}).pop(name, None) is not None:
+                self.save()
+
+    def refresh(self, region: str = None):
+        # Drops cached values so they are fetched again on next use
+        with self.lock:
+            if region is None:
+                self.entries = {}
+            else:
+                self.entries.pop(region, None)
+            self.save()
+
+
+# Process-wide cache shared by every AWSDefault object
+network = NetworkCache()
@@ -0,0 +1,139 @@
+# Extra imports
+from threading import Lock
+from time import monotonic, sleep
+
+# Error codes returned when the API is throttling us
+THROTTLING_CODES = {
+    "Throttling",
+    "ThrottlingException",
+    "RequestLimitExceeded",
+    "RequestThrottled",
+    "TooManyRequestsException",
+    "SlowDown",
+}
+
+# Error codes returned while another resource still depends on the target
+DEPENDENCY_CODES = {
+    "DependencyViolation",
+    "ResourceInUse",
+    "ScalingActivityInProgress",
+    "InvalidIPAddress.InUse",
+}
+
+# Error codes for temporary server side failures
+TRANSIENT_CODES = {
+    "InternalError",
+    "InternalFailure",
+    "ServiceUnavailable",
+    "Unavailable",
+    "RequestTimeout",
+}
+
+# Requests per second and burst size allowed for each service in a region,
+# keyed by the service name of the botocore client ("elb" for Classic ELB)
+DEFAULT_RATES = {
+    "ec2": (20, 50),
+    "elb": (10, 20),
+    "autoscaling": (10, 20),
+}
+
+
+def classify(c_error):
+    # Splits ClientErrors into throttling, dependency, transient and fatal
+    code = c_error.response.get("Error", {}).get("Code", "")
+    if code in THROTTLING_CODES:
+        return "throttling"
+    if code in DEPENDENCY_CODES:
+        return "dependency"
+    if code in TRANSIENT_CODES:
+        return "transient"
+    return "fatal"
+
+
+class TokenBucket:
+    def __init__(
+        self,
+        rate: float,
+        burst: float,
+        min_rate: float = 0.5,
+        clock=monotonic,
+        sleep=sleep,
+    ):
+        # The rate drops when throttled and slowly recovers up to max_rate
+        self.max_rate = rate
+        self.min_rate = min_rate
+        self.rate = rate
+
+        self.burst = burst
+        self.tokens = burst
+
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self.lock = Lock()
+
+    def refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        # Blocks until a token is available
+        while True:
+            with self.lock:
+                self.refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            self.sleep(delay)
+
+    def throttled(self):
+        # Multiplicative decrease
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def succeeded(self):
+        # Additive increase
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+class RateLimiter:
+    def __init__(self, rates: dict = None):
+        self.rates = rates or DEFAULT_RATES
+
+        # One bucket per (region, service), shared by every client and wrapper
+        self.buckets = {}
+        self.lock = Lock()
+
+    def bucket(self, region: str, service: str):
+        with self.lock:
+            if (region, service) not in self.buckets:
+                rate, burst = self.rates.get(service, (10, 20))
+                self.buckets[(region, service)] = TokenBucket(rate, burst)
+            return self.buckets[(region, service)]
+
+    def attach(self, client):
+        bucket = self.bucket(
+            client.meta.region_name, client.meta.service_model.service_name
+        )
+
+        def before_send(**kwargs):
+            # Every attempt, retries included, takes a token
+            bucket.acquire()
+
+        def after_call(parsed, **kwargs):
+            if "Error" not in parsed:
+                bucket.succeeded()
+
+        def needs_retry(response=None, **kwargs):
+            if response is not None:
+                code = response[1].get("Error", {}).get("Code")
+                if code in THROTTLING_CODES:
+                    bucket.throttled()
+
+        events = client.meta.events
+        events.register("before-send.*.*", before_send)
+        events.register("after-call.*.*", after_call)
+        events.register("needs-retry.*.*", needs_retry)
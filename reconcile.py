@@ -0,0 +1,689 @@
+# Import AWS classes
+from aws_create import AWSCreate, resolve_groups
+from aws_delete import AWSDelete
+
+# Boto3 imports
+from botocore.exceptions import ClientError
+
+# AMI cache and content hashes
+from ami_cache import HASH_TAG, AMICache, content_hash, hash_tag, tag_value
+
+# Scaling policy names
+from scaling import policy_targets
+
+# Database instance type
+from database import options
+
+# Extra imports
+from base64 import b64encode
+import os
+
+# Order in which resources are created (deletions go in reverse)
+RESOURCES = [
+    "key_pair",
+    "security_group",
+    "instance",
+    "ami",
+    "load_balancer",
+    "launch_configuration",
+    "launch_template",
+    "autoscaling",
+]
+
+
+def ingress_rules(permissions: list):
+    # Flattens IpPermissions into comparable (protocol, from, to, kind, source) rules
+    rules = set()
+    for permission in permissions:
+        key = (
+            permission["IpProtocol"],
+            permission.get("FromPort"),
+            permission.get("ToPort"),
+        )
+        for ip_range in permission.get("IpRanges", []):
+            rules.add(key + ("cidr", ip_range["CidrIp"]))
+        for pair in permission.get("UserIdGroupPairs", []):
+            rules.add(key + ("group", pair["GroupId"]))
+    return rules
+
+
+def ingress_permissions(rules: set):
+    # Turns flattened rules back into IpPermissions
+    permissions = []
+    for protocol, from_port, to_port, kind, source in sorted(rules, key=str):
+        permission = {"IpProtocol": protocol, "FromPort": from_port, "ToPort": to_port}
+        if kind == "cidr":
+            permission["IpRanges"] = [{"CidrIp": source}]
+        else:
+            permission["UserIdGroupPairs"] = [{"GroupId": source}]
+        permissions.append(permission)
+    return permissions
+
+
+class Reconciler:
+    def __init__(
+        self,
+        spec: dict,
+        create: AWSCreate,
+        delete: AWSDelete,
+        home: "Reconciler" = None,
+    ):
+        self.spec = spec
+        self.create = create
+        self.delete = delete
+
+        # Web regions other than the first copy the AMI of its reconciler
+        # (applied first) instead of baking one
+        self.home = home
+
+        # Current state of every resource in the spec (None when missing)
+        self.state = {}
+
+        # Action planned for every resource: keep, create, update, replace or
+        # refresh (rolling replacement of the autoscaling instances)
+        self.actions = {}
+
+        # Baked AMIs are content addressed, so unchanged user data reuses them
+        self.ami_cache = (
+            AMICache(create, spec["ami"]["name"]) if "ami" in spec else None
+        )
+
+    def describe(self):
+        print(f"\nDescribing current state of {self.create.region}...")
+        client = self.create.client
+        spec = self.spec
+
+        if "key_pair" in spec:
+            try:
+                keys = client.describe_key_pairs(KeyNames=[spec["key_pair"]["name"]])
+                self.state["key_pair"] = keys["KeyPairs"][0]
+            except ClientError as c_error:
+                if c_error.response["Error"]["Code"] != "InvalidKeyPair.NotFound":
+                    raise
+                self.state["key_pair"] = None
+
+        if "security_group" in spec:
+            groups = client.describe_security_groups(
+                Filters=[
+                    {"Name": "group-name", "Values": [spec["security_group"]["name"]]},
+                    {"Name": "vpc-id", "Values": [self.create.vpc_id]},
+                ]
+            )["SecurityGroups"]
+            self.state["security_group"] = groups[0] if groups else None
+
+        if "instance" in spec and "ami" not in spec:
+            # Instances in the state file are described by ID, the tag is only
+            # searched when it knows nothing or is out of date
+            reservations = self.known_instances()
+            if reservations is None:
+                reservations = self.create.paginate(
+                    client,
+                    "describe_instances",
+                    "Reservations",
+                    Filters=[
+                        self.create.tag_filter(self.create.instance_tags),
+                        {
+                            "Name": "instance-state-name",
+                            "Values": ["pending", "running"],
+                        },
+                    ],
+                )
+            # Read replicas share the tags of the database and follow it
+            instances = [
+                instance
+                for reservation in reservations
+                for instance in reservation["Instances"]
+                if tag_value(instance, "Role") != "replica"
+            ]
+            self.state["instance"] = instances
+
+        if "ami" in spec:
+            self.state["ami_images"] = self.ami_cache.images()
+
+        if "load_balancer" in spec:
+            self.state["load_balancer"] = self.create.find_load_balancer(
+                spec["load_balancer"]["name"]
+            )
+
+        if "launch_configuration" in spec:
+            configs = self.create.autoscaling.describe_launch_configurations(
+                LaunchConfigurationNames=[spec["launch_configuration"]["name"]]
+            )["LaunchConfigurations"]
+            self.state["launch_configuration"] = configs[0] if configs else None
+
+        if "launch_template" in spec:
+            self.state["launch_template"] = self.create.find_launch_template(
+                spec["launch_template"]["name"]
+            )
+
+        if "autoscaling" in spec:
+            groups = self.create.autoscaling.describe_auto_scaling_groups(
+                AutoScalingGroupNames=[spec["autoscaling"]["name"]]
+            )["AutoScalingGroups"]
+            self.state["autoscaling"] = groups[0] if groups else None
+
+            # The warm pool can only be described once the autoscaling exists
+            self.state["warm_pool"] = (
+                self.create.autoscaling.describe_warm_pool(
+                    AutoScalingGroupName=spec["autoscaling"]["name"]
+                ).get("WarmPoolConfiguration")
+                if groups and "warm_pool" in spec["autoscaling"]
+                else None
+            )
+
+            # Also described without a scaling block, whose removal has to
+            # delete the policies that are still attached
+            self.state["scaling"] = self.describe_scaling() if groups else None
+
+        return self.state
+
+    def known_instances(self):
+        # Reservations of the instances in the state store, None when it knows
+        # nothing or they're no longer running
+        create = self.create
+        known = create.store.ids(
+            create.region, "instances", create.instance_tags["Value"]
+        )
+        if not known:
+            return None
+
+        try:
+            reservations = create.client.describe_instances(InstanceIds=known)[
+                "Reservations"
+            ]
+        except ClientError as c_error:
+            if "InvalidInstanceID" not in c_error.response["Error"]["Code"]:
+                raise
+            return None
+
+        if any(
+            instance["State"]["Name"] not in ("pending", "running")
+            for reservation in reservations
+            for instance in reservation["Instances"]
+        ):
+            return None
+        return reservations
+
+    def changes(self, resource: str):
+        # True if the resource gets a new ID during apply
+        return self.actions.get(resource, ("keep",))[0] in ("create", "replace")
+
+    def decide(self, resource: str, action: str, reason: str = ""):
+        self.actions[resource] = (action, reason)
+
+    def plan(self, user_data: str = None, launch_user_data: str = None):
+        if not self.state:
+            self.describe()
+
+        spec = self.spec
+        state = self.state
+        self.user_data = user_data
+
+        # Launch stage user data of the autoscaling instances (None if unknown)
+        self.launch_user_data = launch_user_data
+        # Copies of the home region's AMI keep the hash it was baked with
+        image_spec = self.home.spec if self.home else spec
+        self.user_data_hash = (
+            content_hash(image_spec["instance"]["image"], user_data)
+            if "instance" in spec and user_data is not None
+            else None
+        )
+
+        if "key_pair" in spec:
+            key_file = os.path.join(os.getcwd(), ".ssh", spec["key_pair"]["filename"])
+            if not state["key_pair"]:
+                self.decide("key_pair", "create", "missing")
+            elif not os.path.exists(key_file):
+                # Replacing it would replace every instance using it (the
+                # database too), only SSH needs the file
+                self.decide(
+                    "key_pair", "keep", f"local key file {key_file} missing, no SSH"
+                )
+            else:
+                self.decide("key_pair", "keep")
+
+        if "security_group" in spec:
+            group = state["security_group"]
+            if not group:
+                self.decide("security_group", "create", "missing")
+            elif ingress_rules(group["IpPermissions"]) != ingress_rules(
+                resolve_groups(spec["security_group"]["permissions"], group["GroupId"])
+            ):
+                self.decide("security_group", "update", "ingress rules differ")
+            else:
+                self.decide("security_group", "keep")
+
+        if "instance" in spec and "ami" not in spec:
+            instances = state["instance"]
+            instance = instances[0] if instances else None
+            if not instance:
+                self.decide("instance", "create", "missing")
+            elif len(instances) > 1:
+                self.decide("instance", "replace", f"{len(instances)} tagged instances")
+            elif self.changes("security_group") or (
+                self.changes("key_pair") and "database" not in spec
+            ):
+                self.decide("instance", "replace", "key pair or security group changes")
+            elif instance["ImageId"] != spec["instance"]["image"]:
+                self.decide("instance", "replace", "base image differs")
+            elif (
+                "database" in spec
+                and instance["InstanceType"]
+                != options(spec["database"])["instance_type"]
+            ):
+                self.decide("instance", "replace", "instance type differs")
+            elif tag_value(instance, HASH_TAG) != self.user_data_hash:
+                self.decide("instance", "replace", "user data changed")
+            elif self.changes("key_pair"):
+                # Replacing the database would lose its data
+                self.decide("instance", "keep", "database keeps its old key pair")
+            else:
+                self.decide("instance", "keep")
+
+        if "ami" in spec:
+            # Looks for a cached AMI baked from the same image and user data
+            state["ami"] = (
+                self.ami_cache.find(state["ami_images"], self.user_data_hash)
+                if user_data is not None
+                else None
+            )
+            if user_data is None:
+                self.decide("ami", "create", "user data unknown")
+            elif not state["ami"]:
+                self.decide("ami", "create", "not in AMI cache")
+            else:
+                self.decide("ami", "keep", f"cached as {state['ami']['ImageId']}")
+
+        if "load_balancer" in spec:
+            load_balancer = state["load_balancer"]
+            group = state.get("security_group")
+            if not load_balancer:
+                self.decide("load_balancer", "create", "missing")
+            elif self.changes("security_group") or (
+                load_balancer["SecurityGroups"] != [group["GroupId"]]
+            ):
+                self.decide("load_balancer", "update", "security group differs")
+            else:
+                self.decide("load_balancer", "keep")
+
+        if "launch_configuration" in spec:
+            config = state["launch_configuration"]
+            if not config:
+                self.decide("launch_configuration", "create", "missing")
+            elif any(
+                self.changes(resource)
+                for resource in ("key_pair", "security_group", "ami")
+            ):
+                self.decide(
+                    "launch_configuration", "replace", "key pair, group or AMI changes"
+                )
+            elif (
+                config["ImageId"] != state["ami"]["ImageId"]
+                or config["KeyName"] != spec["key_pair"]["name"]
+                or config["SecurityGroups"] != [state["security_group"]["GroupId"]]
+            ):
+                self.decide("launch_configuration", "replace", "settings differ")
+            else:
+                self.decide("launch_configuration", "keep")
+
+        if "launch_template" in spec:
+            template = state["launch_template"]
+            if not template:
+                self.decide("launch_template", "create", "missing")
+            elif any(
+                self.changes(resource)
+                for resource in ("key_pair", "security_group", "ami")
+            ):
+                self.decide(
+                    "launch_template", "update", "key pair, group or AMI changes"
+                )
+            elif (
+                template["LaunchTemplateData"].get("ImageId") != state["ami"]["ImageId"]
+                or template["LaunchTemplateData"].get("KeyName")
+                != spec["key_pair"]["name"]
+                or template["LaunchTemplateData"].get("SecurityGroupIds")
+                != [state["security_group"]["GroupId"]]
+                or template["LaunchTemplateData"].get("InstanceType")
+                != spec.get("instance_type", "t2.micro")
+            ):
+                self.decide("launch_template", "update", "settings differ")
+            elif launch_user_data is None:
+                self.decide("launch_template", "update", "launch user data unknown")
+            elif (
+                template["LaunchTemplateData"].get("UserData")
+                != b64encode(launch_user_data.encode()).decode()
+            ):
+                self.decide("launch_template", "update", "launch user data changed")
+            else:
+                self.decide("launch_template", "keep")
+
+        if "autoscaling" in spec:
+            group = state["autoscaling"]
+            sizes = spec["autoscaling"]
+            if not group:
+                self.decide("autoscaling", "create", "missing")
+            elif self.changes("load_balancer") or (
+                "launch_template" not in spec and self.changes("launch_configuration")
+            ):
+                self.decide(
+                    "autoscaling", "replace", "launch config or LoadBalancer changes"
+                )
+            elif "launch_template" in spec and (
+                group.get("LaunchTemplate", {}).get("LaunchTemplateName")
+                != spec["launch_template"]["name"]
+                or self.actions["launch_template"][0] != "keep"
+            ):
+                # New instances are rolled in while the old ones keep serving
+                self.decide("autoscaling", "refresh", "launch template changes")
+            elif (group["MinSize"], group["MaxSize"]) != (
+                sizes["min_size"],
+                sizes["max_size"],
+            ):
+                # apply writes the bounds with or without scaling policies
+                self.decide("autoscaling", "update", "sizes differ")
+            elif (
+                "scaling" not in sizes and group["DesiredCapacity"] != sizes["desired"]
+            ):
+                # With scaling policies the desired capacity is managed by AWS
+                self.decide("autoscaling", "update", "desired capacity differs")
+            elif self.warm_pool_differs():
+                self.decide("autoscaling", "update", "warm pool differs")
+            elif self.scaling_differs():
+                self.decide("autoscaling", "update", "scaling policies differ")
+            else:
+                self.decide("autoscaling", "keep")
+
+        return [
+            (resource,) + self.actions[resource]
+            for resource in RESOURCES
+            if resource in self.actions
+        ]
+
+    def warm_pool_differs(self):
+        desired = self.spec["autoscaling"].get("warm_pool")
+        current = self.state.get("warm_pool")
+        if not desired:
+            return False
+        if not current:
+            return True
+        return (current["MinSize"], current["PoolState"]) != (
+            desired.get("min_size", 1),
+            desired.get("pool_state", "Stopped"),
+        )
+
+    def describe_scaling(self):
+        # Target values of the policies and recurrences of the scheduled actions
+        auto_name = self.spec["autoscaling"]["name"]
+        policies = self.create.autoscaling.describe_policies(
+            AutoScalingGroupName=auto_name
+        )["ScalingPolicies"]
+        actions = self.create.autoscaling.describe_scheduled_actions(
+            AutoScalingGroupName=auto_name
+        )["ScheduledUpdateGroupActions"]
+
+        return (
+            {
+                policy["PolicyName"]: policy["TargetTrackingConfiguration"][
+                    "TargetValue"
+                ]
+                for policy in policies
+                if "TargetTrackingConfiguration" in policy
+            },
+            {action["ScheduledActionName"]: action["Recurrence"] for action in actions},
+        )
+
+    def desired_scaling(self):
+        # Same shape as describe_scaling, empty without a scaling block
+        sizes = self.spec["autoscaling"]
+        if "scaling" not in sizes:
+            return {}, {}
+
+        return (
+            policy_targets(sizes["name"], sizes["scaling"]),
+            {
+                action["name"]: action["recurrence"]
+                for action in sizes["scaling"].get("scheduled", [])
+            },
+        )
+
+    def scaling_differs(self):
+        return (self.state.get("scaling") or ({}, {})) != self.desired_scaling()
+
+    def stale_scaling(self):
+        # Policies and scheduled actions attached but no longer in the spec
+        policies, actions = self.state.get("scaling") or ({}, {})
+        desired_policies, desired_actions = self.desired_scaling()
+        return (
+            [name for name in policies if name not in desired_policies],
+            [name for name in actions if name not in desired_actions],
+        )
+
+    def print_plan(self):
+        print(f"\nPlan for {self.create.region}:")
+        for resource in RESOURCES:
+            if resource in self.actions:
+                action, reason = self.actions[resource]
+                print(f"  {action:<8} {resource:<22} {reason}")
+
+    def apply(self):
+        spec = self.spec
+        state = self.state
+        create = self.create
+        public_ip = None
+
+        if all(action == "keep" for action, _ in self.actions.values()):
+            print(f"\nNothing to change in {create.region}.")
+
+        # Replaced resources are deleted first, dependents before dependencies
+        for resource in reversed(RESOURCES):
+            if self.actions.get(resource, ("keep",))[0] != "replace":
+                continue
+            if resource == "autoscaling":
+                self.delete.delete_autoscaling(spec["autoscaling"]["name"])
+            elif resource == "launch_configuration":
+                self.delete.delete_launch_configuration(
+                    spec["launch_configuration"]["name"]
+                )
+            elif resource == "instance":
+                self.delete.delete_instances()
+            elif resource == "key_pair":
+                self.delete.delete_key_pairs()
+
+        if "key_pair" in spec:
+            if self.actions["key_pair"][0] == "keep":
+                create.key_pair_name = spec["key_pair"]["name"]
+            else:
+                create.generate_key_pair(
+                    keyname=spec["key_pair"]["name"],
+                    filename=spec["key_pair"]["filename"],
+                )
+
+        if "security_group" in spec:
+            action = self.actions["security_group"][0]
+            if action == "create":
+                create.create_security_group(
+                    sec_group_name=spec["security_group"]["name"],
+                    permissions=spec["security_group"]["permissions"],
+                )
+            else:
+                create.sec_group_id = state["security_group"]["GroupId"]
+                if action == "update":
+                    self.update_security_group()
+
+        if "instance" in spec and "ami" not in spec:
+            if self.actions["instance"][0] == "keep":
+                instance = state["instance"][0]
+                create.instance_id = instance["InstanceId"]
+                public_ip = instance.get("PublicIpAddress")
+            elif "database" in spec:
+                public_ip = create.create_database(
+                    img_id=spec["instance"]["image"],
+                    database=spec["database"],
+                    user_data=self.user_data,
+                    tags=[hash_tag(spec["instance"]["image"], self.user_data)],
+                )
+            else:
+                public_ip = create.create_instance(
+                    img_id=spec["instance"]["image"],
+                    user_data=self.user_data,
+                    tags=[hash_tag(spec["instance"]["image"], self.user_data)],
+                )
+
+        if "ami" in spec:
+            if self.actions["ami"][0] == "keep":
+                create.ami_id = state["ami"]["ImageId"]
+                self.ami_cache.touch(create.ami_id)
+            elif self.home:
+                if self.home.create.ami_id:
+                    create.ami_id = self.ami_cache.copy(
+                        self.home.create.region,
+                        self.home.create.ami_id,
+                        self.user_data_hash,
+                    )
+            else:
+                self.ami_cache.bake(
+                    create, self.delete, spec["instance"]["image"], self.user_data
+                )
+
+            # Without an AMI the launch template and autoscaling can't be made
+            if not create.ami_id:
+                print(f"\nERROR: No AMI in {create.region}, stopping the apply")
+                return public_ip
+
+            # Old cached AMIs and their snapshots are deregistered
+            self.ami_cache.evict(keep=[create.ami_id])
+
+        if "load_balancer" in spec:
+            action = self.actions["load_balancer"][0]
+            if action == "create":
+                create.create_load_balancer(
+                    load_name=spec["load_balancer"]["name"],
+                    security_group=spec["security_group"]["name"],
+                    load_tags=spec["load_balancer"]["tags"],
+                )
+            elif action == "update":
+                self.update_load_balancer(spec["load_balancer"]["name"])
+
+        if "launch_configuration" in spec:
+            if self.actions["launch_configuration"][0] != "keep":
+                create.create_launch_configuration(
+                    launch_name=spec["launch_configuration"]["name"],
+                    instance_type=spec.get("instance_type", "t2.micro"),
+                    user_data=self.launch_user_data,
+                )
+
+        if "launch_template" in spec:
+            if self.actions["launch_template"][0] != "keep":
+                create.create_launch_template(
+                    template_name=spec["launch_template"]["name"],
+                    instance_type=spec.get("instance_type", "t2.micro"),
+                    user_data=self.launch_user_data,
+                )
+
+        if "autoscaling" in spec:
+            action = self.actions["autoscaling"][0]
+            sizes = spec["autoscaling"]
+            launch_template = "launch_template" in spec
+            launch_name = spec[
+                "launch_template" if launch_template else "launch_configuration"
+            ]["name"]
+
+            if action in ("create", "replace"):
+                create.create_autoscaling(
+                    auto_name=sizes["name"],
+                    launch_name=launch_name,
+                    load_name=spec["load_balancer"]["name"],
+                    min_size=sizes["min_size"],
+                    max_size=sizes["max_size"],
+                    desired=sizes["desired"],
+                    launch_template=launch_template,
+                    warm_pool=sizes.get("warm_pool"),
+                    scaling=sizes.get("scaling"),
+                )
+            elif action in ("update", "refresh"):
+                self.update_autoscaling(action, launch_name, launch_template)
+
+        return public_ip
+
+    def update_load_balancer(self, load_name: str):
+        print(f"\nUpdating LoadBalancer {load_name}...")
+        try:
+            self.create.call(
+                self.create.load_balancer.apply_security_groups_to_load_balancer,
+                LoadBalancerName=load_name,
+                SecurityGroups=[self.create.sec_group_id],
+            )
+
+        except ClientError as c_error:
+            print(f"\nERROR: {c_error}")
+
+    def update_autoscaling(self, action: str, launch_name: str, launch_template: bool):
+        create = self.create
+        sizes = self.spec["autoscaling"]
+        load_name = self.spec["load_balancer"]["name"]
+        print(f"\nUpdating autoscaling {sizes['name']}...")
+        try:
+            extra = (
+                create.launch_source(launch_name, launch_template)
+                if action == "refresh"
+                else {}
+            )
+
+            # The scaling policies own the desired capacity when there are any
+            if "scaling" not in sizes:
+                extra["DesiredCapacity"] = sizes["desired"]
+
+            create.call(
+                create.autoscaling.update_auto_scaling_group,
+                AutoScalingGroupName=sizes["name"],
+                MinSize=sizes["min_size"],
+                MaxSize=sizes["max_size"],
+                **extra,
+            )
+
+        except ClientError as c_error:
+            print(f"\nERROR: {c_error}")
+            return
+
+        if sizes.get("warm_pool"):
+            create.create_warm_pool(sizes["name"], **sizes["warm_pool"])
+
+        # Left attached they would keep resizing the group
+        policy_names, action_names = self.stale_scaling()
+        if policy_names or action_names:
+            self.delete.delete_scaling_policies(
+                sizes["name"], policy_names, action_names
+            )
+        if sizes.get("scaling"):
+            create.create_scaling_policies(sizes["name"], load_name, **sizes["scaling"])
+
+        # Replaces the running instances without taking the group down
+        if action == "refresh":
+            create.start_instance_refresh(sizes["name"], load_name)
+
+    def update_security_group(self):
+        print(f"\nUpdating security group {self.create.sec_group_id} ingress rules...")
+        current = ingress_rules(self.state["security_group"]["IpPermissions"])
+        desired = ingress_rules(
+            resolve_groups(
+                self.spec["security_group"]["permissions"], self.create.sec_group_id
+            )
+        )
+
+        try:
+            # Only the rules that differ are revoked or authorized
+            if current - desired:
+                self.create.call(
+                    self.create.client.revoke_security_group_ingress,
+                    GroupId=self.create.sec_group_id,
+                    IpPermissions=ingress_permissions(current - desired),
+                )
+            if desired - current:
+                self.create.call(
+                    self.create.client.authorize_security_group_ingress,
+                    GroupId=self.create.sec_group_id,
+                    IpPermissions=ingress_permissions(desired - current),
+                )
+
+        except ClientError as c_error:
+            print(f"\nERROR: {c_error}")
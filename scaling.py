@@ -0,0 +1,163 @@
+# Extra imports
+from math import ceil
+
+# Month and weekday names accepted in cron fields
+MONTHS = {
+    name: number
+    for number, name in enumerate(
+        "JAN FEB MAR APR MAY JUN JUL AUG SEP OCT NOV DEC".split(), start=1
+    )
+}
+WEEKDAYS = {
+    name: number for number, name in enumerate("SUN MON TUE WED THU FRI SAT".split())
+}
+
+# Allowed values of the 5 cron fields used by scheduled actions
+CRON_FIELDS = [
+    ("minute", 0, 59, {}),
+    ("hour", 0, 23, {}),
+    ("day of month", 1, 31, {}),
+    ("month", 1, 12, MONTHS),
+    ("day of week", 0, 7, WEEKDAYS),
+]
+
+
+def cron_value(value: str, low: int, high: int, names: dict):
+    number = names[value.upper()] if value.upper() in names else int(value)
+    if not low <= number <= high:
+        raise ValueError(f"{value} is not between {low} and {high}")
+    return number
+
+
+def cron_problems(recurrence: str):
+    # Checks a "minute hour day month weekday" recurrence without calling AWS
+    fields = recurrence.split()
+    if len(fields) != 5:
+        return [f"recurrence '{recurrence}' needs 5 fields, has {len(fields)}"]
+
+    problems = []
+    for field, (name, low, high, names) in zip(fields, CRON_FIELDS):
+        for part in field.split(","):
+            values, _, step = part.partition("/")
+            try:
+                if step and int(step) < 1:
+                    raise ValueError(f"step {step} is not positive")
+                if values == "*":
+                    continue
+                start, _, end = values.partition("-")
+                if end and cron_value(start, low, high, names) > cron_value(
+                    end, low, high, names
+                ):
+                    raise ValueError(f"range {values} is reversed")
+                cron_value(start, low, high, names)
+
+            except ValueError as v_error:
+                problems.append(f"{name} '{part}' in '{recurrence}': {v_error}")
+
+    return problems
+
+
+def size_problems(name: str, min_size: int, max_size: int, desired: int = None):
+    problems = []
+    if min_size < 0:
+        problems.append(f"{name}: min_size {min_size} is negative")
+    if min_size > max_size:
+        problems.append(f"{name}: min_size {min_size} is above max_size {max_size}")
+    if desired is not None and not min_size <= desired <= max_size:
+        problems.append(f"{name}: desired {desired} is outside {min_size}-{max_size}")
+    return problems
+
+
+def validate_scaling(sizes: dict):
+    # Offline checks of an autoscaling spec, returns a list of problems
+    problems = size_problems(
+        sizes["name"], sizes["min_size"], sizes["max_size"], sizes["desired"]
+    )
+    scaling = sizes.get("scaling")
+    if not scaling:
+        return problems
+
+    cpu_target = scaling.get("cpu_target")
+    if cpu_target is not None and not 0 < cpu_target < 100:
+        problems.append(f"cpu_target {cpu_target} must be between 0 and 100")
+
+    requests = scaling.get("requests_per_instance")
+    if requests is not None and requests <= 0:
+        problems.append(f"requests_per_instance {requests} must be positive")
+
+    if scaling.get("warmup", 0) < 0:
+        problems.append(f"warmup {scaling['warmup']} is negative")
+
+    scheduled = scaling.get("scheduled", [])
+    if cpu_target is None and requests is None and not scheduled:
+        problems.append("scaling has no target tracking policy or scheduled action")
+
+    names = [action["name"] for action in scheduled]
+    for name in sorted({name for name in names if names.count(name) > 1}):
+        problems.append(f"scheduled action {name} is defined more than once")
+
+    for action in scheduled:
+        problems += cron_problems(action["recurrence"])
+        problems += size_problems(
+            action["name"],
+            action.get("min_size", sizes["min_size"]),
+            action.get("max_size", sizes["max_size"]),
+            action.get("desired"),
+        )
+
+    return problems
+
+
+def policy_targets(auto_name: str, scaling: dict):
+    # Target tracking policies created for a scaling spec, name -> target value
+    targets = {}
+    if scaling.get("cpu_target") is not None:
+        targets[f"{auto_name}-cpu"] = float(scaling["cpu_target"])
+    if scaling.get("requests_per_instance") is not None:
+        targets[f"{auto_name}-requests"] = float(scaling["requests_per_instance"])
+    return targets
+
+
+def peak_capacity(sizes: dict, peak_rpm: float):
+    # Instances needed to serve peak_rpm requests per minute at the target load
+    scaling = sizes.get("scaling") or {}
+    requests = scaling.get("requests_per_instance")
+    needed = ceil(peak_rpm / requests) if requests else None
+
+    # The highest max size the group can reach, scheduled actions included
+    max_size = max(
+        [sizes["max_size"]]
+        + [
+            action.get("max_size", sizes["max_size"])
+            for action in scaling.get("scheduled", [])
+        ]
+    )
+
+    return {"needed": needed, "max_size": max_size}
+
+
+def dry_run(sizes: dict, peak_rpm: float = None):
+    print(f"\nValidating scaling of {sizes['name']} (no AWS calls)...")
+    problems = validate_scaling(sizes)
+
+    if peak_rpm is not None:
+        capacity = peak_capacity(sizes, peak_rpm)
+        if capacity["needed"] is None:
+            problems.append("peak sizing needs requests_per_instance")
+        else:
+            print(
+                f"A peak of {peak_rpm:g} requests per minute needs {capacity['needed']} instances, the group can reach {capacity['max_size']}."
+            )
+            if capacity["needed"] > capacity["max_size"]:
+                problems.append(
+                    f"max_size {capacity['max_size']} can't serve the peak, {capacity['needed']} instances are needed"
+                )
+
+    if problems:
+        print(f"Scaling configuration is invalid ({len(problems)} found):")
+    else:
+        print("Scaling configuration is valid.")
+    for problem in problems:
+        print(f"  - {problem}")
+
+    return problems
@@ -0,0 +1,137 @@
+# Extra imports
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextvars import copy_context
+from time import monotonic
+
+
+class Task:
+    def __init__(self, name: str, func, deps: list):
+        self.name = name
+        self.func = func
+        self.deps = deps
+
+        # Filled in when the task runs
+        self.start = None
+        self.end = None
+        self.result = None
+        self.error = None
+        self.skipped = False
+
+    @property
+    def duration(self):
+        if self.start is None or self.end is None:
+            return 0
+        return self.end - self.start
+
+    @property
+    def ok(self):
+        return self.end is not None and self.error is None and not self.skipped
+
+
+class Scheduler:
+    def __init__(self, max_workers: int = 8, clock=monotonic):
+        self.max_workers = max_workers
+
+        # Clock used for the timing report (a virtual one in the offline harness)
+        self.clock = clock
+        self.tasks = {}
+        self.t0 = None
+
+    def add(self, name: str, func, deps: list = ()):
+        # Dependencies must be added first, which keeps the graph acyclic
+        for dep in deps:
+            if dep not in self.tasks:
+                raise ValueError(f"Task {name} depends on unknown task {dep}")
+
+        if name in self.tasks:
+            raise ValueError(f"Task {name} already exists")
+
+        self.tasks[name] = Task(name, func, list(deps))
+        return name
+
+    def result(self, name: str):
+        return self.tasks[name].result
+
+    def execute(self, task: Task):
+        task.start = self.clock()
+        try:
+            task.result = task.func()
+        except Exception as error:
+            # Recorded before the end time, which is what dependents look at
+            # (the future itself may only be collected later)
+            task.error = error
+            raise
+        finally:
+            task.end = self.clock()
+        return task.result
+
+    def run(self):
+        self.t0 = self.clock()
+        pending = dict(self.tasks)
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while pending or running:
+                # Submits every task whose dependencies have all finished
+                for name, task in list(pending.items()):
+                    deps = [self.tasks[dep] for dep in task.deps]
+                    if any(dep.end is None and not dep.skipped for dep in deps):
+                        continue
+
+                    del pending[name]
+
+                    # A failed dependency means this task can't run
+                    if not all(dep.ok for dep in deps):
+                        task.skipped = True
+                        print(f"\nSkipping {name} because a dependency failed.")
+                        continue
+
+                    # Runs in a copy of the caller's context (e.g. its open
+                    # trace spans)
+                    running[pool.submit(copy_context().run, self.execute, task)] = task
+
+                if not running:
+                    continue
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    task = running.pop(future)
+                    if future.exception() is not None:
+                        task.error = future.exception()
+                        print(f"\nERROR: task {task.name} failed: {task.error}")
+
+        return {name: task.result for name, task in self.tasks.items()}
+
+    def critical_path(self):
+        # Walks back from the last task to finish through its latest dependency
+        finished = [task for task in self.tasks.values() if task.end is not None]
+        if not finished:
+            return []
+
+        path = [max(finished, key=lambda task: task.end)]
+        while True:
+            deps = [self.tasks[dep] for dep in path[-1].deps]
+            deps = [dep for dep in deps if dep.end is not None]
+            if not deps:
+                break
+            path.append(max(deps, key=lambda dep: dep.end))
+
+        return list(reversed(path))
+
+    def report(self, title: str = "Timing report"):
+        print(f"\n{title}")
+        print(f"{'Task':<30}{'Start':>10}{'Duration':>10}  Status")
+
+        for task in self.tasks.values():
+            if task.skipped:
+                status, start = "skipped", "-"
+            else:
+                status = "ok" if task.ok else "failed"
+                start = f"{task.start - self.t0:.1f}s"
+            print(f"{task.name:<30}{start:>10}{task.duration:>9.1f}s  {status}")
+
+        path = self.critical_path()
+        if path:
+            total = path[-1].end - self.t0
+            print(f"\nCritical path ({total:.1f}s):")
+            print(" -> ".join(task.name for task in path))
@@ -0,0 +1,14 @@
+#!/bin/bash
+# Bake stage: everything that doesn't depend on the Postgres IP goes into the AMI
+sudo apt update
+git clone https://github.com/BrunoSDomingues/tasks.git && mv tasks /home/ubuntu
+cd /home/ubuntu/tasks/
+./install.sh
+status=$?
+echo $status >> /home/ubuntu/default.txt
+
+# AWSCreate.bake_image images the instance once it has stopped, a failed
+# install leaves it running so it can be inspected
+if [ $status -eq 0 ]; then
+    sudo shutdown -h now
+fi
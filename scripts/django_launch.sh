@@ -0,0 +1,8 @@
+#!/bin/bash
+# Launch stage: the baked AMI connects to the database host "node1", this points it at Postgres
+echo "ADD_IP_HERE node1" >> /etc/hosts
+
+# node1 doesn't resolve while baking, so the migrations install.sh runs there
+# fail and are applied here, once the database answers (they're idempotent)
+cd /home/ubuntu/tasks/
+until python3 manage.py migrate --noinput; do sleep 10; done
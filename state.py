@@ -0,0 +1,84 @@
+# Extra imports
+import json
+import os
+from threading import Lock
+
+# Written by main.py next to the network cache
+STATE_PATH = ".cache/state.json"
+
+
+class StateStore:
+    def __init__(self, path: str = None):
+        # Optional JSON file, so later runs (or a teardown after a failed
+        # rebuild) go straight to the resources without describing them
+        self.path = path
+        self.lock = Lock()
+
+        # IDs keyed by region, kind ("instances", "security_groups"...) and the
+        # tag value or name they would otherwise be discovered by
+        self.entries = self.load()
+
+    def use_file(self, path: str):
+        # Starts persisting to the file, reusing whatever it already holds
+        with self.lock:
+            self.path = path
+            self.entries = self.load()
+
+    def load(self):
+        if self.path and os.path.exists(self.path):
+            try:
+                with open(self.path, "r") as f:
+                    return json.load(f)
+            except (OSError, ValueError):
+                # A corrupt state file only means resources are discovered again
+                return {}
+        return {}
+
+    def save(self):
+        if not self.path:
+            return
+
+        folder = os.path.dirname(self.path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+
+        with open(self.path, "w") as f:
+            json.dump(self.entries, f, indent=2)
+
+    def ids(self, region: str, kind: str, key: str):
+        # None when nothing is known (tag discovery is needed), a list otherwise
+        with self.lock:
+            ids = self.entries.get(region, {}).get(kind, {}).get(key)
+            return list(ids) if ids is not None else None
+
+    def add(self, region: str, kind: str, key: str, resource_id: str):
+        with self.lock:
+            ids = (
+                self.entries.setdefault(region, {})
+                .setdefault(kind, {})
+                .setdefault(key, [])
+            )
+            if resource_id not in ids:
+                ids.append(resource_id)
+                self.save()
+
+    def set(self, region: str, kind: str, key: str, ids: list):
+        # Everything that exists for the key. Nothing left is forgotten rather
+        # than stored, so resources created elsewhere (another machine, the
+        # console) are still found by tag next time
+        if not ids:
+            return self.forget(region, kind, key)
+
+        with self.lock:
+            self.entries.setdefault(region, {}).setdefault(kind, {})[key] = list(ids)
+            self.save()
+
+    def forget(self, region: str, kind: str, key: str):
+        # Drops out of date IDs, the next use discovers them by tag
+        with self.lock:
+            if self.entries.get(region, {}).get(kind, {}).pop(key, None) is not None:
+                self.save()
+
+
+# Process-wide store shared by every AWSDefault object
+store = StateStore()
@@ -0,0 +1,101 @@
+# Test imports
+import pytest
+
+# Boto3 imports
+import boto3
+
+# Shared objects every AWS class is built with
+from clients import ClientRegistry
+from network import NetworkCache
+from ratelimit import DEFAULT_RATES, RateLimiter
+from state import StateStore
+from wait import FakeClock, Waiter
+
+# Local AWS stand-in, only the moto-backed tests need it
+try:
+    from moto import mock_aws
+except ImportError:
+    mock_aws = None
+
+REGION = "us-east-1"
+TAGS = {
+    "key_tags": {"Key": "Name", "Value": "test_key"},
+    "security_tags": {"Key": "Name", "Value": "test_security"},
+    "instance_tags": {"Key": "Name", "Value": "test_instance"},
+}
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def waiter(clock):
+    # Polls without sleeping and without jitter, so delays are exact
+    return Waiter(clock=clock, jitter=0)
+
+
+@pytest.fixture
+def aws(monkeypatch, tmp_path):
+    # Mocked account, with key files written to a scratch folder
+    if mock_aws is None:
+        pytest.skip("moto isn't installed")
+
+    for variable in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"):
+        monkeypatch.setenv(variable, "testing")
+    monkeypatch.chdir(tmp_path)
+
+    with mock_aws():
+        yield
+
+
+@pytest.fixture
+def isolated(aws, waiter):
+    # Arguments of an AWS class that share nothing with the rest of the process
+    return {
+        "region": REGION,
+        **TAGS,
+        "waiter": waiter,
+        "clients": ClientRegistry(
+            rate_limiter=RateLimiter({service: (1e6, 1e6) for service in DEFAULT_RATES})
+        ),
+        "network_cache": NetworkCache(),
+        "state_store": StateStore(),
+    }
+
+
+@pytest.fixture
+def moto_interfaces(isolated):
+    # AWS deletes the network interfaces of terminated instances, moto keeps
+    # them and security group deletions wait on them until their timeout
+    def prune(client):
+        if client.meta.service_model.service_name != "ec2":
+            return
+
+        # A client of its own, so the extra calls don't go through the hooks
+        ec2 = boto3.client("ec2", region_name=client.meta.region_name)
+
+        def prune_interfaces(**kwargs):
+            terminated = ec2.describe_instances(
+                Filters=[{"Name": "instance-state-name", "Values": ["terminated"]}]
+            )["Reservations"]
+            instance_ids = [
+                instance["InstanceId"]
+                for reservation in terminated
+                for instance in reservation["Instances"]
+            ]
+            if not instance_ids:
+                return
+            for interface in ec2.describe_network_interfaces(
+                Filters=[{"Name": "attachment.instance-id", "Values": instance_ids}]
+            )["NetworkInterfaces"]:
+                ec2.delete_network_interface(
+                    NetworkInterfaceId=interface["NetworkInterfaceId"]
+                )
+
+        client.meta.events.register(
+            "before-call.ec2.DescribeNetworkInterfaces", prune_interfaces
+        )
+
+    isolated["clients"].add_hook(prune)
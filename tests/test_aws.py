@@ -0,0 +1,121 @@
+# Test imports
+import pytest
+
+# Boto3 imports
+from botocore.exceptions import ClientError
+
+# AWS classes
+from aws_create import AWSCreate
+from aws_delete import AWSDelete
+
+IMAGE = "ami-12c6146b"
+PERMISSIONS = [
+    {
+        "IpProtocol": "tcp",
+        "FromPort": 22,
+        "ToPort": 22,
+        "IpRanges": [{"CidrIp": "0.0.0.0/0"}],
+    }
+]
+
+
+@pytest.fixture
+def create(isolated):
+    create = AWSCreate(**isolated)
+    create.generate_key_pair("test_key", "test_instance")
+    create.create_security_group("test_group", PERMISSIONS)
+    return create
+
+
+@pytest.fixture
+def delete(isolated, create):
+    return AWSDelete(**isolated)
+
+
+def test_instance_waits_on_the_shared_waiter(create, clock):
+    assert create.create_instance(IMAGE, "#!/bin/bash\n")
+    assert create.status_ok(create.instance_id)
+
+
+def test_instance_status_timeout_is_handled(create, clock, monkeypatch):
+    monkeypatch.setattr(AWSCreate, "status_ok", lambda self, instance_id: False)
+
+    assert create.create_instance(IMAGE, "#!/bin/bash\n") is None
+    assert clock.now == create.waiter.timeout
+
+
+def test_failed_ami_is_reported(create, monkeypatch):
+    create.create_instance(IMAGE, "#!/bin/bash\n")
+    monkeypatch.setattr(AWSCreate, "image_state", lambda self, image_id: "failed")
+
+    create.create_ami_image("test_ami")
+    assert create.ami_id is None
+
+
+def test_termination_timeout_is_handled(create, delete, monkeypatch):
+    create.create_instance(IMAGE, "#!/bin/bash\n")
+    monkeypatch.setattr(AWSDelete, "terminated", lambda self, instance_ids: False)
+
+    assert delete.delete_instances()["ids"] == []
+    assert delete.store.ids(delete.region, "instances", "test_instance") == [
+        create.instance_id
+    ]
+
+
+def test_deletions_report_what_was_deleted(create, delete):
+    create.create_instance(IMAGE, "#!/bin/bash\n")
+
+    assert delete.delete_instances()["ids"] == [create.instance_id]
+    assert delete.delete_key_pairs()["ids"] == ["test_key"]
+
+
+def test_failed_key_pair_deletion_isnt_reported(create, delete, monkeypatch):
+    def denied(**kwargs):
+        raise ClientError(
+            {"Error": {"Code": "UnauthorizedOperation", "Message": "denied"}},
+            "DeleteKeyPair",
+        )
+
+    monkeypatch.setattr(delete.client, "delete_key_pair", denied)
+    assert delete.delete_key_pairs()["ids"] == []
+
+
+def test_network_cache_is_scoped_by_account(isolated):
+    cache = isolated["network_cache"]
+    create = AWSCreate(**isolated)
+    vpc_id = create.vpc_id
+    assert cache.entries[f"123456789012:{create.region}"]["vpc_id"]["value"] == vpc_id
+
+    # Credentials of another account don't see the first one's topology
+    isolated["clients"].account_id = "999999999999"
+    assert f"999999999999:{create.region}" not in cache.entries
+    create.refresh()
+    assert f"123456789012:{create.region}" in cache.entries
+
+
+def test_stale_security_groups_arent_reported(create, delete):
+    # The state file also lists a group that's already gone
+    stale = "sg-0123456789abcdef0"
+    key = delete.security_tags["Value"]
+    delete.store.set(delete.region, "security_groups", key, [stale])
+
+    assert delete.delete_security_group()["ids"] == [create.sec_group_id]
+    assert not delete.store.ids(delete.region, "security_groups", key)
+
+
+def test_tagged_resources_missing_from_the_store_are_deleted(create, delete):
+    create.create_instance(IMAGE, "#!/bin/bash\n")
+
+    # Launched with the same tags by something that didn't record it
+    untracked = delete.client.run_instances(
+        ImageId=IMAGE,
+        MinCount=1,
+        MaxCount=1,
+        TagSpecifications=[
+            {"ResourceType": "instance", "Tags": [delete.instance_tags]}
+        ],
+    )["Instances"][0]["InstanceId"]
+
+    assert sorted(delete.delete_instances()["ids"]) == sorted(
+        [create.instance_id, untracked]
+    )
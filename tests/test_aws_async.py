@@ -0,0 +1,133 @@
+# Test imports
+import pytest
+
+# Async and blocking AWS classes
+from aws_async import AsyncAWSCreate, AsyncAWSDelete
+from aws_create import AWSCreate
+from aws_delete import AWSDelete
+
+# Endpoint cache keys
+from network import endpoint_key
+
+# Extra imports
+import asyncio
+import inspect
+
+IMAGE = "ami-12c6146b"
+PERMISSIONS = [
+    {
+        "IpProtocol": "tcp",
+        "FromPort": 8080,
+        "ToPort": 8080,
+        "IpRanges": [{"CidrIp": "0.0.0.0/0"}],
+    }
+]
+LOAD_TAGS = {"Key": "Name", "Value": "test_lb"}
+
+
+@pytest.mark.parametrize(
+    "async_class, sync_class",
+    [(AsyncAWSCreate, AWSCreate), (AsyncAWSDelete, AWSDelete)],
+)
+def test_every_method_is_a_coroutine(async_class, sync_class, isolated):
+    wrapper = async_class(**isolated)
+    for name, _ in inspect.getmembers(sync_class, inspect.isfunction):
+        if not name.startswith("_"):
+            assert inspect.iscoroutinefunction(getattr(wrapper, name)), name
+
+
+def test_attributes_are_shared_with_the_sync_object(isolated):
+    create = AsyncAWSCreate(**isolated)
+    create.key_pair_name = "test_key"
+    assert create.sync.key_pair_name == "test_key"
+    assert create.region == create.sync.region
+
+
+@pytest.fixture
+def create(isolated, moto_interfaces):
+    create = AsyncAWSCreate(**isolated)
+    asyncio.run(create.generate_key_pair("test_key", "test_instance"))
+    asyncio.run(create.create_security_group("test_group", PERMISSIONS))
+    return create
+
+
+@pytest.fixture
+def delete(isolated, create):
+    return AsyncAWSDelete(**isolated)
+
+
+def test_create_and_delete_instances(create, delete):
+    public_ip = asyncio.run(create.create_instance(IMAGE, "#!/bin/bash\n"))
+    assert public_ip
+
+    summary = asyncio.run(delete.delete_instances())
+    assert summary["ids"] == [create.instance_id]
+    assert create.sync.instance_state(create.instance_id) == "terminated"
+    assert create.store.ids(create.region, "instances", "test_instance") is None
+
+
+def test_regions_run_concurrently(create, isolated):
+    async def both():
+        other = AsyncAWSCreate(**{**isolated, "region": "us-west-2"})
+        await other.generate_key_pair("test_key", "test_other")
+        await other.create_security_group("test_group", PERMISSIONS)
+        return await asyncio.gather(
+            create.create_instance(IMAGE, ""), other.create_instance(IMAGE, "")
+        )
+
+    assert all(asyncio.run(both()))
+
+
+def test_bake_images_the_stopped_instance(create, monkeypatch):
+    # The bake script's shutdown, as soon as the instance is first polled
+    instance_state = AWSCreate.instance_state
+
+    def stopped(sync, instance_id: str):
+        sync.client.stop_instances(InstanceIds=[instance_id])
+        return instance_state(sync, instance_id)
+
+    monkeypatch.setattr(AWSCreate, "instance_state", stopped)
+
+    ami_id = asyncio.run(create.bake_image(IMAGE, "#!/bin/bash\n", "test_ami"))
+    assert ami_id and ami_id == create.ami_id
+
+
+def test_bake_times_out_while_the_script_runs(create):
+    assert asyncio.run(create.bake_image(IMAGE, "", "test_ami", timeout=60)) is None
+    assert create.ami_id is None
+
+
+def test_security_group_in_use_is_kept_after_the_timeout(create, delete):
+    # An interface nobody detaches keeps the group in use
+    create.client.create_network_interface(
+        SubnetId=create.subnets[0], Groups=[create.sec_group_id]
+    )
+
+    summary = asyncio.run(delete.delete_security_group(timeout=30))
+    assert summary["count"] == 0
+    assert delete.store.ids(delete.region, "security_groups", "test_security") == [
+        create.sec_group_id
+    ]
+
+
+def test_deleted_load_balancer_forgets_its_endpoint(create, delete):
+    asyncio.run(create.create_load_balancer("test-lb", "test_group", LOAD_TAGS))
+    assert create.network.entries[create.region][endpoint_key("test-lb")]
+
+    asyncio.run(delete.delete_load_balancers("test-lb"))
+    assert endpoint_key("test-lb") not in create.network.entries[create.region]
+
+
+def test_teardown_removes_everything(create, delete):
+    asyncio.run(create.create_instance(IMAGE, "#!/bin/bash\n"))
+    asyncio.run(create.create_load_balancer("test-lb", "test_group", LOAD_TAGS))
+
+    scheduler = asyncio.run(delete.teardown_region(load_name="test-lb"))
+    assert all(task.ok for task in scheduler.tasks.values())
+
+    client = create.client
+    assert not client.describe_key_pairs()["KeyPairs"]
+    assert not client.describe_security_groups(
+        Filters=[{"Name": "group-name", "Values": ["test_group"]}]
+    )["SecurityGroups"]
+    assert create.sync.find_load_balancer("test-lb") is None
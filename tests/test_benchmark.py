@@ -0,0 +1,50 @@
+# Test imports
+import pytest
+
+# Load generator and local stand-in server
+from benchmark import LoadGenerator, StubServer, parse_mix, percentile
+
+# Extra imports
+import asyncio
+
+
+@pytest.mark.parametrize(
+    "count, p, expected",
+    [(100, 50, 50), (100, 95, 95), (100, 99, 99), (100, 100, 100), (10, 50, 5)],
+)
+def test_percentile_is_the_nearest_rank(count, p, expected):
+    assert percentile(list(range(1, count + 1)), p) == expected
+
+
+def test_percentile_edges():
+    assert percentile([], 50) is None
+    assert percentile([7], 99) == 7
+    assert percentile([1, 2, 3], 0) == 1
+
+
+def test_parse_mix():
+    assert parse_mix("create_task=8,get_tasks=2") == {
+        "create_task": 8.0,
+        "get_tasks": 2.0,
+    }
+    assert parse_mix("get_tasks") == {"get_tasks": 1.0}
+
+    with pytest.raises(ValueError):
+        parse_mix("create_task=1,drop_tables=1")
+
+
+def test_load_generator_against_the_stub_server():
+    with StubServer() as server:
+        generator = LoadGenerator(
+            url=server.url, mix={"create_task": 1, "get_tasks": 1}, concurrency=4
+        )
+        results = asyncio.run(generator.run(duration=10, total=20))
+        created = len(server.server.tasks)
+
+    overall = results["overall"]
+    assert (overall["requests"], overall["errors"]) == (20, 0)
+    assert overall["p50"] <= overall["p95"] <= overall["p99"] <= overall["max"]
+
+    operations = results["operations"]
+    assert operations["create_task"]["requests"] == created
+    assert sum(stats["requests"] for stats in operations.values()) == 20
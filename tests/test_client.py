@@ -0,0 +1,66 @@
+# Test imports
+import pytest
+
+# Task manager client and local stand-in server
+from benchmark import StubServer
+from client import TaskClient
+
+
+@pytest.fixture
+def server():
+    with StubServer() as stub:
+        yield stub
+
+
+def tasks(count: int):
+    # Descriptions with spaces, commas and brackets, like the real ones
+    return [
+        {
+            "title": f"task {number}",
+            "pub_date": "2023-01-01T00:00:00",
+            "description": f"write [part {number}], then {{review}} it",
+        }
+        for number in range(count)
+    ]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 65536])
+def test_iter_tasks_matches_get_tasks(server, chunk_size):
+    server.server.tasks.extend(tasks(25))
+
+    with TaskClient(url=server.url) as client:
+        assert list(client.iter_tasks(chunk_size)) == client.get_tasks()
+
+
+def test_iter_tasks_of_an_empty_list(server):
+    with TaskClient(url=server.url) as client:
+        assert list(client.iter_tasks(chunk_size=1)) == []
+
+
+def test_iter_tasks_can_stop_early(server):
+    server.server.tasks.extend(tasks(3))
+
+    with TaskClient(url=server.url) as client:
+        first = next(client.iter_tasks(chunk_size=16))
+    assert first["title"] == "task 0"
+
+
+def test_iter_tasks_of_a_document(server):
+    # Anything other than a list is parsed once complete (the index is a string)
+    with TaskClient(url=server.url) as client:
+        client.send = lambda method, path, **kwargs: client.request(
+            method, "", **kwargs
+        )
+        assert list(client.iter_tasks(chunk_size=3)) == ["Test index"]
+
+
+def test_create_and_delete_tasks(server):
+    with TaskClient(url=server.url, pool_size=4) as client:
+        created = client.create_tasks(
+            [{"title": str(number), "description": ""} for number in range(10)]
+        )
+        assert len(created) == 10
+        assert len(client.get_tasks()) == 10
+
+        client.delete_tasks()
+        assert client.get_tasks() == []
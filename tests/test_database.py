@@ -0,0 +1,78 @@
+# Test imports
+import pytest
+
+# Postgres and PgBouncer configuration
+from database import (
+    DB_PASSWORD,
+    DB_USER,
+    options,
+    pgbouncer_ini,
+    postgres_port,
+    postgres_settings,
+    primary_script,
+    replica_script,
+    userlist,
+    validate_database,
+)
+
+# Extra imports
+from configparser import ConfigParser
+import hashlib
+
+
+def test_defaults_are_valid():
+    assert validate_database({}) == []
+
+
+@pytest.mark.parametrize("instance_type", ["t2.micro", "t3.medium", "r5.large"])
+def test_settings_fit_every_instance_type(instance_type):
+    assert validate_database({"instance_type": instance_type, "replica": True}) == []
+
+
+def test_postgres_moves_off_5432_behind_pgbouncer():
+    assert postgres_port({}) == 5433
+    assert postgres_port({"pgbouncer": False}) == 5432
+    assert postgres_settings({"pgbouncer": False})["max_connections"] == 100
+
+
+def test_unknown_instance_type():
+    assert validate_database({"instance_type": "x1.huge"}) == [
+        "unknown instance type x1.huge"
+    ]
+
+
+def test_pool_larger_than_postgres_accepts():
+    # max_connections follows the pool size, the reserved slots don't
+    settings = postgres_settings({"pool_size": 20})
+    database = {"pool_size": settings["max_connections"], "max_client_conn": 1000}
+    assert validate_database(database) == []
+
+    problems = validate_database({"pool_size": 20, "max_client_conn": 10})
+    assert problems == ["max_client_conn is below pool_size"]
+
+
+def test_unknown_pool_mode():
+    assert validate_database({"pool_mode": "sometimes"}) == [
+        "unknown pool_mode sometimes"
+    ]
+
+
+def test_pgbouncer_ini_parses():
+    parser = ConfigParser()
+    parser.read_string(pgbouncer_ini({"pool_mode": "transaction"}))
+    assert parser["pgbouncer"]["pool_mode"] == "transaction"
+    assert "port=5433" in parser["databases"]["tasks"]
+
+
+def test_userlist_uses_pgbouncer_md5_format():
+    digest = hashlib.md5(f"{DB_PASSWORD}{DB_USER}".encode()).hexdigest()
+    assert userlist() == f'"{DB_USER}" "md5{digest}"\n'
+
+
+def test_scripts_follow_the_options():
+    assert "pgbouncer" not in primary_script({"pgbouncer": False})
+    assert "REPLICATION" not in primary_script({})
+    assert "REPLICATION" in primary_script({"replica": True})
+
+    replica = replica_script(options({"replica": True}), "10.0.0.5")
+    assert "-h 10.0.0.5 -p 5433" in replica
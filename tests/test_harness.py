@@ -0,0 +1,54 @@
+# Offline harness
+import aws
+import aws_delete
+from aws_create import AWSCreate
+from harness import VirtualClock, VirtualScheduler, virtualize
+import main
+from tracing import Tracer
+
+# Extra imports
+from functools import partial
+
+
+def test_virtualize_restores_everything_it_patches():
+    clock = VirtualClock()
+    tracer = Tracer(clock=clock.time)
+    targets = [
+        (aws, "registry"),
+        (aws, "Waiter"),
+        (main, "Scheduler"),
+        (aws_delete, "Scheduler"),
+        (AWSCreate, "instance_state"),
+        (aws.AWSDefault, "__init__"),
+    ]
+    before = [getattr(target, attribute) for target, attribute in targets]
+
+    with virtualize(clock, tracer, latency=0.1, bake_time=300) as (registry, _):
+        assert aws.registry is registry
+        assert main.Scheduler().virtual is clock
+
+    assert [getattr(target, attribute) for target, attribute in targets] == before
+
+
+def test_nested_tasks_start_and_end_in_the_callers_time():
+    clock = VirtualClock()
+    tracer = Tracer(clock=clock.time)
+    scheduler = partial(VirtualScheduler, clock=clock, tracer=tracer)
+
+    def region():
+        # A pool of groups deleted at once, like a region's security groups
+        inner = scheduler()
+        inner.add("slow", lambda: clock.sleep(5))
+        inner.add("fast", lambda: clock.sleep(1))
+        inner.run()
+
+    outer = scheduler()
+    outer.add("setup", lambda: clock.sleep(2))
+    outer.add("region", region, deps=["setup"])
+    with tracer.span("teardown") as span:
+        outer.run()
+
+    tasks = {span["name"]: span for span in tracer.spans if span["cat"] == "task"}
+    assert tasks["region/slow"]["start"] == 2
+    assert (tasks["region"]["end"], clock.time()) == (7, 7)
+    assert span["end"] == 7
@@ -0,0 +1,101 @@
+# Test imports
+import pytest
+
+# Rate limiting and error classification
+from ratelimit import DEFAULT_RATES, RateLimiter, TokenBucket, classify
+
+# Boto3 imports
+import boto3
+from botocore.exceptions import ClientError
+
+
+def bucket(rate: float = 2, burst: float = 3, **kwargs):
+    # Token bucket on a fake clock that sleeping advances
+    now = [0.0]
+
+    def sleep(t: float):
+        now[0] += t
+
+    return TokenBucket(rate, burst, clock=lambda: now[0], sleep=sleep, **kwargs), now
+
+
+def client_error(code: str):
+    return ClientError({"Error": {"Code": code, "Message": code}}, "Operation")
+
+
+def test_burst_is_available_right_away():
+    tokens, now = bucket(rate=2, burst=3)
+    for _ in range(3):
+        tokens.acquire()
+    assert now[0] == 0
+
+
+def test_acquire_waits_for_the_next_token():
+    tokens, now = bucket(rate=2, burst=3)
+    for _ in range(5):
+        tokens.acquire()
+
+    # Two tokens beyond the burst at 2 per second
+    assert now[0] == pytest.approx(1.0)
+
+
+def test_tokens_refill_up_to_the_burst():
+    tokens, now = bucket(rate=2, burst=3)
+    tokens.acquire()
+    now[0] += 100
+    tokens.refill()
+    assert tokens.tokens == 3
+
+
+def test_throttling_halves_the_rate_down_to_the_minimum():
+    tokens, _ = bucket(rate=8, min_rate=1)
+    for expected in (4, 2, 1, 1):
+        tokens.throttled()
+        assert tokens.rate == expected
+
+
+def test_successes_recover_the_rate_additively():
+    tokens, _ = bucket(rate=10)
+    tokens.throttled()
+    tokens.succeeded()
+    assert tokens.rate == 5 + 10 / 20
+
+    for _ in range(100):
+        tokens.succeeded()
+    assert tokens.rate == 10
+
+
+@pytest.mark.parametrize(
+    "code, kind",
+    [
+        ("Throttling", "throttling"),
+        ("RequestLimitExceeded", "throttling"),
+        ("DependencyViolation", "dependency"),
+        ("ServiceUnavailable", "transient"),
+        ("InvalidGroup.NotFound", "fatal"),
+    ],
+)
+def test_classify(code, kind):
+    assert classify(client_error(code)) == kind
+
+
+def test_buckets_are_shared_per_region_and_service():
+    limiter = RateLimiter()
+    assert limiter.bucket("us-east-1", "ec2") is limiter.bucket("us-east-1", "ec2")
+    assert limiter.bucket("us-east-1", "ec2") is not limiter.bucket("us-east-2", "ec2")
+
+
+def test_clients_use_the_rate_of_their_service_name():
+    # The Classic ELB client is named "elb" by botocore
+    limiter = RateLimiter({"elb": (3, 4)})
+    client = boto3.client(
+        "elb",
+        region_name="us-east-1",
+        aws_access_key_id="testing",
+        aws_secret_access_key="testing",
+    )
+    limiter.attach(client)
+
+    assert limiter.bucket("us-east-1", "elb").max_rate == 3
+    assert set(limiter.buckets) == {("us-east-1", "elb")}
+    assert "elb" in DEFAULT_RATES
@@ -0,0 +1,197 @@
+# Test imports
+import pytest
+
+# Plan/apply reconciler
+from reconcile import Reconciler, ingress_permissions, ingress_rules
+
+# AWS classes
+from aws_create import AWSCreate
+from aws_delete import AWSDelete
+
+# Content hashes tagged on instances
+from ami_cache import HASH_TAG, content_hash
+
+# Extra imports
+import os
+
+IMAGE = "ami-12c6146b"
+USER_DATA = "#!/bin/bash\necho hi\n"
+PERMISSIONS = [
+    {
+        "IpProtocol": "tcp",
+        "FromPort": 22,
+        "ToPort": 22,
+        "IpRanges": [{"CidrIp": "0.0.0.0/0"}],
+    }
+]
+
+
+def instance_spec(**extra):
+    return {
+        "key_pair": {"name": "test_key", "filename": "test_instance"},
+        "security_group": {"name": "test_group", "permissions": PERMISSIONS},
+        "instance": {"image": IMAGE, "user_data": "unused"},
+        **extra,
+    }
+
+
+def instance_state(**instance):
+    # Described state where everything matches instance_spec
+    return {
+        "key_pair": {"KeyName": "test_key"},
+        "security_group": {"GroupId": "sg-1", "IpPermissions": PERMISSIONS},
+        "instance": [
+            {
+                "InstanceId": "i-1",
+                "ImageId": IMAGE,
+                "InstanceType": "t2.micro",
+                "Tags": [{"Key": HASH_TAG, "Value": content_hash(IMAGE, USER_DATA)}],
+                **instance,
+            }
+        ],
+    }
+
+
+def planned(spec: dict, state: dict):
+    # Plans against injected state, so nothing is described
+    reconciler = Reconciler(spec, create=None, delete=None)
+    reconciler.state = state
+    return {resource: action for resource, action, _ in reconciler.plan(USER_DATA)}
+
+
+@pytest.fixture
+def key_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(".ssh")
+    path = os.path.join(".ssh", "test_instance")
+    open(path, "w").close()
+    return path
+
+
+def test_ingress_rules_round_trip():
+    rules = ingress_rules(PERMISSIONS)
+    assert rules == {("tcp", 22, 22, "cidr", "0.0.0.0/0")}
+    assert ingress_permissions(rules) == PERMISSIONS
+
+
+def test_everything_matching_is_kept(key_file):
+    assert set(planned(instance_spec(), instance_state()).values()) == {"keep"}
+
+
+def test_missing_resources_are_created(key_file):
+    state = {"key_pair": None, "security_group": None, "instance": []}
+    assert set(planned(instance_spec(), state).values()) == {"create"}
+
+
+def test_missing_key_file_keeps_the_key_pair(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    actions = planned(instance_spec(), instance_state())
+    assert actions == {"key_pair": "keep", "security_group": "keep", "instance": "keep"}
+
+
+def test_changed_user_data_replaces_the_instance(key_file):
+    state = instance_state(Tags=[{"Key": HASH_TAG, "Value": "old"}])
+    assert planned(instance_spec(), state)["instance"] == "replace"
+
+
+def test_security_group_rules_are_updated(key_file):
+    state = instance_state()
+    state["security_group"] = {"GroupId": "sg-1", "IpPermissions": []}
+    assert planned(instance_spec(), state)["security_group"] == "update"
+
+
+def test_new_key_pair_replaces_web_instances_but_not_the_database(key_file):
+    state = instance_state()
+    state["key_pair"] = None
+    assert planned(instance_spec(), state)["instance"] == "replace"
+
+    database = instance_spec(database={"instance_type": "t2.micro"})
+    assert planned(database, state)["instance"] == "keep"
+
+
+def autoscaling_state(scaling: bool, **group):
+    return {
+        "autoscaling": {"MinSize": 2, "MaxSize": 3, "DesiredCapacity": 2, **group},
+        "warm_pool": None,
+        "scaling": ({"web-cpu": 50.0}, {}) if scaling else ({}, {}),
+    }
+
+
+def autoscaling_spec(scaling: bool):
+    sizes = {"name": "web", "min_size": 2, "max_size": 3, "desired": 2}
+    if scaling:
+        sizes["scaling"] = {"cpu_target": 50}
+    return {"autoscaling": sizes}
+
+
+@pytest.mark.parametrize("scaling", [False, True])
+def test_autoscaling_size_drift_is_updated(scaling):
+    spec = autoscaling_spec(scaling)
+    assert planned(spec, autoscaling_state(scaling)) == {"autoscaling": "keep"}
+    assert planned(spec, autoscaling_state(scaling, MinSize=1)) == {
+        "autoscaling": "update"
+    }
+    assert planned(spec, autoscaling_state(scaling, MaxSize=9)) == {
+        "autoscaling": "update"
+    }
+
+
+def test_desired_capacity_is_left_to_scaling_policies():
+    state = autoscaling_state(False, DesiredCapacity=3)
+    assert planned(autoscaling_spec(False), state) == {"autoscaling": "update"}
+    state = autoscaling_state(True, DesiredCapacity=3)
+    assert planned(autoscaling_spec(True), state) == {"autoscaling": "keep"}
+
+
+def test_removed_scaling_block_deletes_the_policies():
+    reconciler = Reconciler(autoscaling_spec(False), create=None, delete=None)
+    reconciler.state = autoscaling_state(True)
+
+    assert reconciler.plan(USER_DATA) == [
+        ("autoscaling", "update", "scaling policies differ")
+    ]
+    assert reconciler.stale_scaling() == (["web-cpu"], [])
+
+
+def test_update_deletes_policies_no_longer_in_the_spec(isolated):
+    create = AWSCreate(**isolated)
+    create.autoscaling.create_launch_configuration(
+        LaunchConfigurationName="web", ImageId=IMAGE, InstanceType="t2.micro"
+    )
+    create.autoscaling.create_auto_scaling_group(
+        AutoScalingGroupName="web",
+        LaunchConfigurationName="web",
+        MinSize=2,
+        MaxSize=3,
+        DesiredCapacity=2,
+        AvailabilityZones=[f"{create.region}a"],
+    )
+    create.create_scaling_policies(
+        "web",
+        "web-lb",
+        cpu_target=50,
+        scheduled=[{"name": "peak", "recurrence": "0 8 * * *", "desired": 3}],
+    )
+
+    spec = {"load_balancer": {"name": "web-lb"}, **autoscaling_spec(False)}
+    reconciler = Reconciler(spec, create, AWSDelete(**isolated))
+    reconciler.describe()
+    assert reconciler.scaling_differs()
+
+    reconciler.update_autoscaling("update", "web", launch_template=False)
+    reconciler.state = {}
+    reconciler.describe()
+    assert reconciler.state["scaling"] == ({}, {})
+
+
+def test_apply_then_plan_again_keeps_everything(isolated):
+    def reconciler():
+        return Reconciler(instance_spec(), AWSCreate(**isolated), AWSDelete(**isolated))
+
+    first = reconciler()
+    assert {action for _, action, _ in first.plan(USER_DATA)} == {"create"}
+    assert first.apply()
+
+    second = reconciler()
+    assert {action for _, action, _ in second.plan(USER_DATA)} == {"keep"}
+    assert second.state["instance"][0]["InstanceId"] == first.create.instance_id
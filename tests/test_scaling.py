@@ -0,0 +1,77 @@
+# Offline scaling checks
+from scaling import cron_problems, peak_capacity, policy_targets, validate_scaling
+
+
+def sizes(**scaling):
+    return {
+        "name": "group",
+        "min_size": 2,
+        "max_size": 3,
+        "desired": 2,
+        "scaling": {
+            "cpu_target": 50,
+            "requests_per_instance": 600,
+            "warmup": 120,
+            "scheduled": [
+                {
+                    "name": "peak",
+                    "recurrence": "0 12 * * MON-FRI",
+                    "min_size": 3,
+                    "max_size": 5,
+                },
+                {"name": "off_peak", "recurrence": "0 22 * * MON-FRI"},
+            ],
+            **scaling,
+        },
+    }
+
+
+def test_valid_spec_has_no_problems():
+    assert validate_scaling(sizes()) == []
+
+
+def test_sizes_are_checked():
+    spec = {"name": "group", "min_size": 4, "max_size": 3, "desired": 5}
+    problems = validate_scaling(spec)
+    assert any("above max_size" in problem for problem in problems)
+    assert any("outside" in problem for problem in problems)
+
+
+def test_targets_are_checked():
+    problems = validate_scaling(
+        sizes(cpu_target=150, requests_per_instance=0, warmup=-1)
+    )
+    assert len(problems) == 3
+
+
+def test_scaling_needs_a_policy_or_a_schedule():
+    spec = sizes(cpu_target=None, requests_per_instance=None, scheduled=[])
+    assert validate_scaling(spec) == [
+        "scaling has no target tracking policy or scheduled action"
+    ]
+
+
+def test_duplicate_scheduled_actions():
+    action = {"name": "peak", "recurrence": "0 12 * * *"}
+    problems = validate_scaling(sizes(scheduled=[action, action]))
+    assert problems == ["scheduled action peak is defined more than once"]
+
+
+def test_cron_fields():
+    assert cron_problems("*/5 0-23 1,15 JAN-DEC SUN") == []
+    assert len(cron_problems("0 12 * *")) == 1
+    assert len(cron_problems("60 24 * * *")) == 2
+    assert len(cron_problems("0 12 * * FRI-MON")) == 1
+    assert len(cron_problems("*/0 * * * *")) == 1
+
+
+def test_policy_targets():
+    assert policy_targets("group", sizes()["scaling"]) == {
+        "group-cpu": 50.0,
+        "group-requests": 600.0,
+    }
+
+
+def test_peak_capacity_counts_scheduled_max_sizes():
+    assert peak_capacity(sizes(), 2400) == {"needed": 4, "max_size": 5}
+    assert peak_capacity(sizes(requests_per_instance=None), 2400)["needed"] is None
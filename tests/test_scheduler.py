@@ -0,0 +1,91 @@
+# Test imports
+import pytest
+
+# Dependency graph
+from scheduler import Scheduler
+
+# Extra imports
+from threading import Event
+
+
+def fail():
+    raise RuntimeError("boom")
+
+
+def test_results_are_passed_to_dependents():
+    scheduler = Scheduler()
+    scheduler.add("a", lambda: 2)
+    scheduler.add("b", lambda: scheduler.result("a") * 3, deps=["a"])
+
+    assert scheduler.run() == {"a": 2, "b": 6}
+    assert scheduler.tasks["b"].start >= scheduler.tasks["a"].end
+
+
+def test_independent_tasks_run_concurrently():
+    # Each task waits for the other to start, which only works in parallel
+    started = {"a": Event(), "b": Event()}
+
+    def task(name: str, other: str):
+        started[name].set()
+        return started[other].wait(timeout=5)
+
+    scheduler = Scheduler(max_workers=2)
+    scheduler.add("a", lambda: task("a", "b"))
+    scheduler.add("b", lambda: task("b", "a"))
+
+    assert scheduler.run() == {"a": True, "b": True}
+
+
+def test_failure_skips_dependents_transitively():
+    scheduler = Scheduler()
+    scheduler.add("fails", fail)
+    scheduler.add("child", lambda: "never", deps=["fails"])
+    scheduler.add("grandchild", lambda: "never", deps=["child"])
+    scheduler.add("independent", lambda: "ran")
+
+    results = scheduler.run()
+    tasks = scheduler.tasks
+
+    assert isinstance(tasks["fails"].error, RuntimeError)
+    assert tasks["child"].skipped and tasks["grandchild"].skipped
+    assert tasks["child"].start is None
+    assert results["independent"] == "ran"
+    assert not tasks["fails"].ok and tasks["independent"].ok
+
+
+def test_dependency_with_several_parents_waits_for_all():
+    order = []
+    scheduler = Scheduler()
+    scheduler.add("a", lambda: order.append("a"))
+    scheduler.add("b", lambda: order.append("b"))
+    scheduler.add("c", lambda: order.append("c"), deps=["a", "b"])
+    scheduler.run()
+
+    assert order[-1] == "c"
+
+
+def test_unknown_and_duplicate_tasks_are_rejected():
+    scheduler = Scheduler()
+    with pytest.raises(ValueError, match="unknown"):
+        scheduler.add("a", lambda: None, deps=["missing"])
+
+    scheduler.add("a", lambda: None)
+    with pytest.raises(ValueError, match="already exists"):
+        scheduler.add("a", lambda: None)
+
+
+def test_critical_path_follows_the_latest_dependency():
+    # Tasks advance a fake clock by their duration, one at a time
+    now = [0]
+
+    def takes(seconds: float):
+        now[0] += seconds
+
+    scheduler = Scheduler(max_workers=1, clock=lambda: now[0])
+    scheduler.add("short", lambda: takes(1))
+    scheduler.add("long", lambda: takes(10))
+    scheduler.add("last", lambda: takes(2), deps=["short", "long"])
+    scheduler.run()
+
+    assert [task.name for task in scheduler.critical_path()] == ["long", "last"]
+    assert scheduler.tasks["last"].duration == 2
@@ -0,0 +1,159 @@
+# Test imports
+import pytest
+
+# Span and API call tracing
+from scheduler import Scheduler
+from tracing import Tracer
+
+# Boto3 imports
+import boto3
+from botocore.config import Config
+from botocore.awsrequest import AWSResponse
+from botocore.exceptions import ClientError, EndpointConnectionError
+from botocore.stub import Stubber
+
+
+def ec2_client(**kwargs):
+    return boto3.client(
+        "ec2",
+        region_name="us-east-1",
+        aws_access_key_id="testing",
+        aws_secret_access_key="testing",
+        **kwargs,
+    )
+
+
+@pytest.fixture
+def tracer():
+    # Every clock reading is one second after the previous one
+    ticks = iter(range(1000))
+    return Tracer(clock=lambda: next(ticks))
+
+
+def test_api_calls_are_counted_in_open_spans(tracer):
+    client = ec2_client()
+    tracer.attach(client)
+
+    with Stubber(client) as stubber:
+        stubber.add_response("describe_vpcs", {"Vpcs": []})
+        stubber.add_client_error("describe_subnets", service_error_code="Blocked")
+
+        with tracer.span("describe", region="us-east-1") as span:
+            client.describe_vpcs()
+            with pytest.raises(ClientError):
+                client.describe_subnets()
+
+    assert tracer.totals["api_calls"] == 2
+    assert tracer.totals["errors"] == 1
+    assert (span["api_calls"], span["errors"]) == (2, 1)
+
+    api = [span for span in tracer.spans if span["cat"] == "api"]
+    assert [span["name"] for span in api] == ["ec2.DescribeVpcs", "ec2.DescribeSubnets"]
+    assert api[1]["args"] == {"error": "Blocked"}
+
+
+class Raw:
+    def __init__(self, body: bytes):
+        self.body = body
+
+    def stream(self, **kwargs):
+        yield self.body
+
+
+THROTTLED = b"""<Response><Errors><Error><Code>RequestLimitExceeded</Code>
+<Message>Request limit exceeded.</Message></Error></Errors></Response>"""
+NO_VPCS = b"""<DescribeVpcsResponse><vpcSet/></DescribeVpcsResponse>"""
+
+
+def test_throttles_are_counted(tracer):
+    # The throttled response goes through botocore's retry handler, which
+    # fires needs-retry before the second attempt succeeds
+    client = ec2_client(config=Config(retries={"total_max_attempts": 2}))
+    tracer.attach(client)
+    responses = iter([(503, THROTTLED), (200, NO_VPCS)])
+
+    def respond(request, **kwargs):
+        status, body = next(responses)
+        return AWSResponse(request.url, status, {}, Raw(body))
+
+    client.meta.events.register("before-send.ec2.*", respond)
+    with tracer.span("describe") as span:
+        assert client.describe_vpcs()["Vpcs"] == []
+
+    assert tracer.totals == {"api_calls": 1, "retries": 1, "throttles": 1, "errors": 0}
+    assert (span["throttles"], span["retries"]) == (1, 1)
+
+
+def test_calls_in_scheduler_tasks_count_towards_open_spans(tracer):
+    client = ec2_client()
+    tracer.attach(client)
+
+    def describe():
+        # A nested scheduler, as a region's teardown runs inside a task
+        inner = Scheduler(max_workers=2)
+        inner.add("vpcs", client.describe_vpcs)
+        inner.add("subnets", client.describe_subnets, deps=["vpcs"])
+        inner.run()
+
+    with Stubber(client) as stubber:
+        stubber.add_response("describe_vpcs", {"Vpcs": []})
+        stubber.add_response("describe_subnets", {"Subnets": []})
+
+        with tracer.span("teardown") as span:
+            scheduler = Scheduler()
+            scheduler.add("region", describe)
+            scheduler.run()
+
+    assert span["api_calls"] == 2
+    assert tracer.stack() == ()
+
+
+def test_calls_failing_before_a_response_are_recorded(tracer):
+    # after-call-error only gets the exception, the model comes from before-call
+    client = ec2_client(config=Config(retries={"total_max_attempts": 1}))
+    tracer.attach(client)
+
+    def unreachable(request, **kwargs):
+        raise EndpointConnectionError(endpoint_url=request.url)
+
+    client.meta.events.register("before-send.ec2.*", unreachable)
+    with pytest.raises(EndpointConnectionError):
+        client.describe_vpcs()
+
+    (span,) = tracer.spans
+    assert span["name"] == "ec2.DescribeVpcs"
+    assert span["args"] == {"error": "EndpointConnectionError"}
+    assert tracer.totals["errors"] == 1
+
+
+def test_instrument_wraps_public_methods_once(tracer):
+    class Resource:
+        region = "us-east-2"
+
+        def create(self, value):
+            return value * 2
+
+        def _private(self):
+            return "untraced"
+
+    tracer.instrument(Resource)
+    tracer.instrument(Resource)
+
+    resource = Resource()
+    assert resource.create(4) == 8
+    assert resource._private() == "untraced"
+
+    (span,) = tracer.spans
+    assert (span["name"], span["cat"]) == ("Resource.create", "method")
+    assert span["args"] == {"region": "us-east-2"}
+
+
+def test_chrome_trace_events(tracer):
+    with tracer.span("outer"):
+        with tracer.span("inner", cat="method"):
+            pass
+
+    events = {event["name"]: event for event in tracer.chrome_trace()["traceEvents"]}
+    assert events["outer"]["dur"] == 3e6
+    assert events["inner"]["ts"] == 2e6
+    assert events["inner"]["args"]["api_calls"] == 0
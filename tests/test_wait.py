@@ -0,0 +1,107 @@
+# Test imports
+import pytest
+
+# Waiting subsystem
+from wait import FakeClock, WaitCancelled, WaitHandle, Waiter, WaitTimeout
+
+# Extra imports
+import asyncio
+
+
+def polls(results: list):
+    # Condition returning the given results in order, counting the calls
+    calls = []
+
+    def condition():
+        calls.append(len(calls))
+        return results[len(calls) - 1]
+
+    return condition, calls
+
+
+def test_returns_the_first_truthy_result(waiter, clock):
+    condition, calls = polls([None, 0, "done"])
+
+    assert waiter.wait_until(condition) == "done"
+    assert len(calls) == 3
+
+
+def test_no_sleep_when_ready_right_away(waiter, clock):
+    assert waiter.wait_until(lambda: True) is True
+    assert clock.slept == 0
+
+
+def test_delays_back_off_up_to_max_delay(clock):
+    waiter = Waiter(delay=2, max_delay=15, backoff=2, jitter=0, clock=clock)
+    condition, calls = polls([None] * 5 + [True])
+
+    waiter.wait_until(condition)
+
+    # 2, 4, 8, then capped at 15
+    assert clock.slept == 2 + 4 + 8 + 15 + 15
+
+
+def test_jitter_stays_within_bounds(clock):
+    waiter = Waiter(delay=10, backoff=1, jitter=0.1, clock=clock)
+    delays = waiter.delays()
+
+    for _ in range(100):
+        assert 9 <= next(delays) <= 11
+
+
+def test_times_out_at_the_deadline(waiter, clock):
+    with pytest.raises(WaitTimeout, match="thing"):
+        waiter.wait_until(lambda: None, name="thing", timeout=10)
+
+    # The last sleep is cut short, so the wait ends exactly at the deadline
+    assert clock.now == 10
+
+
+def test_every_wait_gets_its_own_deadline(waiter, clock):
+    with pytest.raises(WaitTimeout):
+        waiter.wait_until(lambda: None, timeout=5)
+
+    condition, _ = polls([None, True])
+    assert waiter.wait_until(condition, timeout=5)
+    assert clock.now == 5 + 2
+
+
+def test_zero_timeout_still_polls_once(waiter, clock):
+    assert waiter.wait_until(lambda: "ready", timeout=0) == "ready"
+
+    with pytest.raises(WaitTimeout):
+        waiter.wait_until(lambda: None, timeout=0)
+    assert clock.slept == 0
+
+
+def test_cancelled_handle_stops_the_wait(waiter):
+    handle = WaitHandle()
+
+    def condition():
+        handle.cancel()
+        return None
+
+    with pytest.raises(WaitCancelled):
+        waiter.wait_until(condition, handle=handle)
+
+
+def test_async_wait_uses_the_same_backoff(clock):
+    waiter = Waiter(delay=1, backoff=3, jitter=0, clock=clock)
+    condition, calls = polls([None, None, "done"])
+
+    assert asyncio.run(waiter.wait_until_async(condition)) == "done"
+    assert clock.slept == 1 + 3
+
+
+def test_async_wait_times_out(waiter, clock):
+    with pytest.raises(WaitTimeout):
+        asyncio.run(waiter.wait_until_async(lambda: None, timeout=7))
+    assert clock.now == 7
+
+
+def test_fake_clock_only_advances_when_sleeping():
+    clock = FakeClock(start=100)
+    assert clock.time() == 100
+
+    clock.sleep(2.5)
+    assert (clock.time(), clock.slept) == (102.5, 2.5)
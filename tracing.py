@@ -0,0 +1,187 @@
+# Throttling error codes shared with the rate limiter
+from ratelimit import THROTTLING_CODES
+
+# Extra imports
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+import json
+import threading
+from time import monotonic
+
+
+class Tracer:
+    def __init__(self, clock=monotonic):
+        self.clock = clock
+        self.t0 = clock()
+
+        # Finished spans, appended from every thread
+        self.spans = []
+        self.lock = threading.Lock()
+
+        # Spans currently open, kept in the context so threads started with a
+        # copy of it (the scheduler's tasks) count towards the caller's spans
+        self.open = ContextVar(f"tracer_{id(self)}", default=())
+
+        # Totals for the whole run
+        self.totals = {"api_calls": 0, "retries": 0, "throttles": 0, "errors": 0}
+
+    def stack(self):
+        return self.open.get()
+
+    def count(self, counter: str, amount: int = 1):
+        # API counters go to the run totals and to every open span, which
+        # other threads may be counting into as well
+        with self.lock:
+            self.totals[counter] += amount
+            for span in self.stack():
+                span[counter] += amount
+
+    def new_span(self, name: str, cat: str, start: float, args: dict):
+        return {
+            "name": name,
+            "cat": cat,
+            "start": start,
+            "end": None,
+            "tid": threading.get_ident(),
+            "api_calls": 0,
+            "retries": 0,
+            "throttles": 0,
+            "errors": 0,
+            "args": args,
+        }
+
+    def finish(self, span: dict):
+        span["end"] = self.clock()
+        with self.lock:
+            self.spans.append(span)
+
+    @contextmanager
+    def span(self, name: str, cat: str = "phase", **args):
+        span = self.new_span(name, cat, self.clock(), args)
+        token = self.open.set(self.stack() + (span,))
+        try:
+            yield span
+        finally:
+            self.open.reset(token)
+            self.finish(span)
+
+    ######################## METHOD INSTRUMENTATION ########################
+
+    def instrument(self, cls, methods: list = None):
+        # Wraps the public methods defined by the class (not inherited ones)
+        for name, attr in list(vars(cls).items()):
+            if name.startswith("_") or not callable(attr):
+                continue
+            if methods is not None and name not in methods:
+                continue
+            if getattr(attr, "traced", False):
+                continue
+            setattr(cls, name, self.wrap(f"{cls.__name__}.{name}", attr))
+        return cls
+
+    def wrap(self, name: str, method):
+        @wraps(method)
+        def traced(obj, *args, **kwargs):
+            with self.span(name, cat="method", region=getattr(obj, "region", None)):
+                return method(obj, *args, **kwargs)
+
+        traced.traced = True
+        return traced
+
+    ######################## BOTOCORE EVENTS ########################
+
+    def attach(self, client):
+        # Registers on the client's event system, so no call site changes
+        events = client.meta.events
+        events.register("before-call.*.*", self.before_call)
+        events.register("after-call.*.*", self.after_call)
+        events.register("after-call-error.*.*", self.after_call_error)
+        events.register("needs-retry.*.*", self.needs_retry)
+
+    def before_call(self, model, context, **kwargs):
+        context["trace_start"] = self.clock()
+
+        # after-call-error is only given the exception and the context
+        context["trace_model"] = model
+
+    def record_call(self, model, context, error: str = None):
+        service = model.service_model.service_name
+        start = context.get("trace_start", self.clock())
+        span = self.new_span(
+            f"{service}.{model.name}",
+            "api",
+            start,
+            {"error": error} if error else {},
+        )
+        self.finish(span)
+        self.count("api_calls")
+        if error:
+            self.count("errors")
+
+    def after_call(self, http_response, parsed, model, context, **kwargs):
+        self.record_call(model, context, parsed.get("Error", {}).get("Code"))
+
+        retries = parsed.get("ResponseMetadata", {}).get("RetryAttempts", 0)
+        if retries:
+            self.count("retries", retries)
+
+    def after_call_error(self, exception, context, **kwargs):
+        self.record_call(context["trace_model"], context, type(exception).__name__)
+
+    def needs_retry(self, response=None, **kwargs):
+        # Only counts throttles, returning None leaves the retry decision to botocore
+        if response is not None:
+            code = response[1].get("Error", {}).get("Code")
+            if code in THROTTLING_CODES:
+                self.count("throttles")
+        return None
+
+    ######################## OUTPUT ########################
+
+    def chrome_trace(self):
+        # Complete ("X") events, timestamps in microseconds since the tracer started
+        events = []
+        for span in self.spans:
+            args = dict(span["args"])
+            for counter in ("api_calls", "retries", "throttles", "errors"):
+                if span["cat"] != "api":
+                    args[counter] = span[counter]
+            events.append(
+                {
+                    "name": span["name"],
+                    "cat": span["cat"],
+                    "ph": "X",
+                    "ts": (span["start"] - self.t0) * 1e6,
+                    "dur": (span["end"] - span["start"]) * 1e6,
+                    "pid": 1,
+                    "tid": span["tid"],
+                    "args": args,
+                }
+            )
+        return {"traceEvents": events, "otherData": {"totals": self.totals}}
+
+    def write(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.chrome_trace(), f, default=str)
+        print(f"\nTrace with {len(self.spans)} spans written to {path}.")
+
+    def summary(self, top: int = 10):
+        spans = [span for span in self.spans if span["cat"] != "api"]
+        spans.sort(key=lambda span: span["end"] - span["start"], reverse=True)
+
+        print(f"\nSlowest phases (top {top})")
+        print(
+            f"{'Phase':<45}{'Region':<12}{'Duration':>10}{'Calls':>7}{'Retries':>9}{'Throttles':>11}"
+        )
+        for span in spans[:top]:
+            region = span["args"].get("region") or "-"
+            duration = span["end"] - span["start"]
+            print(
+                f"{span['name']:<45}{region:<12}{duration:>9.1f}s{span['api_calls']:>7}{span['retries']:>9}{span['throttles']:>11}"
+            )
+
+        totals = self.totals
+        print(
+            f"\n{totals['api_calls']} API calls, {totals['retries']} retries, {totals['throttles']} throttles, {totals['errors']} errors."
+        )
@@ -0,0 +1,141 @@
+# Extra imports
+import asyncio
+from random import uniform
+from threading import Event
+from time import monotonic
+
+
+class WaitTimeout(Exception):
+    pass
+
+
+class WaitCancelled(Exception):
+    pass
+
+
+class WaitHandle:
+    def __init__(self):
+        # Event used both to sleep between polls and to cancel the wait
+        self.event = Event()
+
+    def cancel(self):
+        self.event.set()
+
+    @property
+    def cancelled(self):
+        return self.event.is_set()
+
+    def sleep(self, t: float):
+        # Returns early if the handle is cancelled while sleeping
+        self.event.wait(t)
+
+
+class FakeClock:
+    def __init__(self, start: float = 0.0):
+        self.now = start
+        self.slept = 0.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, t: float):
+        # Advances the clock instead of blocking
+        self.now += t
+        self.slept += t
+
+
+class Waiter:
+    def __init__(
+        self,
+        delay: float = 2,
+        max_delay: float = 15,
+        backoff: float = 2,
+        jitter: float = 0.1,
+        timeout: float = 900,
+        clock=None,
+    ):
+        # Polling configuration
+        self.delay = delay
+        self.max_delay = max_delay
+        self.backoff = backoff
+        self.jitter = jitter
+        self.timeout = timeout
+
+        # Clock used for deadlines and sleeping (a FakeClock in tests)
+        self.clock = clock
+
+    def now(self):
+        return self.clock.time() if self.clock else monotonic()
+
+    def pause(self, t: float, handle: WaitHandle):
+        if self.clock:
+            self.clock.sleep(t)
+        else:
+            handle.sleep(t)
+
+    def delays(self):
+        # Yields exponentially growing delays, capped and with +/- jitter
+        delay = self.delay
+        while True:
+            yield delay * (1 + uniform(-self.jitter, self.jitter))
+            delay = min(delay * self.backoff, self.max_delay)
+
+    def wait_until(
+        self,
+        condition,
+        name: str = "resource",
+        timeout: float = None,
+        handle: WaitHandle = None,
+    ):
+        # Each resource gets its own deadline
+        timeout = self.timeout if timeout is None else timeout
+        deadline = self.now() + timeout
+        handle = handle or WaitHandle()
+        delays = self.delays()
+
+        while True:
+            # Returns whatever the condition returned once it is truthy
+            result = condition()
+            if result:
+                return result
+
+            if handle.cancelled:
+                raise WaitCancelled(f"Wait for {name} was cancelled")
+
+            remaining = deadline - self.now()
+            if remaining <= 0:
+                raise WaitTimeout(f"Timed out after {timeout}s waiting for {name}")
+
+            self.pause(min(next(delays), remaining), handle)
+
+    async def wait_until_async(
+        self,
+        condition,
+        name: str = "resource",
+        timeout: float = None,
+        handle: WaitHandle = None,
+    ):
+        # Same as wait_until, but the condition runs in a thread and the
+        # event loop is free while sleeping
+        timeout = self.timeout if timeout is None else timeout
+        deadline = self.now() + timeout
+        handle = handle or WaitHandle()
+        delays = self.delays()
+
+        while True:
+            result = await asyncio.to_thread(condition)
+            if result:
+                return result
+
+            if handle.cancelled:
+                raise WaitCancelled(f"Wait for {name} was cancelled")
+
+            remaining = deadline - self.now()
+            if remaining <= 0:
+                raise WaitTimeout(f"Timed out after {timeout}s waiting for {name}")
+
+            delay = min(next(delays), remaining)
+            if self.clock:
+                self.clock.sleep(delay)
+            else:
+                await asyncio.sleep(delay)